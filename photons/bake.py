@@ -0,0 +1,289 @@
+import asyncio
+import mmap
+import struct
+import numpy as np
+
+from photons.eventloop import resolveLoop
+from photons.lights import LightArray2, DummyDriver, Promise
+from photons.virtualclock import virtualLoop
+
+
+class BakeFile:
+    """
+    Frame file format:
+
+    [Header][Frames][Index]
+
+    Header (little endian, 40 bytes):
+
+    [magic "PHBK"][version][flags][reserved][ledArraySize][numFrames][fps]
+    [loopStart][loopEnd][index_offset][reserved]
+    [4bytes][1byte][1byte][2bytes][4bytes][4bytes][float32]
+    [4bytes][4bytes][8bytes][4bytes]
+
+    Raw files (flags 0) store numFrames frames of ledArraySize x 3 bytes
+    right after the header and have no index.
+
+    Delta files (flags Delta) store one record per frame with only the
+    pixels that changed since the previous frame:
+
+    [count][ids][colors]
+    [4bytes][count * 4bytes][count * 3bytes]
+
+    The index is numFrames 8 byte offsets of those records.
+    """
+
+    magic = b"PHBK"
+    version = 1
+    header = struct.Struct('<4sBBHIIfIIQ4x')
+
+    Delta = 0x01
+
+
+class BakeWriter:
+    """writes frames to a BakeFile one at a time"""
+
+    def __init__(self, path, ledArraySize, fps, delta=False, loopStart=0,
+                 loopEnd=None):
+        self.file = open(path, 'wb')
+        self.ledArraySize = ledArraySize
+        self.fps = fps
+        self.delta = delta
+        self.loopStart = loopStart
+        self.loopEnd = loopEnd
+        self.numFrames = 0
+        self.offsets = []
+        self.previous = None
+
+        self.file.write(bytes(BakeFile.header.size))
+
+    def write(self, ledsData):
+        self.numFrames += 1
+
+        if not self.delta:
+            self.file.write(np.ascontiguousarray(ledsData, np.uint8).data)
+            return
+
+        if self.previous is None:
+            ids = np.arange(self.ledArraySize, dtype=np.uint32)
+            self.previous = np.array(ledsData, copy=True)
+        else:
+            ids = np.flatnonzero(np.any(ledsData != self.previous, axis=1))
+            ids = ids.astype(np.uint32)
+            self.previous[ids] = ledsData[ids]
+
+        self.offsets.append(self.file.tell())
+        self.file.write(struct.pack('<I', len(ids)))
+        self.file.write(ids.tobytes())
+        self.file.write(np.ascontiguousarray(ledsData[ids], np.uint8).data)
+
+    def close(self):
+        index_offset = 0
+        flags = 0
+
+        if self.delta:
+            flags |= BakeFile.Delta
+            index_offset = self.file.tell()
+            self.file.write(np.array(self.offsets, np.uint64).tobytes())
+
+        loopEnd = self.loopEnd
+
+        if loopEnd is None:
+            loopEnd = self.numFrames
+
+        self.file.seek(0)
+        self.file.write(BakeFile.header.pack(
+            BakeFile.magic, BakeFile.version, flags, 0, self.ledArraySize,
+            self.numFrames, self.fps, self.loopStart, loopEnd, index_offset))
+        self.file.close()
+
+
+class BakedAnimation:
+    """
+    Memory mapped BakeFile.  frame(index) of a raw file is a view into the
+    file.  Delta files are decoded into one persistent buffer, so reading
+    frames in order costs one fancy index assignment per frame.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, flags, _, self.ledArraySize, self.numFrames,
+         self.fps, self.loopStart, self.loopEnd,
+         index_offset) = BakeFile.header.unpack_from(self.mmap)
+
+        if magic != BakeFile.magic or version != BakeFile.version:
+            raise ValueError("{} is not a version {} bake file".format(
+                path, BakeFile.version))
+
+        self.delta = bool(flags & BakeFile.Delta)
+        data = np.frombuffer(self.mmap, np.uint8)
+
+        if not self.delta:
+            size = self.numFrames * self.ledArraySize * 3
+            self.frames = data[BakeFile.header.size:
+                               BakeFile.header.size + size].reshape(
+                self.numFrames, self.ledArraySize, 3)
+            return
+
+        self.data = data
+        self.offsets = np.frombuffer(self.mmap, np.uint64, self.numFrames,
+                                     index_offset)
+        self.current = np.zeros((self.ledArraySize, 3), np.uint8)
+        self.current_index = -1
+
+        # decoded state at the loop start, so looping doesn't replay from 0
+        self.loop_state = None
+
+    def __len__(self):
+        return self.numFrames
+
+    def _apply(self, index):
+        offset = int(self.offsets[index])
+        count = struct.unpack_from('<I', self.mmap, offset)[0]
+        offset += 4
+
+        ids = np.frombuffer(self.mmap, np.uint32, count, offset)
+        colors = self.data[offset + count * 4:
+                           offset + count * 7].reshape(count, 3)
+
+        self.current[ids] = colors
+        self.current_index = index
+
+    def frame(self, index):
+        if not self.delta:
+            return self.frames[index]
+
+        if index < self.current_index:
+            if self.loop_state is not None and index >= self.loopStart:
+                np.copyto(self.current, self.loop_state)
+                self.current_index = self.loopStart
+            else:
+                self.current_index = -1
+
+        while self.current_index < index:
+            self._apply(self.current_index + 1)
+
+            if self.current_index == self.loopStart:
+                self.loop_state = self.current.copy()
+
+        return self.current
+
+    def close(self):
+        self.frames = None
+        self.data = None
+        self.offsets = None
+        self.mmap.close()
+
+
+class BakedPlayer:
+    """
+    Plays a BakedAnimation into leds (LightArray2 or Matrix) at leds.fps.
+
+    speed scales playback (1.0 plays at the fps it was baked at).  Frames
+    in [loopStart, loopEnd) repeat forever if repeat is set; the defaults
+    come from the file.  promise is called when a non repeating playback
+    ends.
+    """
+
+    def __init__(self, leds, baked, speed=1.0, loopStart=None,
+                 loopEnd=None, repeat=True, loop=None):
+        self.leds = leds
+        self.baked = baked
+        self.speed = speed
+        self.repeat = repeat
+        self.loopStart = baked.loopStart if loopStart is None else loopStart
+        self.loopEnd = baked.loopEnd if loopEnd is None else loopEnd
+
+        if not 0 <= self.loopStart < self.loopEnd <= len(baked):
+            raise ValueError(
+                "loop [{}, {}) is not inside the {} baked frames".format(
+                    self.loopStart, self.loopEnd, len(baked)))
+
+        self.position = 0.0
+        self.running = False
+        self.promise = Promise()
+        self.loop = resolveLoop(loop)
+        self.task = None
+
+    def start(self):
+        self.running = True
+        self.task = self.loop.create_task(self._run())
+
+        return self.promise
+
+    def stop(self):
+        """stop playing.  The promise is still called"""
+        self.running = False
+
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        try:
+            await self._play()
+        finally:
+            self.running = False
+            self.promise.call()
+
+    async def _play(self):
+        while self.running:
+            index = int(self.position)
+
+            if index >= self.loopEnd:
+                if not self.repeat:
+                    break
+
+                length = self.loopEnd - self.loopStart
+                self.position = self.loopStart + \
+                    (self.position - self.loopEnd) % length
+                index = int(self.position)
+
+            np.copyto(self.leds.ledsData, self.baked.frame(index))
+            self.leds.update()
+
+            self.position += self.speed * self.baked.fps / self.leds.fps
+
+            await asyncio.sleep(1.0 / self.leds.fps)
+
+
+def bake(animation, ledArraySize, numFrames, path, fps=30, delta=False,
+         loopStart=0, loopEnd=None):
+    """
+    Render numFrames frames of an animation offscreen and store them in a
+    BakeFile at path.
+
+    animation(leds) is called with an offscreen LightArray2 once the
+    offscreen loop runs.  It may return a coroutine (run as a task), a
+    Promise (eg. from BaseAnimation.start()) or nothing.  Time is virtual,
+    so baking runs as fast as the animation renders, not in real time.
+    Frames are sampled at fps, half a frame after each tick so they never
+    race the animation's own timers.
+    """
+
+    writer = BakeWriter(path, ledArraySize, fps, delta, loopStart, loopEnd)
+
+    try:
+        with virtualLoop() as loop:
+            leds = LightArray2(ledArraySize, DummyDriver(), fps=fps, loop=loop)
+
+            def start():
+                ret = animation(leds)
+
+                if asyncio.iscoroutine(ret):
+                    loop.create_task(ret)
+
+            async def sample():
+                await asyncio.sleep(0.5 / fps)
+
+                for i in range(numFrames):
+                    writer.write(leds.ledsData)
+                    await asyncio.sleep(1.0 / fps)
+
+            loop.call_soon(start)
+            loop.run_until_complete(sample())
+
+    finally:
+        writer.close()
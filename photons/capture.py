@@ -0,0 +1,226 @@
+import asyncio
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+import numpy as np
+
+from photons.lights import BaseDriver
+
+
+class CaptureFile:
+    """
+    Frame log written by CaptureDriver.
+
+    <path>: appended frame records
+
+    [timestamp][numLeds][r][g][b]...
+    [float64][uint32][numLeds * 3 bytes]
+
+    <path>.idx: one entry per record
+
+    [offset][timestamp][numLeds]
+    [uint64][float64][uint32]
+    """
+
+    record = struct.Struct('<dI')
+    indexDtype = np.dtype([('offset', '<u8'), ('timestamp', '<f8'),
+                           ('numLeds', '<u4')])
+
+    @staticmethod
+    def indexPath(path):
+        return path + ".idx"
+
+
+def writeImage(path, image):
+    """write a HxWx3 RGB image as .ppm or (anything else) .png"""
+    image = np.ascontiguousarray(image, np.uint8)
+    height, width = image.shape[:2]
+
+    if path.endswith(".ppm"):
+        with open(path, 'wb') as f:
+            f.write("P6 {} {} 255\n".format(width, height).encode())
+            f.write(image.data)
+        return
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + \
+            struct.pack('>I', zlib.crc32(kind + data))
+
+    # every row starts with filter type 0
+    rows = np.zeros((height, width * 3 + 1), np.uint8)
+    rows[:, 1:] = image.reshape(height, width * 3)
+
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                           8, 2, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)))
+        f.write(chunk(b'IEND', b''))
+
+
+class CaptureDriver(BaseDriver):
+    """
+    Headless driver that records every frame with its timestamp to a
+    CaptureFile.
+
+    update() only copies the frame into a pending list.  A background
+    thread appends pending frames to the log every flush_interval seconds,
+    so recording is cheap enough to leave on.  Wrap another driver with
+    "driver" to record and output at the same time.
+    """
+
+    def __init__(self, path="capture.log", flush_interval=1.0, driver=None,
+                 debug=False, **kwargs):
+        BaseDriver.__init__(self)
+        self.path = path
+        self.debug = debug
+        self.driver = driver
+        self.flush_interval = flush_interval
+
+        self.file = open(path, 'ab')
+        self.index = open(CaptureFile.indexPath(path), 'ab')
+        self.offset = self.file.tell()
+
+        self.pending = []
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+
+        self.thread = threading.Thread(target=self._flushLoop, daemon=True)
+        self.thread.start()
+
+    def update(self, ledsData, force=False):
+        frame = (time.time(), len(ledsData), ledsData.tobytes())
+
+        with self.lock:
+            self.pending.append(frame)
+
+        if self.driver:
+            self.driver.update(ledsData, force)
+
+    def _flushLoop(self):
+        while not self.closed.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+
+        if not pending:
+            return
+
+        index = np.empty(len(pending), CaptureFile.indexDtype)
+        records = []
+
+        for i, (timestamp, numLeds, frame) in enumerate(pending):
+            index[i] = (self.offset, timestamp, numLeds)
+            records.append(CaptureFile.record.pack(timestamp, numLeds))
+            records.append(frame)
+            self.offset += CaptureFile.record.size + len(frame)
+
+        self.file.write(b''.join(records))
+        self.file.flush()
+        self.index.write(index.tobytes())
+        self.index.flush()
+
+        if self.debug:
+            print("CaptureDriver: wrote {} frames".format(len(pending)))
+
+    def close(self):
+        self.closed.set()
+        self.thread.join()
+        self.flush()
+        self.file.close()
+        self.index.close()
+
+
+class CaptureReader:
+    """
+    Reads a CaptureFile.  frame(i) is a view into the memory mapped log.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index = np.fromfile(CaptureFile.indexPath(path),
+                                 CaptureFile.indexDtype)
+        self.mmap = None
+        self.data = np.zeros(0, np.uint8)
+
+        if os.path.getsize(path):
+            with open(path, 'rb') as f:
+                self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            self.data = np.frombuffer(self.mmap, np.uint8)
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def timestamps(self):
+        return self.index['timestamp']
+
+    def frame(self, i):
+        offset, timestamp, numLeds = self.index[i]
+        start = int(offset) + CaptureFile.record.size
+
+        return self.data[start:start + int(numLeds) * 3].reshape(-1, 3)
+
+    def frames(self, start=0, stop=None):
+        for i in range(start, len(self) if stop is None else stop):
+            yield self.frame(i)
+
+    def diff(self, other):
+        """
+        number of pixels that differ in each frame of self and other (an
+        other CaptureReader), frame by frame.  Frames of different sizes
+        count as entirely different.
+        """
+        count = min(len(self), len(other))
+        changed = np.zeros(count, np.int64)
+
+        for i in range(count):
+            a = self.frame(i)
+            b = other.frame(i)
+
+            if a.shape != b.shape:
+                changed[i] = max(len(a), len(b))
+            else:
+                changed[i] = np.count_nonzero(np.any(a != b, axis=1))
+
+        return changed
+
+    def waterfall(self, path, start=0, stop=None):
+        """
+        write frames [start, stop) as an image: one row per frame, one
+        column per pixel (.ppm or .png)
+        """
+        frames = list(self.frames(start, stop))
+        width = max(len(frame) for frame in frames)
+
+        image = np.zeros((len(frames), width, 3), np.uint8)
+
+        for row, frame in enumerate(frames):
+            image[row, :len(frame)] = frame
+
+        writeImage(path, image)
+
+    async def replay(self, leds, speed=1.0, start=0, stop=None):
+        """play the frames into leds with the recorded timing"""
+        if stop is None:
+            stop = len(self)
+
+        for i in range(start, stop):
+            np.copyto(leds.ledsData, self.frame(i))
+            leds.update()
+
+            if i + 1 < stop:
+                delay = self.timestamps[i + 1] - self.timestamps[i]
+                await asyncio.sleep(max(delay, 0) / speed)
+
+    def close(self):
+        self.data = None
+
+        if self.mmap:
+            self.mmap.close()
@@ -0,0 +1,80 @@
+"""
+Event loop helpers.
+
+Nothing in photons looks up the event loop at import time.  Objects take
+an optional loop and resolve it when they are created, and the tasks they
+start are kept in a TaskSet so stop() can cancel them.
+
+uvloop is used for new loops if it is installed and asked for:
+
+    loop = newEventLoop(uvloop=True)
+    asyncio.set_event_loop(loop)
+"""
+
+import asyncio
+import warnings
+
+
+def newEventLoop(uvloop=False):
+    """a new event loop.  uvloop's if uvloop and it is installed"""
+    if uvloop:
+        try:
+            import uvloop as _uvloop
+            return _uvloop.new_event_loop()
+        except ImportError:
+            print("uvloop not available.  Using asyncio's event loop")
+
+    return asyncio.new_event_loop()
+
+
+def currentLoop():
+    """the running loop, else the loop set for this thread, else None"""
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+
+        try:
+            return asyncio.get_event_loop()
+        except RuntimeError:
+            return None
+
+
+def resolveLoop(loop=None):
+    """loop if given, else the current loop.  One is made if there is none"""
+    if loop is not None:
+        return loop
+
+    loop = currentLoop()
+
+    if loop is None:
+        loop = newEventLoop()
+        asyncio.set_event_loop(loop)
+
+    return loop
+
+
+class TaskSet:
+    """the tasks an object started on its loop.  Finished ones drop out"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.tasks = set()
+
+    def create(self, coro):
+        task = self.loop.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+        return task
+
+    def cancel(self):
+        """cancel every task.  They finish on the next loop iteration"""
+        for task in list(self.tasks):
+            task.cancel()
+
+    def __len__(self):
+        return len(self.tasks)
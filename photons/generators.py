@@ -0,0 +1,160 @@
+"""
+Vectorized color generators.  Each builds a whole strip of colors
+((n, 3) uint8 arrays, like LightArray2.ledsData) in one NumPy call.
+
+Frames returned by the cached generators are shared and read only.
+Shift them with shifted() or copy them before modifying.
+"""
+
+import functools
+import numpy as np
+
+
+def _readOnly(array):
+    array.setflags(write=False)
+    return array
+
+
+def wavelengthToRGB(wavelength, gamma=0.80, intensityMax=255):
+    """
+    color of light with the given wavelength(s) in nm.  Taken from Earl F.
+    Glynn's web page:
+    <a href="http://www.efg2.com/Lab/ScienceAndEngineering/Spectra.htm">Spectra Lab Report</a>
+
+    Accepts a scalar or an array and returns (..., 3) uint8 colors.
+    """
+    w = np.asarray(wavelength, np.float64)
+
+    bands = [(w >= 380) & (w < 440),
+             (w >= 440) & (w < 490),
+             (w >= 490) & (w < 510),
+             (w >= 510) & (w < 580),
+             (w >= 580) & (w < 645),
+             (w >= 645) & (w < 781)]
+
+    r = np.select(bands, [-(w - 440) / (440.0 - 380.0), 0.0, 0.0,
+                          (w - 510) / (580.0 - 510.0), 1.0, 1.0], 0.0)
+    g = np.select(bands, [0.0, (w - 440) / (490.0 - 440.0), 1.0, 1.0,
+                          -(w - 645) / (645.0 - 580.0), 0.0], 0.0)
+    b = np.select(bands, [1.0, 1.0, -(w - 510) / (510.0 - 490.0),
+                          0.0, 0.0, 0.0], 0.0)
+
+    # Let the intensity fall off near the vision limits
+    factor = np.select([(w >= 380) & (w < 420),
+                        (w >= 420) & (w < 701),
+                        (w >= 701) & (w < 781)],
+                       [0.3 + 0.7 * (w - 380) / (420.0 - 380.0),
+                        1.0,
+                        0.3 + 0.7 * (780 - w) / (780.0 - 700.0)], 0.0)
+
+    rgb = np.stack([r, g, b], axis=-1) * factor[..., None]
+
+    return np.rint(intensityMax * rgb ** gamma).astype(np.uint8)
+
+
+@functools.lru_cache(maxsize=32)
+def spectrum(n, start=780, end=380):
+    """
+    n colors of the visible spectrum from wavelength start to end.  Memoized,
+    so the wavelength mapping only runs once per strip size.
+    """
+    wavelengths = start + np.arange(n) * (end - start) / n
+
+    return _readOnly(wavelengthToRGB(wavelengths))
+
+
+def hsvToRGB(h, s, v):
+    """h, s and v (arrays) in 0-1 to (..., 3) uint8 colors"""
+    h, s, v = np.broadcast_arrays(np.asarray(h, np.float64) % 1.0, s, v)
+
+    i = np.floor(h * 6).astype(int) % 6
+    f = h * 6 - np.floor(h * 6)
+    p = v * (1 - s)
+    q = v * (1 - s * f)
+    t = v * (1 - s * (1 - f))
+
+    r = np.choose(i, [v, q, p, p, t, v])
+    g = np.choose(i, [t, v, v, q, p, p])
+    b = np.choose(i, [p, p, t, v, v, q])
+
+    return np.rint(np.stack([r, g, b], axis=-1) * 255).astype(np.uint8)
+
+
+@functools.lru_cache(maxsize=32)
+def hsvRainbow(n, saturation=1.0, value=1.0):
+    """n colors around the hue circle.  Memoized"""
+    return _readOnly(hsvToRGB(np.arange(n) / n, saturation, value))
+
+
+def gradient(n, colors, positions=None):
+    """
+    n colors blending linearly through "colors".  positions (0-1, one per
+    color) default to evenly spaced.
+    """
+    colors = np.asarray(colors, np.float64)
+
+    if positions is None:
+        positions = np.linspace(0, 1, len(colors))
+
+    x = np.linspace(0, 1, n)
+    channels = [np.interp(x, positions, colors[:, c]) for c in range(3)]
+
+    return np.rint(np.stack(channels, axis=-1)).astype(np.uint8)
+
+
+@functools.lru_cache(maxsize=32)
+def _paletteTable(colors, positions):
+    return _readOnly(gradient(256, colors, positions))
+
+
+def palette(values, colors, positions=None):
+    """
+    map values in 0-1 to colors of a gradient palette.  The palette is
+    built once as a 256 entry lookup table and indexed per pixel.
+    """
+    colors = tuple(map(tuple, np.asarray(colors).tolist()))
+
+    if positions is not None:
+        positions = tuple(positions)
+
+    table = _paletteTable(colors, positions)
+    index = np.clip(np.rint(np.asarray(values) * 255), 0, 255).astype(int)
+
+    return table[index]
+
+
+@functools.lru_cache(maxsize=32)
+def _noiseLattice(seed, size):
+    return _readOnly(np.random.default_rng(seed).random(size))
+
+
+def noise(n, scale=16.0, offset=0.0, octaves=1, seed=0):
+    """
+    smooth 1d value noise in 0-1 for n pixels.  scale is the feature size
+    in pixels.  Animate by moving offset (in pixels).
+    """
+    total = np.zeros(n)
+    amplitude = 1.0
+    norm = 0.0
+
+    for octave in range(octaves):
+        x = (np.arange(n) + offset) / scale
+        cell = np.floor(x).astype(int)
+        t = x - cell
+        t = t * t * (3 - 2 * t)
+
+        lattice = _noiseLattice(seed + octave, 256)
+        a = lattice[cell % 256]
+        b = lattice[(cell + 1) % 256]
+
+        total += amplitude * (a + (b - a) * t)
+        norm += amplitude
+        amplitude /= 2
+        scale /= 2
+
+    return total / norm
+
+
+def shifted(frame, offset):
+    """frame rotated along the strip by offset pixels"""
+    return np.roll(frame, offset, axis=0)
@@ -0,0 +1,240 @@
+"""
+Opt-in performance instrumentation.
+
+Hot paths record into the module level "metrics" like this:
+
+    started = metrics.start()
+    ...
+    metrics.observe("encode_seconds", started)
+
+start() returns None while metrics are disabled and every recording call
+returns right away, so the cost when disabled is one attribute check.
+
+Enable with metrics.enable() and read with metrics.snapshot(),
+metrics.toJson() or metrics.toPrometheus().  Servers started through
+server_main() serve them over HTTP with --metrics-port.
+"""
+
+import asyncio
+import bisect
+import json
+import time
+
+from photons.eventloop import resolveLoop
+
+
+# seconds: 1us to ~8s.  sizes: 16 bytes to 1MB
+timeBuckets = [1e-6 * 2 ** i for i in range(24)]
+sizeBuckets = [2 ** i for i in range(4, 21)]
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """upper bound of the bucket holding the q quantile"""
+        if not self.count:
+            return 0.0
+
+        rank = q * self.count
+        total = 0
+
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+
+        return float("inf")
+
+    def snapshot(self):
+        return {"count": self.count,
+                "sum": self.sum,
+                "p50": self.quantile(0.5),
+                "p99": self.quantile(0.99),
+                "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"],
+                                    self.counts))}
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def _labelText(labels, extra=None):
+    labels = list(labels)
+
+    if extra:
+        labels.append(extra)
+
+    if not labels:
+        return ""
+
+    return "{" + ",".join('{}="{}"'.format(k, v) for k, v in labels) + "}"
+
+
+class Metrics:
+
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def reset(self):
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def start(self):
+        """timestamp for observe() or None if disabled"""
+        if not self.enabled:
+            return None
+
+        return time.perf_counter()
+
+    def observe(self, name, started, **labels):
+        """record the seconds since started (from start())"""
+        if started is None:
+            return
+
+        self.observeValue(name, time.perf_counter() - started, timeBuckets,
+                          **labels)
+
+    def observeValue(self, name, value, buckets=sizeBuckets, **labels):
+        if not self.enabled:
+            return
+
+        key = _key(name, labels)
+        histogram = self.histograms.get(key)
+
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(buckets)
+
+        histogram.observe(value)
+
+    def count(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+
+        key = _key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        if not self.enabled:
+            return
+
+        self.gauges[_key(name, labels)] = value
+
+    def snapshot(self):
+        def entries(values, convert=lambda v: v):
+            return [{"name": name, "labels": dict(labels),
+                     "value": convert(value)}
+                    for (name, labels), value in sorted(values.items())]
+
+        return {"histograms": entries(self.histograms,
+                                      lambda h: h.snapshot()),
+                "counters": entries(self.counters),
+                "gauges": entries(self.gauges)}
+
+    def toJson(self):
+        return json.dumps(self.snapshot())
+
+    def toPrometheus(self, prefix="photons_"):
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE {} {}".format(name, kind))
+
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            name = prefix + name
+            header(name, "histogram")
+            total = 0
+
+            for bound, count in zip(histogram.buckets + ["+Inf"],
+                                    histogram.counts):
+                total += count
+                lines.append("{}_bucket{} {}".format(
+                    name, _labelText(labels, ("le", bound)), total))
+
+            lines.append("{}_sum{} {}".format(name, _labelText(labels),
+                                              histogram.sum))
+            lines.append("{}_count{} {}".format(name, _labelText(labels),
+                                                histogram.count))
+
+        for kind, values in (("counter", self.counters),
+                             ("gauge", self.gauges)):
+            for (name, labels), value in sorted(values.items()):
+                name = prefix + name
+                header(name, kind)
+                lines.append("{}{} {}".format(name, _labelText(labels),
+                                              value))
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class MetricsServer(asyncio.Protocol):
+    """
+    Minimal HTTP endpoint.  GET /metrics.json returns JSON, any other path
+    the Prometheus text format.
+    """
+
+    """longest request accepted.  Longer ones are dropped unanswered"""
+    max_request_length = 8192
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.request = bytearray()
+
+    def data_received(self, data):
+        self.request.extend(data)
+
+        if b"\r\n\r\n" not in self.request and b"\n\n" not in self.request:
+            if len(self.request) > self.max_request_length:
+                self.request = bytearray()
+                self.transport.close()
+
+            return
+
+        line = self.request.split(b"\n", 1)[0].split()
+        path = line[1].decode() if len(line) > 1 else "/"
+
+        if path.endswith(".json"):
+            body = metrics.toJson()
+            content_type = "application/json"
+        else:
+            body = metrics.toPrometheus()
+            content_type = "text/plain; version=0.0.4"
+
+        body = body.encode()
+
+        self.transport.write(
+            "HTTP/1.0 200 OK\r\nContent-Type: {}\r\n"
+            "Content-Length: {}\r\n\r\n".format(content_type,
+                                                len(body)).encode() + body)
+        self.transport.close()
+
+
+def startMetricsServer(port, iface="0.0.0.0", loop=None):
+    """enable metrics and serve them on port.  Returns the server"""
+    loop = resolveLoop(loop)
+
+    metrics.enable()
+
+    return loop.run_until_complete(
+        loop.create_server(MetricsServer, host=iface, port=port))
@@ -0,0 +1,221 @@
+import asyncio
+import numpy as np
+
+from photons.eventloop import resolveLoop
+from photons.instrumentation import metrics
+
+
+class BlendMode:
+    Alpha = "alpha"
+    Add = "add"
+    Multiply = "multiply"
+    Max = "max"
+
+
+class Layer:
+    """
+    One effect's output.  colors are float32 0-255, alpha is an optional
+    per pixel coverage (0-1) on top of opacity.
+
+    Call changed() after writing colors or alpha, or override render() to
+    redraw every frame.  Layers that don't change are not composited again.
+    """
+
+    def __init__(self, ledArraySize, blend=BlendMode.Alpha, opacity=1.0,
+                 alpha=False):
+        self.colors = np.zeros((ledArraySize, 3), np.float32)
+        self.alpha = None
+
+        if alpha:
+            self.alpha = np.ones((ledArraySize, 1), np.float32)
+
+        self._blend = blend
+        self._opacity = opacity
+        self._visible = True
+        self.dirty = True
+
+    def changed(self):
+        self.dirty = True
+
+    def render(self):
+        """called every frame before compositing.  Override for effects"""
+        pass
+
+    @property
+    def blend(self):
+        return self._blend
+
+    @blend.setter
+    def blend(self, blend):
+        self._blend = blend
+        self.dirty = True
+
+    @property
+    def opacity(self):
+        return self._opacity
+
+    @opacity.setter
+    def opacity(self, opacity):
+        self._opacity = opacity
+        self.dirty = True
+
+    @property
+    def visible(self):
+        return self._visible
+
+    @visible.setter
+    def visible(self, visible):
+        self._visible = visible
+        self.dirty = True
+
+    def fill(self, color):
+        self.colors[:] = color
+        self.dirty = True
+
+    def setColors(self, colors, startId=0):
+        self.colors[startId:startId + len(colors)] = colors
+        self.dirty = True
+
+
+class LayerStack:
+    """
+    Composites layers bottom to top into leds (LightArray2 or Matrix).
+
+    The composite after every layer is kept, so a frame only recomposites
+    from the lowest changed layer upwards.  Static backgrounds below
+    animated layers cost nothing per frame, and a frame where nothing
+    changed doesn't touch leds at all.
+    """
+
+    def __init__(self, leds, loop=None):
+        self.leds = leds
+        self.layers = []
+        self.composites = []
+        self.running = False
+
+        # lowest index to recomposite from even if no layer is dirty
+        self._recomposite = None
+        self.loop = resolveLoop(loop)
+        self.task = None
+
+        self._empty = np.zeros((leds.ledArraySize, 3), np.float32)
+        self._weight = np.empty((leds.ledArraySize, 1), np.float32)
+        self._scratch = np.empty((leds.ledArraySize, 3), np.float32)
+        self._frame = np.empty((leds.ledArraySize, 3), np.uint8)
+
+    def addLayer(self, layer=None, **kwargs):
+        """add layer (or a new Layer(**kwargs)) on top.  Returns the layer"""
+        if layer is None:
+            layer = Layer(self.leds.ledArraySize, **kwargs)
+
+        self.layers.append(layer)
+        self.composites.append(np.empty_like(self._empty))
+        layer.dirty = True
+
+        return layer
+
+    def removeLayer(self, layer):
+        index = self.layers.index(layer)
+
+        del self.layers[index]
+        del self.composites[index]
+
+        # what was above the removed layer, or nothing, shows through now
+        if self._recomposite is None or index < self._recomposite:
+            self._recomposite = index
+
+    def _blend(self, base, layer, out):
+        weight = layer.opacity
+
+        if layer.alpha is not None:
+            weight = np.multiply(layer.alpha, layer.opacity, out=self._weight)
+
+        top = layer.colors
+        scratch = self._scratch
+
+        if layer.blend == BlendMode.Add:
+            np.multiply(top, weight, out=scratch)
+            np.add(base, scratch, out=out)
+            return
+
+        if layer.blend == BlendMode.Multiply:
+            # base * (1 + (top / 255 - 1) * weight)
+            np.multiply(top, 1.0 / 255, out=scratch)
+            scratch -= 1
+            scratch *= weight
+            scratch += 1
+            np.multiply(base, scratch, out=out)
+            return
+
+        if layer.blend == BlendMode.Max:
+            np.maximum(base, top, out=scratch)
+        elif layer.blend == BlendMode.Alpha:
+            np.copyto(scratch, top)
+        else:
+            raise ValueError("unknown blend mode {}".format(layer.blend))
+
+        # base + (blended - base) * weight
+        scratch -= base
+        scratch *= weight
+        np.add(base, scratch, out=out)
+
+    def flatten(self):
+        """composite changed layers into leds.  Returns False if nothing
+           changed"""
+        for layer in self.layers:
+            layer.render()
+
+        start = self._recomposite
+
+        for index, layer in enumerate(self.layers[:start]):
+            if layer.dirty:
+                start = index
+                break
+
+        if start is None:
+            return False
+
+        self._recomposite = None
+
+        started = metrics.start()
+
+        base = self.composites[start - 1] if start else self._empty
+
+        for index in range(start, len(self.layers)):
+            layer = self.layers[index]
+            out = self.composites[index]
+
+            if layer.visible:
+                self._blend(base, layer, out)
+            else:
+                np.copyto(out, base)
+
+            layer.dirty = False
+            base = out
+
+        frame = np.clip(base, 0, 255, out=self._scratch)
+        np.rint(frame, out=frame)
+        np.copyto(self._frame, frame, casting='unsafe')
+
+        self.leds.changeColors(0, self._frame)
+
+        metrics.observe("composite_seconds", started)
+
+        return True
+
+    def start(self):
+        self.running = True
+        self.task = self.loop.create_task(self._run())
+
+    def stop(self):
+        self.running = False
+
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        while self.running:
+            self.flatten()
+
+            await asyncio.sleep(1.0 / self.leds.fps)
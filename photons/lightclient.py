@@ -5,7 +5,12 @@ import binascii
 import sys
 import traceback
 
-from photons.lightprotocol import LightProtocol
+import numpy as np
+
+from photons.eventloop import resolveLoop, TaskSet
+from photons.instrumentation import metrics
+from photons.lightprotocol import LightProtocol, LightProtocolException, \
+    IncompatibleProtocolException, InvalidMessageLength
 
 
 class DebugPrinter:
@@ -23,10 +28,8 @@ class ReconnectAsyncio(DebugPrinter):
         DebugPrinter.__init__(self, debug)
         self.address = None
         self.retry = retry
-        self.loop = loop
-
-        if not loop:
-            self.loop = asyncio.get_event_loop()
+        self.loop = resolveLoop(loop)
+        self.tasks = TaskSet(self.loop)
 
     def _connect(self):
         raise Exception(
@@ -34,14 +37,13 @@ class ReconnectAsyncio(DebugPrinter):
 
     def _do_connect(self):
         if self.retry:
-            self.loop.create_task(self._connect_retry())
+            self.tasks.create(self._connect_retry())
         else:
-            self.loop.create_task(self._connect_once())
+            self.tasks.create(self._connect_once())
 
-    @asyncio.coroutine
-    def _connect_once(self):
+    async def _connect_once(self):
         try:
-            yield from self._connect()
+            await self._connect()
 
         except ConnectionRefusedError:
             self.print_debug("connection refused ({})".format(self.address))
@@ -56,15 +58,14 @@ class ReconnectAsyncio(DebugPrinter):
                                       file=sys.stdout)
             self.print_debug("connection failed ({})".format(self.address))
 
-    @asyncio.coroutine
-    def _connect_retry(self):
+    async def _connect_retry(self):
         timeout = 5
         maxtimeout = 60
 
         while True:
             try:
                 self.print_debug("connecting...")
-                yield from self._connect()
+                await self._connect()
 
                 self.print_debug("connected!")
                 return
@@ -73,7 +74,7 @@ class ReconnectAsyncio(DebugPrinter):
                 self.print_debug(
                     "connection refused ({}). retry in {} seconds...".format(
                         self.address, timeout))
-                yield from asyncio.sleep(timeout)
+                await asyncio.sleep(timeout)
                 if timeout < maxtimeout:
                     timeout += 2
 
@@ -83,7 +84,7 @@ class ReconnectAsyncio(DebugPrinter):
                 self.print_debug(
                     "connection failed ({}). retry in {} seconds...".format(
                         self.address, timeout))
-                yield from asyncio.sleep(timeout)
+                await asyncio.sleep(timeout)
 
                 if timeout < maxtimeout:
                     timeout += 2
@@ -100,15 +101,47 @@ class ReconnectAsyncio(DebugPrinter):
 
 class LightClient(asyncio.Protocol, LightProtocol, ReconnectAsyncio):
 
-    def __init__(self, host=None, port=None, loop=asyncio.get_event_loop(),
+    def __init__(self, host=None, port=None, loop=None,
                  debug=False, onConnected=None, onDisconnected=None,
-                 fps=60, compression=False):
+                 fps=60, compression=False, latest_frame=False,
+                 write_buffer_limits=None, resync=False, resync_timeout=1.0):
+        """
+        latest_frame: keep a shadow framebuffer instead of queueing every
+                      command.  Each send tick only the difference between
+                      the last sent frame and the newest frame is sent.
+                      Intermediate frames are collapsed so memory stays
+                      bounded and latency is at most one frame.
+
+        compression: compress payloads.  True for deflate or one of
+                     LightProtocolFlags.  Uses protocol version 2, which
+                     needs a version 2 server.
+
+                     Changed meaning: LightClientUdp's compression used to
+                     turn on run-length encoding, which is now always
+                     used when it is smaller.  compression=True now sends
+                     version 2 headers that version 1 servers reject, so
+                     old callers passing it should drop it.
+
+        write_buffer_limits: (high, low) water marks in bytes passed to the
+                             transport.  When the transport buffer rises
+                             above high, frames are coalesced until it
+                             drains below low.
+
+        resync: on (re)connect ask the server for its frame (GetFrame) so
+                update() can keep sending true deltas instead of a full
+                frame.  With a baseline only its hash is checked.  In
+                latest_frame mode frames are held until the reply, or
+                resync_timeout seconds.  Needs a server that knows
+                GetFrame.
+        """
 
         LightProtocol.__init__(self, debug=debug)
-        ReconnectAsyncio.__init__(self, retry=True)
+        self.setCompression(compression)
+        ReconnectAsyncio.__init__(self, retry=True, loop=loop)
         self.reader = None
         self.writer = None
-        self.loop = loop
+        self.addy = None
+        self.port = None
         self.debug = debug
         self.connected = False
         self.fps = fps
@@ -118,20 +151,54 @@ class LightClient(asyncio.Protocol, LightProtocol, ReconnectAsyncio):
 
         self.send_queue = asyncio.Queue()
 
-        self.loop.create_task(self._process_send())
+        self.latest_frame = latest_frame
+        self.shadow_frame = None
+        self.frame_pending = False
+
+        self.write_buffer_limits = write_buffer_limits
+        self.writing_paused = False
+        self.pause_count = 0
+        self.paused_time = 0.0
+        self._pause_started = None
+
+        self.resync = resync
+        self.resync_timeout = resync_timeout
+        self.resync_pending = False
+        self._resync_started = None
+        self._resync_update_count = 0
+        self._resync_baseline = None
+        self._resync_hash_only = False
+
+        self.receive_buffer = bytearray()
+        self.onFrameSnapshot = self._onFrameSnapshot
+        self.onFrameHash = self._onFrameHash
+
+        self.tasks.create(self._process_send())
 
         if host and port:
             self.connectTo(host, port)
 
-    @asyncio.coroutine
-    def _connect(self):
-        yield from asyncio.get_event_loop().create_connection(
-            lambda: self,
-            self.addy, self.port)
+    def close(self):
+        """stop sending and reconnecting and close the connection"""
+        self.tasks.cancel()
+
+        if self.writer:
+            self.writer.close()
+
+    async def _connect(self):
+        await self.loop.create_connection(lambda: self, self.addy, self.port)
 
     def connection_made(self, transport):
         self.writer = transport
         self.connected = True
+
+        if self.write_buffer_limits:
+            high, low = self.write_buffer_limits
+            transport.set_write_buffer_limits(high=high, low=low)
+
+        if self.resync:
+            self.requestResync()
+
         if self.onConnected:
             self.onConnected()
 
@@ -139,7 +206,131 @@ class LightClient(asyncio.Protocol, LightProtocol, ReconnectAsyncio):
         self._onDisconnected()
 
     def data_received(self, data):
-        pass
+        self.receive_buffer.extend(data)
+
+        while True:
+            try:
+                length = LightProtocol.frameLength(self.receive_buffer)
+            except IncompatibleProtocolException:
+                self.receive_buffer = bytearray()
+                return
+
+            if length is None or len(self.receive_buffer) < length:
+                return
+
+            frame = self.receive_buffer[:length]
+            del self.receive_buffer[:length]
+
+            self._parseReply(frame)
+
+    def _parseReply(self, frame):
+        try:
+            self.parse(frame)
+        except Exception as ex:
+            self.print_debug("failed to parse reply: {}".format(ex))
+
+    def requestResync(self):
+        """
+        check our diff baseline against the server.  Only a hash is asked
+        for if we have a baseline, the whole frame otherwise.
+        """
+        self.resync_pending = True
+        self._resync_started = self.loop.time()
+        self._resync_update_count = self.update_count
+
+        if self.ledsDataCopy is not None:
+            self._resync_baseline = np.array(self.ledsDataCopy, copy=True)
+            self._resync_hash_only = True
+        else:
+            self._resync_baseline = None
+            self._resync_hash_only = False
+
+        self.getFrame(self._resync_hash_only)
+
+    def _endResync(self, baseline):
+        self.resync_pending = False
+        self._resync_baseline = None
+
+        # anything encoded since the request was against the old baseline
+        if self.update_count != self._resync_update_count:
+            baseline = None
+
+        self.ledsDataCopy = baseline
+
+        self.print_debug("resync {}".format(
+            "done" if baseline is not None else "failed. sending full frame"))
+
+    def _onFrameSnapshot(self, frame):
+        if not self.resync_pending:
+            return
+
+        self._endResync(np.array(frame, copy=True))
+
+    def _onFrameHash(self, numLeds, digest):
+        if not self.resync_pending:
+            return
+
+        baseline = self._resync_baseline
+
+        if baseline is not None and len(baseline) == numLeds and \
+                self.hashFrame(baseline) == digest:
+            self.resync_pending = False
+            self._resync_baseline = None
+            return
+
+        if self._resync_hash_only and \
+                self.update_count == self._resync_update_count:
+            # our baseline is wrong.  Ask for the real one
+            self._resync_hash_only = False
+            self.getFrame()
+            return
+
+        self._endResync(None)
+
+    def pause_writing(self):
+        """called by the transport when its buffer is above the high mark"""
+        self.print_debug("write buffer full. pausing ({})".format(
+            self.write_buffer_size))
+        self.writing_paused = True
+        self.pause_count += 1
+        self._pause_started = self.loop.time()
+
+    def resume_writing(self):
+        """called by the transport when its buffer drained below the low mark.
+           Everything that changed while paused goes out as a single diff"""
+        self.writing_paused = False
+
+        if self._pause_started is not None:
+            self.paused_time += self.loop.time() - self._pause_started
+            self._pause_started = None
+
+        if not self.connected:
+            return
+
+        if self.frame_pending:
+            self._send_frame()
+        else:
+            self.flush()
+
+    @property
+    def write_buffer_size(self):
+        if not self.writer:
+            return 0
+
+        return self.writer.get_write_buffer_size()
+
+    def write_stats(self):
+        """flow control statistics for this connection"""
+        paused_time = self.paused_time
+
+        if self._pause_started is not None:
+            paused_time += self.loop.time() - self._pause_started
+
+        return {"address": "{}:{}".format(self.addy, self.port),
+                "write_buffer_size": self.write_buffer_size,
+                "paused": self.writing_paused,
+                "pause_count": self.pause_count,
+                "paused_time": paused_time}
 
     def connectTo(self, addy, port):
         self.addy = addy
@@ -153,28 +344,98 @@ class LightClient(asyncio.Protocol, LightProtocol, ReconnectAsyncio):
         if self.debug:
             print(msg)
 
+    def update(self, ledsData, force=False):
+        if not self.latest_frame and not self.writing_paused:
+            # a frame coalesced while paused is older than this one
+            self.frame_pending = False
+
+            return LightProtocol.update(self, ledsData, force)
+
+        # Only remember the newest frame.  While the transport is paused
+        # this is what coalesces changes instead of growing the queue.
+
+        if self.shadow_frame is None or \
+                self.shadow_frame.shape != ledsData.shape:
+            self.shadow_frame = np.array(ledsData, copy=True)
+        else:
+            np.copyto(self.shadow_frame, ledsData)
+
+        self.frame_pending = True
+
+        if force and self.connected and not self.writing_paused and \
+                not self.resync_pending:
+            self._send_frame()
+
+    def _send_frame(self):
+        """encode the shadow frame against the last sent frame and flush"""
+        self.frame_pending = False
+        LightProtocol.update(self, self.shadow_frame)
+        self.flush()
+
     def send(self, msg):
+        if len(msg) > self.maxPayloadLength():
+            raise InvalidMessageLength(
+                "command of {} bytes is too long for protocol version "
+                "{}".format(len(msg), self.protocol_version))
+
+        if self.latest_frame and not self.connected:
+            # the shadow frame is resent on reconnect.  Don't let stale
+            # commands pile up while we are disconnected.
+            return msg
+
         self.send_queue.put_nowait(msg)
         return msg
 
-    def flush(self):
+    def _payloads(self, limit):
+        """empty the queue into payloads of whole commands, each at most
+           limit bytes long"""
         msg = bytearray()
 
         while self.send_queue.qsize() > 0:
             i = self.send_queue.get_nowait()
+
+            if msg and len(msg) + len(i) > limit:
+                yield msg
+                msg = bytearray()
+
             msg.extend(i)
 
-        msg = self.writeHeader(msg)
-        self.writer.write(msg)
+        yield msg
+
+    def flush(self):
+        # not connected yet.  Keep the queue for when we are
+        if not self.send_queue.qsize() or not self.writer:
+            return
+
+        for msg in self._payloads(self.maxPayloadLength()):
+            msg = self.writeHeader(msg)
+            self.writer.write(msg)
+
+            metrics.count("bytes_sent", len(msg))
+            metrics.observeValue("message_bytes", len(msg))
 
-    @asyncio.coroutine
-    def _process_send(self):
+    async def _process_send(self):
         while True:
 
-            if self.connected and self.send_queue.qsize():
-                self.flush()
+            if self.resync_pending and self.loop.time() - \
+                    self._resync_started > self.resync_timeout:
+                self._endResync(None)
 
-            yield from asyncio.sleep(1.0 / self.fps)
+            try:
+                if not self.connected or self.writing_paused:
+                    pass
+
+                elif self.frame_pending and not self.resync_pending:
+                    self._send_frame()
+
+                elif self.send_queue.qsize():
+                    self.flush()
+
+            except LightProtocolException as ex:
+                # drop the frame, not the connection
+                self.print_debug("can't send frame: {}".format(ex))
+
+            await asyncio.sleep(1.0 / self.fps)
 
     def _onConnected(self):
         if self.onConnected:
@@ -182,6 +443,27 @@ class LightClient(asyncio.Protocol, LightProtocol, ReconnectAsyncio):
 
     def _onDisconnected(self, reason=None):
         self.connected = False
+        self.resync_pending = False
+        self.receive_buffer = bytearray()
+
+        if self.writing_paused:
+            self.resume_writing()
+
+        # we don't know what the server has anymore.  The next update()
+        # sends a whole frame (with resync the baseline is checked against
+        # the server instead)
+        if not self.resync:
+            self.ledsDataCopy = None
+
+        self.requestKeyframe()
+
+        if self.latest_frame:
+            # drop whatever was queued and send the whole shadow frame once
+            # we reconnect
+            while self.send_queue.qsize():
+                self.send_queue.get_nowait()
+
+            self.frame_pending = self.shadow_frame is not None
 
         if self.writer:
             self.writer.close()
@@ -195,36 +477,40 @@ class LightClientUdp(LightClient):
         """
                 LightClientUdp
 
-                max_packet_size can be used to limit the size of packets sent
-                Actual sent packet may be +- 10 or so above the max_packet_size
+                max_packet_size can be used to limit the size of packets sent.
+                Packets only go over it if a single command is longer
         """
         LightClient.__init__(self, *args, **kwargs)
         self.max_packet_size = 5000
         if "max_packet_size" in kwargs.keys():
             self.max_packet_size = kwargs["max_packet_size"]
 
-        if "compression" in kwargs.keys():
-            self.compression = kwargs["compression"]
-
     def error_received(self, *args):
         print("udp error recieved... {}".format(args))
 
-    @asyncio.coroutine
-    def _connect(self):
-        yield from asyncio.get_event_loop().create_datagram_endpoint(lambda: self,
-                                                                     remote_addr=(self.addy, self.port))
+    def datagram_received(self, data, addr):
+        # one datagram is one reply
+        self._parseReply(bytearray(data))
+
+    async def _connect(self):
+        await self.loop.create_datagram_endpoint(
+            lambda: self, remote_addr=(self.addy, self.port))
 
     def flush(self):
-        msg = bytearray()
+        # not connected yet.  Keep the queue for when we are
+        if not self.send_queue.qsize() or not self.writer:
+            return
 
-        while self.send_queue.qsize() > 0 and len(msg) < self.max_packet_size:
-            i = self.send_queue.get_nowait()
-            msg.extend(i)
+        limit = min(self.max_packet_size, self.maxPayloadLength())
+
+        for msg in self._payloads(limit):
+            self.debug_print("sending payload size: {}".format(len(msg)))
+            msg = self.writeHeader(msg)
 
-        self.debug_print("sending payload size: {}".format(len(msg)))
-        msg = self.writeHeader(msg)
+            self.writer.sendto(msg)
 
-        self.writer.sendto(msg)
+            metrics.count("bytes_sent", len(msg))
+            metrics.observeValue("message_bytes", len(msg))
 
 
 def test_protocol(debug=False):
@@ -246,8 +532,7 @@ def test_protocol(debug=False):
     c = TestClient(num_lights)
 
     # set all colors to red, green, than blue
-    @asyncio.coroutine
-    def test_set_color():
+    async def test_set_color():
         print("test_set_color")
         print("============\n")
 
@@ -255,49 +540,46 @@ def test_protocol(debug=False):
         for i in range(num_lights):
             c.setColor(i, (255, 0, 0))
 
-        yield from (asyncio.sleep(5))
+        await asyncio.sleep(5)
 
         print("setColor: green")
         for i in range(num_lights):
             c.setColor(i, (0, 255, 0))
 
-        yield from (asyncio.sleep(5))
+        await asyncio.sleep(5)
 
         print("setColor: blue")
         for i in range(num_lights):
             c.setColor(i, (0, 0, 255))
 
-        yield from (asyncio.sleep(5))
+        await asyncio.sleep(5)
 
-    @asyncio.coroutine
-    def test_clear():
+    async def test_clear():
         print("test_clear")
         print("==========\n")
 
         c.clear()
-        yield from (asyncio.sleep(5))
+        await asyncio.sleep(5)
 
-    @asyncio.coroutine
-    def test_set_all():
+    async def test_set_all():
         print("test_set_all")
         print("============\n")
 
         print("setAllColor: red")
         c.setAllColor((255, 0, 0))
 
-        yield from (asyncio.sleep(5))
+        await asyncio.sleep(5)
 
         print("setAllColor: green")
         c.setAllColor((0, 255, 0))
 
-        yield from (asyncio.sleep(5))
+        await asyncio.sleep(5)
 
         print("setAllColor: blue")
         c.setAllColor((0, 0, 255))
-        yield from (asyncio.sleep(5))
+        await asyncio.sleep(5)
 
-    @asyncio.coroutine
-    def test_set_series():
+    async def test_set_series():
         print("test_set_series")
         print("===============\n")
         # first and last led = red
@@ -311,10 +593,9 @@ def test_protocol(debug=False):
 
         print("red, blue, red")
 
-        yield from (asyncio.sleep(5))
+        await asyncio.sleep(5)
 
-    @asyncio.coroutine
-    def test_multimsg():
+    async def test_multimsg():
         print("test_multimsg")
         print("============\n")
 
@@ -326,7 +607,7 @@ def test_protocol(debug=False):
 
         c.send(msg)
 
-        yield from (asyncio.sleep(5))
+        await asyncio.sleep(5)
 
         print("should be a rainbow")
 
@@ -334,13 +615,13 @@ def test_protocol(debug=False):
         msg = bytearray(binascii.unhexlify(msg))
 
         c.send(msg)
-        yield from (asyncio.sleep(5))
+        await asyncio.sleep(5)
 
         msg = b'0301010001008a006c0101000200170000010100040050003f0101000800c300000101000900e70000'
         msg = bytearray(binascii.unhexlify(msg))
 
         c.send(msg)
-        yield from (asyncio.sleep(5))
+        await asyncio.sleep(5)
 
     def test_debug():
         print("test_debug")
@@ -369,13 +650,14 @@ def test_protocol(debug=False):
 
         print("pass")
 
-    asyncio.get_event_loop().run_until_complete(test_clear())
-    asyncio.get_event_loop().run_until_complete(test_multimsg())
-    asyncio.get_event_loop().run_until_complete(test_set_series())
-    asyncio.get_event_loop().run_until_complete(test_set_color())
-    asyncio.get_event_loop().run_until_complete(test_clear())
-    asyncio.get_event_loop().run_until_complete(test_set_all())
-    asyncio.get_event_loop().run_until_complete(test_clear())
+    loop = c.leds.loop
+    loop.run_until_complete(test_clear())
+    loop.run_until_complete(test_multimsg())
+    loop.run_until_complete(test_set_series())
+    loop.run_until_complete(test_set_color())
+    loop.run_until_complete(test_clear())
+    loop.run_until_complete(test_set_all())
+    loop.run_until_complete(test_clear())
     test_debug()
     test_setNumLeds()
 
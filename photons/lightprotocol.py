@@ -1,6 +1,10 @@
 import numpy as np
 import struct
 import binascii
+import hashlib
+import zlib
+
+from photons.instrumentation import metrics
 
 
 class LightParser:
@@ -15,23 +19,40 @@ class LightParser:
         return make_command
 
 
-class IncompatibleProtocolException(Exception):
+class LightProtocolException(Exception):
+    """base of everything parse() raises for bad input"""
+    pass
+
+
+class IncompatibleProtocolException(LightProtocolException):
     def __init__(self, protocol, should_be_protocol):
-        Exception.__init__(self)
+        LightProtocolException.__init__(self)
         print("protocol {} should be {}".format(protocol, should_be_protocol))
 
 
-class BadMessageTypeException(Exception):
+class BadMessageTypeException(LightProtocolException):
     def __init__(self):
-        Exception.__init__(self)
+        LightProtocolException.__init__(self)
         print("message type should be bytearray")
 
 
-class InvalidCommandException(Exception):
+class InvalidCommandException(LightProtocolException):
+    pass
+
+
+class InvalidMessageLength(LightProtocolException):
+    pass
+
+
+class UnsupportedFlagsException(LightProtocolException):
     pass
 
 
-class InvalidMessageLength(Exception):
+class CorruptPayloadException(LightProtocolException):
+    pass
+
+
+class CostLimitExceeded(LightProtocolException):
     pass
 
 
@@ -42,6 +63,110 @@ class LightProtocolCommand:
     SetDebug = 0x05
     SetAllColor = 0x06
     SetSeries = 0x07
+    SetRange = 0x08
+    SetPalette = 0x09
+    KeyFrame = 0x0A
+    DeltaFrame = 0x0B
+    GetFrame = 0x0C
+    FrameSnapshot = 0x0D
+    FrameHash = 0x0E
+
+
+class LightProtocolFlags:
+    """flags byte of the version 2 header"""
+    Deflate = 0x01
+    Lz4 = 0x02
+
+
+def _inflate(payload, maxLength):
+    inflater = zlib.decompressobj()
+    payload = inflater.decompress(payload, maxLength)
+
+    if inflater.unconsumed_tail:
+        raise InvalidMessageLength(
+            "payload inflates to more than {} bytes".format(maxLength))
+
+    if not inflater.eof:
+        raise CorruptPayloadException("deflate payload is truncated")
+
+    return payload
+
+
+"""payload codecs by header flag: (compress, decompress).  decompress
+   takes the payload and the maximum decompressed length"""
+payloadCodecs = {
+    LightProtocolFlags.Deflate: (lambda payload: zlib.compress(payload, 1),
+                                 _inflate),
+}
+
+try:
+    import lz4.block
+
+    def _lz4Decompress(payload, maxLength):
+        # lz4 blocks start with their decompressed size
+        if len(payload) < 4 or \
+                struct.unpack('<I', payload[:4])[0] > maxLength:
+            raise InvalidMessageLength(
+                "payload decompresses to more than {} bytes".format(
+                    maxLength))
+
+        return lz4.block.decompress(payload)
+
+    payloadCodecs[LightProtocolFlags.Lz4] = (lz4.block.compress,
+                                             _lz4Decompress)
+except ImportError:
+    pass
+
+
+def paletteBits(numColors):
+    """bits per index needed for a palette of numColors (1, 2, 4 or 8)"""
+    for bits in (1, 2, 4, 8):
+        if numColors <= 1 << bits:
+            return bits
+
+    return None
+
+
+def packIndices(indices, bits):
+    """pack uint8 indices into bytes, lowest bits first"""
+    perByte = 8 // bits
+    padded = np.zeros(-(-len(indices) // perByte) * perByte, np.uint8)
+    padded[:len(indices)] = indices
+
+    shifts = np.arange(0, 8, bits, dtype=np.uint8)
+    packed = np.left_shift(padded.reshape(-1, perByte), shifts)
+
+    return np.bitwise_or.reduce(packed, axis=1).astype(np.uint8)
+
+
+def unpackIndices(packed, bits, count):
+    """reverse of packIndices"""
+    shifts = np.arange(0, 8, bits, dtype=np.uint8)
+    mask = (1 << bits) - 1
+
+    indices = np.right_shift(packed[:, None], shifts) & mask
+
+    return indices.reshape(-1)[:count]
+
+
+class FrameBuffer:
+    """leds target that decodes frames into ledsData and nothing else"""
+
+    def __init__(self, ledArraySize):
+        self.setLedArraySize(ledArraySize)
+
+    def setLedArraySize(self, ledArraySize):
+        self.ledArraySize = ledArraySize
+        self.ledsData = np.zeros((ledArraySize, 3), np.uint8)
+
+    def clear(self):
+        self.ledsData[:] = 0
+
+    def changeColor(self, ledNumber, color):
+        self.ledsData[ledNumber] = color
+
+    def changeColors(self, startId, colors):
+        self.ledsData[startId:startId + len(colors)] = colors
 
 
 class ColorChangeSet:
@@ -58,11 +183,19 @@ class LightProtocol:
 
             [Header] [Payload]
 
-            Header:
+            Header (version 1):
 
             [Protocol_Version][Payload_Length]
             [1byte][2bytes]
 
+            Header (version 2):
+
+            [Protocol_Version][Flags][Payload_Length]
+            [1byte][1byte][4bytes]
+
+            Flags (@see LightProtocolFlags) select the codec the payload is
+            compressed with.  Payload_Length is the length on the wire.
+
             Payload:
             [Command][Data]
             [1byte][...]
@@ -74,77 +207,265 @@ class LightProtocol:
             SetDebug - turn on/off debugging messages on client/server
             SetAllColor - Set all pixels in string to color
             SetSeries - Set a series of pixels in string to color
+            SetRange - Set consecutive pixels to individual colors
+            SetPalette - Set consecutive pixels to palette indexed colors
+            KeyFrame - Full frame the following deltas are based on
+            DeltaFrame - Changes relative to a KeyFrame
+            GetFrame - Ask the server for its current frame or its hash
+            FrameSnapshot - Reply to GetFrame: the current frame
+            FrameHash - Reply to GetFrame: hash of the current frame
 
 
     """
-    ledsDataCopy = None
+
+    """versions parse() understands.  Anything else is rejected by looking
+       at the first byte only"""
+    supported_versions = (0x01, 0x02)
+
+    """one light of a SetColor command on the wire"""
+    setColorDtype = np.dtype([('id', '<u2'), ('color', 'u1', (3,))])
+
+    """largest payload parse() accepts, after decompression"""
+    max_message_length = 1 << 20
+
+    """leds one message may allocate with SetNumPixels, in total"""
+    max_resize = 0xffff
 
     def __init__(self, leds=None, debug=False):
 
         self.supportsChangeColor = False
+        self.supportsMasterBrightness = False
         self.changeColor = self.setColor
 
+        """sender: the last frame sent, which update() diffs against"""
+        self.ledsDataCopy = None
+        self.update_count = 0
+
         """leds = LightArray2 handle.  This is only used when trying to parse."""
         self.leds = leds
         self.protocol_version = 0x01  # version 1.0
         self.debug = debug
+
+        """payload compression for writeHeader: False, True (deflate) or a
+           LightProtocolFlags codec.  Anything but False needs version 2"""
         self.compression = False
 
+        """
+        Keyframe mode (for lossy transports): every keyframe_interval frames
+        update() sends a full KeyFrame.  Frames in between are sent as
+        DeltaFrames against that keyframe rather than the previous frame,
+        so a lost packet is repaired by the next delta or keyframe.
+        None disables keyframes.
+        """
+        self.keyframe_interval = None
+
+        """sender: last keyframe sent.  parser: last keyframe applied"""
+        self.keyframe = None
+        self.keyframe_id = 0
+        self.frames_since_keyframe = 0
+
+        """
+        parser: work done by the last parse(), one per command plus one
+        per led written.  Commands are checked against max_cost before
+        they touch any leds.  None is unlimited.
+        """
+        self.cost = 0
+        self.max_cost = None
+        self._in_frame = False
+
+        """
+        parser: if max_cost is per led (frames of work), max_cost_frames
+        is that number of frames.  max_cost then grows with the array when
+        SetNumPixels grows it.
+        """
+        self.max_cost_frames = None
+        self.resized = 0
+
+        """
+        parser: reply(msg) sends a message back to whoever sent the one
+        being parsed (GetFrame).  Snapshots longer than max_reply_length
+        are answered with a hash instead.
+
+        onFrameSnapshot(frame) and onFrameHash(numLeds, hash) are called
+        with the replies.
+        """
+        self.reply = None
+        self.max_reply_length = None
+        self.onFrameSnapshot = None
+        self.onFrameHash = None
+
     def debug_print(self, msg):
         if self.debug:
             print(msg)
 
-    def updateCompress(self, ledsData):
-        index = 0
+    def encodeFrame(self, ledsData, base=None):
+        """
+        Encode ledsData with whatever set of commands is the cheapest on the
+        wire.  Only pixels that differ from base are sent.  If base is None
+        every pixel is sent.
+
+        Candidates (cost in bytes):
+
+        SetAllColor - 4 (only if the whole frame is one color)
+        SetColor - 3 + 5 per changed pixel
+        SetSeries runs - 8 per run of equal colors, single pixels are
+                         batched into one SetColor
+        SetRange - 5 + 3 per pixel between first and last changed pixel
+        SetPalette - 7 + 3 per color + 1, 2, 4 or 8 bits per pixel between
+                     first and last changed pixel
+        """
+        numLeds = len(ledsData)
 
-        while index < len(ledsData):
-            color = ledsData[index]
-            startId = index
-            length = 0
-            for i in ledsData[index:]:
-                if not np.array_equal(color, i):
-                    break
+        if base is None or base.shape != ledsData.shape:
+            changed = np.ones(numLeds, np.bool_)
+        else:
+            changed = np.any(ledsData != base, axis=1)
 
-                length += 1
+        changedIds = np.flatnonzero(changed)
 
-            if length < 4:
-                """if the length is less than 4, it's not worth the extra bits to send a setSeries"""
-                for i in range(length):
-                    self.setColor(startId + i, color)
-            else:
-                self.setSeries(startId, length, color)
+        if not len(changedIds):
+            return
 
-            index += length
+        first = int(changedIds[0])
+        last = int(changedIds[-1])
 
-    def update(self, ledsData, force=False):
-        if len(ledsData) == 1 or np.unique(ledsData).size == 1:
+        # runs of changed pixels that share a color:
+        same = np.zeros(numLeds, np.bool_)
+        same[1:] = np.all(ledsData[1:] == ledsData[:-1], axis=1)
+        same[1:] &= changed[1:] & changed[:-1]
+
+        runEnds = changed.copy()
+        runEnds[:-1] &= ~same[1:]
+
+        runStarts = np.flatnonzero(changed & ~same)
+        runLengths = np.flatnonzero(runEnds) - runStarts + 1
+
+        # a series costs 8 bytes, a pixel in a SetColor 5
+        isSeries = runLengths >= 2
+        numSingles = len(runLengths) - np.count_nonzero(isSeries)
+
+        costs = {
+            "color": 3 + 5 * len(changedIds),
+            "series": 8 * np.count_nonzero(isSeries) +
+            (3 + 5 * numSingles if numSingles else 0),
+            "range": 5 + 3 * (last - first + 1),
+        }
+
+        if runLengths[0] == numLeds:
+            costs["all"] = 4
+
+        span = ledsData[first:last + 1]
+
+        # np.unique sorts, so only look for a palette if one could win
+        if min(costs.values()) > 10 + -(-len(span) // 8):
+            keys = span.astype(np.uint32)
+            keys = keys[:, 0] << 16 | keys[:, 1] << 8 | keys[:, 2]
+            paletteKeys, indices = np.unique(keys, return_inverse=True)
+            bits = paletteBits(len(paletteKeys))
+
+            if bits:
+                costs["palette"] = 7 + 3 * len(paletteKeys) + \
+                    -(-len(span) * bits // 8)
+
+        encoding = min(costs, key=costs.get)
+
+        if self.debug:
+            self.debug_print("encoding {} changed pixels as {} ({})".format(
+                len(changedIds), encoding, costs))
+
+        # commands are split so each fits in one message
+        limit = self.maxPayloadLength()
+
+        if encoding == "all":
             self.setAllColor(ledsData[0])
-            return
 
-        if self.compression:
-            stdDev = np.std(ledsData)
+        elif encoding == "range":
+            step = (limit - 5) // 3
+
+            for start in range(0, len(span), step):
+                self.setRange(first + start, span[start:start + step])
+
+        elif encoding == "palette":
+            palette = np.empty((len(paletteKeys), 3), np.uint8)
+            palette[:, 0] = paletteKeys >> 16
+            palette[:, 1] = paletteKeys >> 8
+            palette[:, 2] = paletteKeys
+
+            step = (limit - 7 - 3 * len(palette)) * 8 // bits
+
+            for start in range(0, len(span), step):
+                self.setPalette(first + start, palette,
+                                indices[start:start + step])
+
+        elif encoding == "series":
+            singles = runStarts[~isSeries]
+
+            for start, length in zip(runStarts[isSeries],
+                                     runLengths[isSeries]):
+                self.setSeries(int(start), int(length), ledsData[start])
 
-            if stdDev < len(ledsData) / 4:
-                " if there's a lot of common data, we can compress the stream and break up the packets "
-                return self.updateCompress(ledsData)
+            if numSingles:
+                self._setColors(singles, ledsData[singles], limit)
 
-        if self.ledsDataCopy is None:
-            self.ledsDataCopy = np.array(ledsData, copy=True)
-            # self.SetNumPixels(len(self.ledsDataCopy))
-            diff = self.ledsDataCopy
         else:
-            diff = np.bitwise_xor(ledsData, self.ledsDataCopy)
+            self._setColors(changedIds, ledsData[changedIds], limit)
 
-        ledsToChange = bytearray()
-        changeset = {}
-        for i in range(len(diff)):
-            if not np.all(np.equal(diff[i], [0, 0, 0])):
-                changeset[i] = ledsData[i]
+    def _setColors(self, ids, colors, limit):
+        """setColor in as many commands as it takes to stay under limit"""
+        step = (limit - 3) // 5
 
-        self.setColor([*changeset], list(changeset.values()))
+        for start in range(0, len(ids), step):
+            self.setColor(ids[start:start + step], colors[start:start + step])
+
+    def _encodeFramePayload(self, ledsData, base=None):
+        """encodeFrame() into a bytearray instead of sending it"""
+        payload = bytearray()
+
+        def capture(buff):
+            payload.extend(buff)
+            return buff
+
+        self.send = capture
+
+        try:
+            self.encodeFrame(ledsData, base)
+        finally:
+            del self.send
+
+        return payload
+
+    def requestKeyframe(self):
+        """send a keyframe with the next update()"""
+        self.keyframe = None
+
+    def updateKeyframed(self, ledsData):
+        if self.keyframe is None or self.keyframe.shape != ledsData.shape \
+                or self.frames_since_keyframe + 1 >= self.keyframe_interval:
+            self.keyframe_id = (self.keyframe_id + 1) & 0xffff
+            self.keyFrame(self.keyframe_id, self._encodeFramePayload(ledsData))
+
+            self.keyframe = np.array(ledsData, copy=True)
+            self.frames_since_keyframe = 0
+            return
+
+        self.frames_since_keyframe += 1
+
+        payload = self._encodeFramePayload(ledsData, self.keyframe)
+        self.deltaFrame(self.keyframe_id, payload)
+
+    def update(self, ledsData, force=False):
+        started = metrics.start()
+        self.update_count += 1
+
+        if self.keyframe_interval:
+            self.updateKeyframed(ledsData)
+        else:
+            self.encodeFrame(ledsData, self.ledsDataCopy)
 
         self.ledsDataCopy = np.array(ledsData, copy=True)
 
+        metrics.observe("encode_seconds", started)
+
         if force:
             self.flush()
 
@@ -157,18 +478,104 @@ class LightProtocol:
            Flush any buffers."""
         pass
 
+    def maxPayloadLength(self):
+        """largest payload one message can carry with protocol_version"""
+        if self.protocol_version == 0x01:
+            return 0xffff
+
+        return self.max_message_length
+
+    def setCompression(self, compression):
+        """
+        enable payload compression.  compression is True (deflate) or one
+        of LightProtocolFlags.  This switches to protocol version 2, which
+        old servers do not understand.
+        """
+        if compression is True:
+            compression = LightProtocolFlags.Deflate
+
+        if compression and compression not in payloadCodecs:
+            raise UnsupportedFlagsException(
+                "compression {} not available".format(compression))
+
+        self.compression = compression
+
+        if compression:
+            self.protocol_version = 0x02
+
     def writeHeader(self, msg):
         """write header:
+        version 1:
         [8bit][16bit]
         [protocol_version][msg_length]
+
+        version 2:
+        [8bit][8bit][32bit]
+        [protocol_version][flags][msg_length]
         """
 
-        header = bytearray([self.protocol_version])  # protocol version 1.0
-        header.extend(struct.pack('<H', len(msg)))
+        if self.protocol_version == 0x01:
+            if len(msg) > 0xffff:
+                raise InvalidMessageLength(
+                    "payload of {} bytes does not fit a version 1 "
+                    "header".format(len(msg)))
 
-        msg = header + msg
+            header = bytearray([self.protocol_version])
+            header.extend(struct.pack('<H', len(msg)))
 
-        return msg
+            return header + msg
+
+        flags = 0
+
+        if self.compression:
+            compress = payloadCodecs[self.compression][0]
+            compressed = compress(bytes(msg))
+
+            # incompressible payloads are sent as they are
+            if len(compressed) < len(msg):
+                msg = compressed
+                flags |= self.compression
+
+        header = bytearray([self.protocol_version, flags])
+        header.extend(struct.pack('<I', len(msg)))
+
+        return header + msg
+
+    @staticmethod
+    def headerLength(buff):
+        """
+        length of the header at the start of buff or None if buff is too
+        short to tell.  Raises IncompatibleProtocolException for unknown
+        versions.
+        """
+        if not len(buff):
+            return None
+
+        if buff[0] == 0x01:
+            return 3
+
+        if buff[0] == 0x02:
+            return 6
+
+        raise IncompatibleProtocolException(
+            buff[0], LightProtocol.supported_versions)
+
+    @staticmethod
+    def frameLength(buff):
+        """
+        total length (header and payload) of the frame at the start of buff
+        or None if the header is incomplete.  Used to split a stream into
+        frames.
+        """
+        header_length = LightProtocol.headerLength(buff)
+
+        if header_length is None or len(buff) < header_length:
+            return None
+
+        if header_length == 3:
+            return header_length + struct.unpack('<H', buff[1:3])[0]
+
+        return header_length + struct.unpack('<I', buff[2:6])[0]
 
     def setColor(self, id, color):
         """
@@ -178,29 +585,32 @@ class LightProtocol:
         Data:
 
         [Command][Number_Lights_to_set][id_1][r][g][b][id_n][r][g][b]...
-        """
-        header = bytearray()
-        header.append(LightProtocolCommand.SetColor)
 
-        if not isinstance(id, list):
+        id and color are a single id and color, or lists or arrays of ids
+        and colors (n x 3).
+        """
+        if not isinstance(id, (list, np.ndarray)):
             id = [id]
-
-        if not isinstance(color, list):
             color = [color]
 
-        header.extend(struct.pack('<H', len(id)))
+        if isinstance(color, list):
+            if all(isinstance(c, (bytes, bytearray)) for c in color):
+                # bytes join much faster than numpy can convert them
+                color = np.frombuffer(b"".join(color), np.uint8)
+            else:
+                color = [np.frombuffer(c, np.uint8)
+                         if isinstance(c, (bytes, bytearray)) else c
+                         for c in color]
 
-        i = 0
-        light = bytearray()
+        lights = np.empty(len(id), self.setColorDtype)
+        lights['id'] = id
+        lights['color'] = np.asarray(color, np.uint8).reshape(-1, 3)
 
-        for curr_id in id:
-            light.extend(struct.pack('<H', curr_id))
-            light.extend(color[i])
-            i += 1
+        header = bytearray()
+        header.append(LightProtocolCommand.SetColor)
+        header.extend(struct.pack('<H', len(lights)))
 
-        buff = header + light
-
-        return self.send(buff)
+        return self.send(header + lights.tobytes())
 
     def setSeries(self, startId, length, color):
         """
@@ -219,6 +629,88 @@ class LightProtocol:
 
         return self.send(buff)
 
+    def setRange(self, startId, colors):
+        """
+        Command 0x08
+        sets consecutive lights starting from "startId" to the individual
+        colors in "colors"
+
+        Data:
+        [0x08][startId][length][r][g][b][r][g][b]...
+        """
+
+        colors = np.asarray(colors, np.uint8)
+
+        buff = bytearray()
+        buff.append(LightProtocolCommand.SetRange)
+        buff.extend(struct.pack('<H', startId))
+        buff.extend(struct.pack('<H', len(colors)))
+        buff.extend(colors.tobytes())
+
+        return self.send(buff)
+
+    def setPalette(self, startId, palette, indices):
+        """
+        Command 0x09
+        sets consecutive lights starting from "startId" to palette[index]
+        for each index in "indices".  Indices are packed into 1, 2, 4 or 8
+        bits depending on the size of the palette (up to 256 colors).
+
+        Data:
+        [0x09][startId][length][bits][num_colors][r][g][b]...[indices]...
+        """
+
+        palette = np.asarray(palette, np.uint8)
+        indices = np.asarray(indices, np.uint8)
+        bits = paletteBits(len(palette))
+
+        buff = bytearray()
+        buff.append(LightProtocolCommand.SetPalette)
+        buff.extend(struct.pack('<H', startId))
+        buff.extend(struct.pack('<H', len(indices)))
+        buff.append(bits)
+        buff.append(len(palette) & 0xff)  # 0 means 256
+        buff.extend(palette.tobytes())
+        buff.extend(packIndices(indices, bits).tobytes())
+
+        return self.send(buff)
+
+    def keyFrame(self, id, payload):
+        """
+        Command 0x0A
+        full frame.  "payload" are commands that set every pixel.  The
+        result is remembered as keyframe "id".
+
+        Data:
+        [0x0A][id][payload_length][payload]
+        """
+
+        buff = bytearray()
+        buff.append(LightProtocolCommand.KeyFrame)
+        buff.extend(struct.pack('<H', id))
+        buff.extend(struct.pack('<I', len(payload)))
+        buff.extend(payload)
+
+        return self.send(buff)
+
+    def deltaFrame(self, baseId, payload):
+        """
+        Command 0x0B
+        changes relative to keyframe "baseId".  Ignored by parsers that
+        don't have that keyframe.
+
+        Data:
+        [0x0B][baseId][payload_length][payload]
+        """
+
+        buff = bytearray()
+        buff.append(LightProtocolCommand.DeltaFrame)
+        buff.extend(struct.pack('<H', baseId))
+        buff.extend(struct.pack('<I', len(payload)))
+        buff.extend(payload)
+
+        return self.send(buff)
+
     def setAllColor(self, color):
         """
         Command: 0x06
@@ -252,6 +744,62 @@ class LightProtocol:
 
         return self.send(header)
 
+    def getFrame(self, hashOnly=False):
+        """
+        Command 0x0C
+        ask the server for its current frame.  It replies with a
+        FrameSnapshot, or a FrameHash if hashOnly.
+
+        Data:
+        [0x0C][hash_only]
+        [1byte][1byte]
+        """
+        buff = bytearray()
+        buff.append(LightProtocolCommand.GetFrame)
+        buff.append(int(hashOnly))
+
+        return self.send(buff)
+
+    def frameSnapshot(self, ledsData):
+        """
+        Command 0x0D
+        a whole frame.  "payload" are the commands encodeFrame() picks to
+        set every pixel, so snapshots are as compact as frames.
+
+        Data:
+        [0x0D][num_leds][payload_length][payload]
+        [1byte][2bytes][4bytes][...]
+        """
+        payload = self._encodeFramePayload(ledsData)
+
+        buff = bytearray()
+        buff.append(LightProtocolCommand.FrameSnapshot)
+        buff.extend(struct.pack('<HI', len(ledsData), len(payload)))
+        buff.extend(payload)
+
+        return self.send(buff)
+
+    def frameHash(self, ledsData):
+        """
+        Command 0x0E
+        hash of a frame (@see hashFrame)
+
+        Data:
+        [0x0E][num_leds][hash]
+        [1byte][2bytes][8bytes]
+        """
+        buff = bytearray()
+        buff.append(LightProtocolCommand.FrameHash)
+        buff.extend(struct.pack('<H', len(ledsData)))
+        buff.extend(self.hashFrame(ledsData))
+
+        return self.send(buff)
+
+    @staticmethod
+    def hashFrame(ledsData):
+        return hashlib.blake2b(np.ascontiguousarray(ledsData, np.uint8),
+                               digest_size=8).digest()
+
     def SetNumPixels(self, numLeds):
         buff = bytearray()
         buff.append(LightProtocolCommand.SetNumPixels)
@@ -274,22 +822,58 @@ class LightProtocol:
         #msg = memoryview(msg_b)
         msg = msg_b
 
-        protocol_version = msg[0]
-        msg_length = struct.unpack('<H', msg[1:3])[0]
+        header_length = self.headerLength(msg)
+
+        if header_length is None or len(msg) < header_length:
+            raise InvalidMessageLength()
 
-        if protocol_version != self.protocol_version:
-            raise IncompatibleProtocolException(
-                protocol_version, self.protocol_version)
+        flags = 0
+
+        if header_length == 3:
+            msg_length = struct.unpack('<H', msg[1:3])[0]
+        else:
+            flags = msg[1]
+            msg_length = struct.unpack('<I', msg[2:6])[0]
 
-        msg = msg[3:]  # remove header and process all commands in message:
+        if msg_length > self.max_message_length:
+            raise InvalidMessageLength(
+                "message length {} is over the limit of {}".format(
+                    msg_length, self.max_message_length))
+
+        # remove header and process all commands in message:
+        msg = msg[header_length:header_length + msg_length]
 
         if len(msg) < msg_length:
             raise InvalidMessageLength()
 
+        if flags:
+            if flags not in payloadCodecs:
+                raise UnsupportedFlagsException(
+                    "unsupported header flags {}".format(flags))
+
+            decompress = payloadCodecs[flags][1]
+
+            try:
+                msg = bytearray(decompress(bytes(msg),
+                                           self.max_message_length))
+            except LightProtocolException:
+                raise
+            except Exception as ex:
+                raise CorruptPayloadException(
+                    "can't decompress payload: {}".format(ex))
+
+        self.cost = 0
+        self.resized = 0
+        self._in_frame = False
+
+        self.parseCommands(msg)
+
+    def parseCommands(self, msg):
         while len(msg):
 
             cmd = msg[0]
             if cmd in LightParser.commandsMap:
+                self.charge(1)
                 msg = LightParser.commandsMap[cmd](self, msg)
 
                 if self.debug:
@@ -297,13 +881,40 @@ class LightProtocol:
                         "remaining message: {}".format(binascii.hexlify(msg)))
             else:
                 raise InvalidCommandException(
-                    "command {0} not supported in {}".format(cmd, self.protocol_version))
+                    "command {} not supported in protocol version {}".format(
+                        cmd, self.protocol_version))
+
+    def charge(self, cost):
+        """account for work about to be done.  Raises past max_cost"""
+        self.cost += cost
+
+        if self.max_cost is not None and self.cost > self.max_cost:
+            raise CostLimitExceeded(
+                "message cost is over the limit of {}".format(self.max_cost))
+
+    @staticmethod
+    def checkLength(msg, length):
+        """raise unless msg holds at least length bytes"""
+        if len(msg) < length:
+            raise InvalidMessageLength(
+                "command 0x{:02x} needs {} bytes, has {}".format(
+                    msg[0], length, len(msg)))
+
+    def clamp(self, start_id, numlights):
+        """number of leds from start_id on that are inside the array"""
+        return max(0, min(numlights, self.leds.ledArraySize - start_id))
 
     @LightParser.command(LightProtocolCommand.SetColor)
     def parseSetColor(self, msg):
-        assert(len(msg) >= 6)
+        self.checkLength(msg, 3)
 
         numlights = struct.unpack('<H', msg[1:3])[0]
+        end = 3 + numlights * 5
+
+        self.checkLength(msg, end)
+        self.charge(numlights)
+
+        ledArraySize = self.leds.ledArraySize
 
         light = 3  # start at light at position 3 in the msg
         for i in range(numlights):
@@ -313,58 +924,246 @@ class LightProtocol:
             g = msg[light+3]
             b = msg[light+4]
 
-            self.leds.changeColor(id, [r, g, b])
+            if id < ledArraySize:
+                self.leds.changeColor(id, [r, g, b])
 
             light += 5  # 5 bytes per light
 
-        return msg[light:]
+        return msg[end:]
 
     @LightParser.command(LightProtocolCommand.Clear)
     def parseClear(self, msg):
+        self.charge(self.leds.ledArraySize)
         self.leds.clear()
         return msg[1:]
 
     @LightParser.command(LightProtocolCommand.SetNumPixels)
     def parseSetNumPixels(self, msg):
+        self.checkLength(msg, 3)
+
         numlights = struct.unpack('<H', msg[1:3])[0]
 
+        # allocating is charged against a fixed cap, not the current size
+        self.resized += numlights
+
+        if self.resized > self.max_resize:
+            raise CostLimitExceeded(
+                "message resizes more than {} leds".format(self.max_resize))
+
+        grown = numlights - self.leds.ledArraySize
         self.leds.setLedArraySize(numlights)
 
+        if self.max_cost is not None and self.max_cost_frames and grown > 0:
+            self.max_cost += grown * self.max_cost_frames
+
         return msg[3:]
 
     @LightParser.command(LightProtocolCommand.SetAllColor)
     def parseSetAllLeds(self, msg):
+        self.checkLength(msg, 4)
 
-        assert(len(msg) > 3)
+        numlights = self.leds.ledArraySize
+        self.charge(numlights)
 
-        pos = 1
-        r = msg[pos]
-        g = msg[pos+1]
-        b = msg[pos+2]
-
-        for led in range(self.leds.ledArraySize):
-            self.leds.changeColor(led, [r, g, b])
+        if numlights:
+            color = np.frombuffer(msg[1:4], np.uint8)
+            self.leds.changeColors(0, np.tile(color, (numlights, 1)))
 
         return msg[4:]
 
     @LightParser.command(LightProtocolCommand.SetSeries)
     def parseSetSeries(self, msg):
+        self.checkLength(msg, 8)
+
         start_id = struct.unpack('<H', msg[1:3])[0]
-        numlights = struct.unpack('<H', msg[3:5])[0]
+        numlights = self.clamp(start_id, struct.unpack('<H', msg[3:5])[0])
 
-        r = msg[5]
-        g = msg[6]
-        b = msg[7]
+        self.charge(numlights)
 
-        i = start_id
-        while i < start_id + numlights:
-            self.leds.changeColor(i, [r, g, b])
-            i += 1
+        if numlights:
+            color = np.frombuffer(msg[5:8], np.uint8)
+            self.leds.changeColors(start_id, np.tile(color, (numlights, 1)))
 
         return msg[8:]
 
+    @LightParser.command(LightProtocolCommand.SetRange)
+    def parseSetRange(self, msg):
+        self.checkLength(msg, 5)
+
+        start_id = struct.unpack('<H', msg[1:3])[0]
+        numlights = struct.unpack('<H', msg[3:5])[0]
+
+        end = 5 + numlights * 3
+        self.checkLength(msg, end)
+
+        count = self.clamp(start_id, numlights)
+        self.charge(count)
+
+        if count:
+            colors = np.frombuffer(msg[5:5 + count * 3], np.uint8)
+            self.leds.changeColors(start_id, colors.reshape(count, 3))
+
+        return msg[end:]
+
+    @LightParser.command(LightProtocolCommand.SetPalette)
+    def parseSetPalette(self, msg):
+        self.checkLength(msg, 7)
+
+        start_id = struct.unpack('<H', msg[1:3])[0]
+        numlights = struct.unpack('<H', msg[3:5])[0]
+        bits = msg[5]
+        num_colors = msg[6] or 256
+
+        if bits not in (1, 2, 4, 8):
+            raise InvalidCommandException(
+                "palette index size {} is not 1, 2, 4 or 8 bits".format(bits))
+
+        pos = 7 + num_colors * 3
+        end = pos + -(-numlights * bits // 8)
+        self.checkLength(msg, end)
+
+        count = self.clamp(start_id, numlights)
+        self.charge(count)
+
+        if not count:
+            return msg[end:]
+
+        palette = np.frombuffer(msg[7:pos], np.uint8).reshape(num_colors, 3)
+        packed = np.frombuffer(msg[pos:end], np.uint8)
+
+        indices = unpackIndices(packed, bits, count)
+
+        if indices.max() >= num_colors:
+            raise InvalidCommandException(
+                "palette index past the {} palette colors".format(num_colors))
+
+        self.leds.changeColors(start_id, palette[indices])
+
+        return msg[end:]
+
+    def parseFrame(self, msg):
+        """payload of a KeyFrame or DeltaFrame.  Frames may not nest"""
+        if self._in_frame:
+            raise InvalidCommandException("frames can not be nested")
+
+        self._in_frame = True
+
+        try:
+            self.parseCommands(msg)
+        finally:
+            self._in_frame = False
+
+    @LightParser.command(LightProtocolCommand.KeyFrame)
+    def parseKeyFrame(self, msg):
+        self.checkLength(msg, 7)
+
+        keyframe_id = struct.unpack('<H', msg[1:3])[0]
+        length = struct.unpack('<I', msg[3:7])[0]
+        end = 7 + length
+
+        self.checkLength(msg, end)
+        self.parseFrame(msg[7:end])
+
+        self.charge(self.leds.ledArraySize)
+        self.keyframe_id = keyframe_id
+        self.keyframe = np.array(self.leds.ledsData, copy=True)
+
+        return msg[end:]
+
+    @LightParser.command(LightProtocolCommand.DeltaFrame)
+    def parseDeltaFrame(self, msg):
+        self.checkLength(msg, 7)
+
+        base_id = struct.unpack('<H', msg[1:3])[0]
+        length = struct.unpack('<I', msg[3:7])[0]
+        end = 7 + length
+
+        self.checkLength(msg, end)
+
+        if self.keyframe is None or base_id != self.keyframe_id:
+            self.debug_print("missing keyframe {}. dropping delta".format(
+                base_id))
+            return msg[end:]
+
+        if len(self.keyframe) != self.leds.ledArraySize:
+            self.debug_print("keyframe {} has the wrong size. dropping "
+                             "delta".format(base_id))
+            return msg[end:]
+
+        self.charge(len(self.keyframe))
+        self.leds.changeColors(0, self.keyframe)
+        self.parseFrame(msg[7:end])
+
+        return msg[end:]
+
+    def frameReply(self, hashOnly):
+        """the reply to GetFrame, with a version 2 header"""
+        replier = LightProtocol()
+        replier.protocol_version = 0x02
+
+        if not hashOnly:
+            reply = replier.writeHeader(
+                replier.frameSnapshot(self.leds.ledsData))
+
+            if self.max_reply_length is None or \
+                    len(reply) <= self.max_reply_length:
+                return reply
+
+        return replier.writeHeader(replier.frameHash(self.leds.ledsData))
+
+    @LightParser.command(LightProtocolCommand.GetFrame)
+    def parseGetFrame(self, msg):
+        self.checkLength(msg, 2)
+
+        self.charge(self.leds.ledArraySize)
+
+        if self.reply:
+            self.reply(self.frameReply(msg[1]))
+        else:
+            self.debug_print("GetFrame: nowhere to send the reply")
+
+        return msg[2:]
+
+    @LightParser.command(LightProtocolCommand.FrameSnapshot)
+    def parseFrameSnapshot(self, msg):
+        self.checkLength(msg, 7)
+
+        numlights, length = struct.unpack('<HI', msg[1:7])
+        end = 7 + length
+
+        self.checkLength(msg, end)
+
+        if self._in_frame:
+            raise InvalidCommandException("frames can not be nested")
+
+        decoder = LightProtocol(leds=FrameBuffer(numlights))
+        decoder.max_cost = self.max_cost
+        decoder._in_frame = True
+
+        self.charge(numlights)
+        decoder.parseCommands(msg[7:end])
+        self.charge(decoder.cost)
+
+        if self.onFrameSnapshot:
+            self.onFrameSnapshot(decoder.leds.ledsData)
+
+        return msg[end:]
+
+    @LightParser.command(LightProtocolCommand.FrameHash)
+    def parseFrameHash(self, msg):
+        self.checkLength(msg, 11)
+
+        numlights = struct.unpack('<H', msg[1:3])[0]
+
+        if self.onFrameHash:
+            self.onFrameHash(numlights, bytes(msg[3:11]))
+
+        return msg[11:]
+
     @LightParser.command(LightProtocolCommand.SetDebug)
     def parseSetDebug(self, msg):
+        self.checkLength(msg, 2)
+
         debug = msg[1]
 
         self.debug = debug == 1
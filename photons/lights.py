@@ -6,6 +6,9 @@ import copy
 import math
 from array import array
 
+from photons.eventloop import resolveLoop, TaskSet
+from photons.instrumentation import metrics
+
 
 class Id:
     id = None
@@ -69,7 +72,7 @@ class Promise:
             self.promise.call()
 
         # this queues up the cleanup after promise.call
-        asyncio.get_event_loop().call_soon(Promise._promise_manager.remove, self)
+        resolveLoop().call_soon(Promise._promise_manager.remove, self)
 
 
 class Chase(Id):
@@ -209,18 +212,18 @@ class ConcurrentAnimation(BaseAnimation):
 
 
 class Delay(BaseAnimation):
-    def __init__(self, time):
+    def __init__(self, time, loop=None):
         BaseAnimation.__init__(self)
         # time in miliseconds:
         self.time = time
+        self.loop = loop
 
-    @asyncio.coroutine
-    def do_sleep(self):
-        yield from (asyncio.sleep(self.time / 1000.0))
+    async def do_sleep(self):
+        await asyncio.sleep(self.time / 1000.0)
         self.promise.call()
 
     def start(self):
-        asyncio.get_event_loop().create_task(self.do_sleep())
+        resolveLoop(self.loop).create_task(self.do_sleep())
 
         return self.promise
 
@@ -280,7 +283,7 @@ class ColorTransformAnimation(BaseAnimation):
 
     def start(self):
         BaseAnimation.start(self)
-        asyncio.get_event_loop().create_task(self._run())
+        self.leds.loop.create_task(self._run())
 
         return self.promise
 
@@ -308,7 +311,8 @@ class ColorTransformAnimation(BaseAnimation):
         animation.frame_index += 1
 
         if animation.frame_index >= animation.num_frames:
-            color = animation.targetColor
+            # land exactly on the target, not on the rounded sum of steps
+            animation.color[:] = animation.targetColor
             ret = True
             animation.complete()
 
@@ -324,8 +328,7 @@ class ColorTransformAnimation(BaseAnimation):
 
         return ret
 
-    @asyncio.coroutine
-    def _run(self):
+    async def _run(self):
         try:
             done_count = 0
             while done_count < len(self.animations):
@@ -334,7 +337,7 @@ class ColorTransformAnimation(BaseAnimation):
                     if self.change_color(animation):
                         done_count += 1
 
-                yield from (asyncio.sleep(1.0 / self.leds.fps))
+                await asyncio.sleep(1.0 / self.leds.fps)
         except KeyboardInterrupt:
             raise KeyboardInterrupt
         except Exception:
@@ -356,12 +359,49 @@ class ColorTransformAnimation(BaseAnimation):
 
 class LightFpsController:
 
-    def __init__(self, driver, fps=30, loop=asyncio.get_event_loop()):
+    def __init__(self, driver, fps=30, loop=None, autostart=True):
+        """
+        loop: event loop to run on.  Defaults to the current loop.
+
+        autostart: start() the update loop now.  Otherwise nothing is
+                   written to the driver until start() is called.
+        """
         self.driver = driver
-        self.loop = loop
+        self.loop = resolveLoop(loop)
+        self.tasks = TaskSet(self.loop)
         self.fps = fps
         self.needsUpdate = False
-        self.loop.create_task(self._updateLoop())
+
+        """
+        Master controls, applied to the output only.  ledsData is never
+        touched, so dimming is reversible.  The output level is
+        masterBrightness * masterFade, or 0 during blackout.
+        """
+        self._masterBrightness = 1.0
+        self._masterFade = 1.0
+        self._blackout = False
+        self._fadeId = 0
+        self._scaled = None
+        self._scaleBuffer = None
+
+        self._updateTask = None
+
+        if autostart:
+            self.start()
+
+    @property
+    def running(self):
+        return self._updateTask is not None
+
+    def start(self):
+        """start writing frames to the driver, fps times a second"""
+        if self._updateTask is None:
+            self._updateTask = self.tasks.create(self._updateLoop())
+
+    def stop(self):
+        """stop the update loop and cancel fades and transforms"""
+        self.tasks.cancel()
+        self._updateTask = None
 
     def update(self, data=None):
         if data is not None:
@@ -370,25 +410,131 @@ class LightFpsController:
         self.needsUpdate = True
 
     def updateNow(self):
-        self.driver.update(self.ledsData, force=True)
+        self.driver.update(self._outputFrame(), force=True)
+
+    @property
+    def masterBrightness(self):
+        return self._masterBrightness
+
+    @masterBrightness.setter
+    def masterBrightness(self, brightness):
+        self._masterBrightness = min(max(brightness, 0.0), 1.0)
+        self.needsUpdate = True
+
+    @property
+    def masterFade(self):
+        return self._masterFade
+
+    @masterFade.setter
+    def masterFade(self, fade):
+        self._masterFade = min(max(fade, 0.0), 1.0)
+        self.needsUpdate = True
+
+    @property
+    def blackout(self):
+        return self._blackout
+
+    @blackout.setter
+    def blackout(self, blackout):
+        self._blackout = blackout
+        self.needsUpdate = True
+
+    def masterLevel(self):
+        if self._blackout:
+            return 0.0
+
+        return self._masterBrightness * self._masterFade
+
+    def fadeTo(self, level, time):
+        """fade masterFade to level (0-1) over time (ms).  A newer fade
+           cancels this one"""
+        self._fadeId += 1
+
+        numFrames = max(int(self.fps * (time / 1000.0)), 1)
+        promise = Promise()
+
+        self.tasks.create(
+            self._doFade(self._fadeId, level, numFrames, promise))
+
+        return promise
+
+    async def _doFade(self, fadeId, level, numFrames, promise):
+        start = self._masterFade
+
+        for i in range(1, numFrames + 1):
+            await asyncio.sleep(1.0 / self.fps)
+
+            if fadeId != self._fadeId:
+                return
+
+            self.masterFade = start + (level - start) * i / numFrames
+
+        promise.call()
+
+    def _frame(self):
+        """the frame to output.  Subclasses may remap ledsData"""
+        return self.ledsData
+
+    def _outputFrame(self):
+        """the frame handed to the driver with master controls applied"""
+        frame = self._frame()
+        level = self.masterLevel()
+
+        if getattr(self.driver, "supportsMasterBrightness", False):
+            # the driver dims in hardware and tells us what is left to do
+            level = self.driver.setMasterBrightness(level)
+
+        if level >= 1.0:
+            return frame
+
+        if self._scaled is None or self._scaled.shape != frame.shape:
+            self._scaled = np.empty(frame.shape, np.uint8)
+            self._scaleBuffer = np.empty(frame.shape, np.uint16)
+
+        # fixed point: frame * level * 256 >> 8
+        np.multiply(frame, int(level * 256), out=self._scaleBuffer,
+                    dtype=np.uint16)
+        np.right_shift(self._scaleBuffer, 8, out=self._scaleBuffer)
+        np.copyto(self._scaled, self._scaleBuffer, casting='unsafe')
+
+        return self._scaled
+
+    async def _updateLoop(self):
+        lastTick = None
 
-    @asyncio.coroutine
-    def _updateLoop(self):
         while True:
             try:
                 if self.needsUpdate is True:
-                    self.driver.update(self.ledsData)
+                    started = metrics.start()
+                    self.driver.update(self._outputFrame())
                     self.needsUpdate = False
+                    metrics.observe("write_seconds", started,
+                                    driver=type(self.driver).__name__)
             except KeyboardInterrupt:
                 raise KeyboardInterrupt
 
-            yield from asyncio.sleep(1.0 / self.fps)
+            if metrics.enabled:
+                lastTick = self._countDroppedFrames(lastTick)
+
+            await asyncio.sleep(1.0 / self.fps)
+
+    def _countDroppedFrames(self, lastTick):
+        """count ticks missed because the loop was busy"""
+        now = self.loop.time()
+        period = 1.0 / self.fps
+
+        if lastTick is not None and now - lastTick > 2 * period:
+            metrics.count("dropped_frames",
+                          int((now - lastTick) / period) - 1)
+
+        return now
 
 
 class LightArray2(LightFpsController):
 
-    def __init__(self, ledArraySize, driver, fps=30, loop=asyncio.get_event_loop()):
-        LightFpsController.__init__(self, driver, fps, loop)
+    def __init__(self, ledArraySize, driver, fps=30, loop=None,
+                 autostart=True):
+        LightFpsController.__init__(self, driver, fps, loop, autostart)
         self.ledArraySize = 0
         self.ledsData = None
         self.setLedArraySize(ledArraySize)
@@ -413,6 +559,16 @@ class LightArray2(LightFpsController):
             self.ledsData[ledNumber] = color
             self.update()
 
+    def changeColors(self, startId, colors):
+        """set consecutive leds starting at startId to colors"""
+        with self.locker:
+            if self.driver.supportsChangeColor:
+                for i, color in enumerate(colors):
+                    self.driver.changeColor(startId + i, color)
+
+            self.ledsData[startId:startId + len(colors)] = colors
+            self.update()
+
     def color(self, ledNumber):
         with self.locker:
             return self.ledsData[ledNumber]
@@ -429,12 +585,11 @@ class LightArray2(LightFpsController):
         greenSteps = greenSteps / numFrames
 
         t = TransformToColor(led, color)
-        self.loop.create_task(self._doTransformColorTo(
+        self.tasks.create(self._doTransformColorTo(
             t, redSteps, greenSteps, blueSteps, numFrames))
         return t.promise
 
-    @asyncio.coroutine
-    def _doTransformColorTo(self, transform, redSteps, greenSteps, blueSteps, numFrames):
+    async def _doTransformColorTo(self, transform, redSteps, greenSteps, blueSteps, numFrames):
         color = self.ledsData[transform.led]
 
         steps = [redSteps, greenSteps, blueSteps]
@@ -448,7 +603,7 @@ class LightArray2(LightFpsController):
 
             self.changeColor(transform.led, color)
 
-            yield from (asyncio.sleep(1.0/self.fps))
+            await asyncio.sleep(1.0/self.fps)
 
         transform.complete()
 
@@ -457,10 +612,19 @@ class BaseDriver:
 
     def __init__(self):
         self.supportsChangeColor = False
+        self.supportsMasterBrightness = False
 
     def changeColor(self, id, color):
         pass
 
+    def setMasterBrightness(self, level):
+        """
+        Only called if supportsMasterBrightness.  Dim the output by level
+        (0-1) in hardware and return the level still to be applied to the
+        pixel data (1.0 if the hardware did all of it).
+        """
+        return level
+
     def update(self, ledsData, force=False):
         self.update(ledsData)
 
@@ -507,6 +671,9 @@ class Apa102Driver(BaseDriver):
             print("Apa102Driver: SPI not available.  Using FakeSPI")
             self.spiDev = FakeSpi()
 
+        # master brightness goes into the 5 bit global brightness field
+        self.supportsMasterBrightness = True
+
         # Global brightness setting 0-100%
         self.brightness = brightness
 
@@ -520,6 +687,7 @@ class Apa102Driver(BaseDriver):
         # Constant data structures:
         self.header = [0x00, 0x00, 0x00, 0x00]
         self.numLeds = None
+        self._frame = None
 
     def _end_frame(self):
         return [0x00] * (self.numLeds + 15 // 16)
@@ -545,6 +713,22 @@ class Apa102Driver(BaseDriver):
 
         return msb | brightness
 
+    def setMasterBrightness(self, level):
+        """
+        Dim with the 5 bit global brightness field.  The field is rounded
+        up and the rest (at most one step) is left to the caller.
+        """
+        full = self._calcGlobalBrightness(self._brightness) & 0b00011111
+        target = full * level
+        field = min(int(math.ceil(target)), full)
+
+        self._brightness_5bit = 0b11100000 | field
+
+        if field == 0:
+            return 1.0  # off anyway
+
+        return target / field
+
     def power(self, ledsData):
         return np.sum((ledsData / [255, 255, 255] * 0.2))
 
@@ -552,15 +736,16 @@ class Apa102Driver(BaseDriver):
         if self.numLeds is None:
             self.numLeds = len(ledsData)
 
+        if self._frame is None or len(self._frame) != len(ledsData):
+            self._frame = np.empty((len(ledsData), 4), np.uint8)
+
+        # [brightness][pixel data in pixel_order] per led
+        self._frame[:, 0] = self._brightness_5bit
+        self._frame[:, 1:] = ledsData[:, self.pixel_order]
+
         data = bytearray()
         data.extend(self.header)
-        po = self.pixel_order
-        brightness = self._brightness_5bit
-
-        for rgb in ledsData:
-            data.append(brightness)
-            # write pixel data
-            data.extend([rgb[po[0]], rgb[po[1]], rgb[po[2]]])
+        data.extend(self._frame.data)
 
         # endframe
         data.extend(self._end_frame())
@@ -570,13 +755,21 @@ class Apa102Driver(BaseDriver):
 
 class OpenCvSimpleDriver(BaseDriver):
 
-    def __init__(self, debug=None, size=50, wrap=100, opengl=False):
+    def __init__(self, debug=None, size=50, wrap=100, opengl=False,
+                 loop=None, maxWidth=1280):
+        """
+        size: pixels per led in the preview.  Smaller if a row of wrap leds
+              would be wider than maxWidth
+        """
         BaseDriver.__init__(self)
 
         self.debug = debug
         self.image = None
+        self.grid = None
+        self.dsize = None
         self.size = size
         self.wrap = wrap
+        self.maxWidth = maxWidth
 
         print("using size: {}".format(self.size))
 
@@ -584,47 +777,46 @@ class OpenCvSimpleDriver(BaseDriver):
 
         self.imshow = cv2.imshow
         self.waitKey = cv2.waitKey
+        self.resize = cv2.resize
+        self.INTER_NEAREST = cv2.INTER_NEAREST
 
         if opengl:
             cv2.namedWindow("output", cv2.WINDOW_OPENGL)
 
-        asyncio.get_event_loop().create_task(self.process_cv2_mainloop())
+        self.loop = resolveLoop(loop)
+        self.task = self.loop.create_task(self.process_cv2_mainloop())
 
     def update(self, ledsData, force=False):
-        width = len(ledsData) * self.size
-        height = self.size
-
-        if len(ledsData) > self.wrap:
-            width = int(self.wrap * self.size)
-            height = int(self.size * len(ledsData) / self.wrap)
-
-        if not isinstance(self.image, list):
-            self.image = np.zeros((height, width, 3), np.uint8)
-            self.imshow("output", self.image)
-
-        x = 0
-        i = 0
-        y = 0
-
-        for color in ledsData:
-            self.image[y: y + self.size, x: x + self.size] = color[::-1]
-            x += self.size
-            i += 1
-            if i > self.wrap:
-                y += self.size
-                x = 0
-                i = 0
+        numLeds = len(ledsData)
+        columns = min(numLeds, self.wrap)
+        rows = -(-numLeds // columns)
+
+        if self.grid is None or self.grid.shape[:2] != (rows, columns):
+            # one pixel per led, upscaled into the preview image
+            self.grid = np.zeros((rows, columns, 3), np.uint8)
+
+            size = max(1, min(self.size, self.maxWidth // columns))
+            self.dsize = (columns * size, rows * size)
+            self.image = np.zeros((self.dsize[1], self.dsize[0], 3), np.uint8)
+
+        pixels = self.grid.reshape(-1, 3)
+        pixels[:numLeds] = ledsData[:, ::-1]  # RGB -> BGR
+
+        self.resize(self.grid, self.dsize, dst=self.image,
+                    interpolation=self.INTER_NEAREST)
 
         self.imshow("output", self.image)
 
-        if force or not asyncio.get_event_loop().is_running():
+        if force or not self.loop.is_running():
             self.waitKey(1)
 
-    @asyncio.coroutine
-    def process_cv2_mainloop(self):
+    async def process_cv2_mainloop(self):
         while True:
             self.waitKey(1)
-            yield from asyncio.sleep(1.0 / 60.0)  # 60 fps...
+            await asyncio.sleep(1.0 / 60.0)  # 60 fps...
+
+    def close(self):
+        self.task.cancel()
 
 
 class DummyDriver(BaseDriver):
@@ -655,6 +847,18 @@ def getDriver(driverName=None):
     except ImportError:
         pass
 
+    try:
+        from photons.capture import CaptureDriver
+        drivers["Capture"] = CaptureDriver
+    except ImportError:
+        pass
+
+    try:
+        from photons.sharedmemory import SharedMemoryDriver
+        drivers["SharedMemory"] = SharedMemoryDriver
+    except ImportError:
+        pass
+
     try:
         from photons.serial import SerialDriver
         drivers['Serial'] = SerialDriver
@@ -685,4 +889,4 @@ if __name__ == "__main__":
     for i in range(10):
         lights.changeColor(i, (255, 255, 255))
 
-    asyncio.get_event_loop().run_forever()
+    lights.loop.run_forever()
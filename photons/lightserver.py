@@ -1,5 +1,7 @@
 import asyncio
-from photons.lightprotocol import LightProtocol
+from photons.eventloop import newEventLoop, resolveLoop, TaskSet
+from photons.instrumentation import metrics, startMetricsServer
+from photons.lightprotocol import LightProtocol, IncompatibleProtocolException
 
 
 def server_main(ServerClass, **kwargs):
@@ -16,38 +18,123 @@ def server_main(ServerClass, **kwargs):
     parser.add_argument('--sslkey', dest="sslkey",
                         default="server.key", nargs=1, help="ssl key")
     parser.add_argument('--port', help="port of server", default=1888)
+    parser.add_argument('--metrics-port', dest="metrics_port", type=int,
+                        help="serve performance metrics (prometheus text, "
+                        "or json at /metrics.json) on this port")
 
     args, unknown = parser.parse_known_args()
 
     if args.port:
         kwargs["port"] = args.port
 
+    if args.metrics_port:
+        startMetricsServer(args.metrics_port)
+
     s = ServerClass(useSsl=args.usessl, **kwargs)
     s.debug = args.debug
 
     return s
 
 
+class CostLimiter:
+    """
+    Token bucket per client.  Each client may spend rate cost per second
+    with bursts of up to burst.  Messages from a client in debt are
+    dropped before they are parsed until its bucket refills.
+    """
+
+    def __init__(self, rate, burst=None, max_clients=1024):
+        self.rate = rate
+        self.burst = burst or rate
+        self.max_clients = max_clients
+        self.buckets = {}
+
+    def _level(self, client, now):
+        level, last = self.buckets.pop(client, (self.burst, now))
+        level = min(self.burst, level + (now - last) * self.rate)
+
+        # most recently seen clients are last.  Forget the oldest.
+        if len(self.buckets) >= self.max_clients:
+            del self.buckets[next(iter(self.buckets))]
+
+        self.buckets[client] = (level, now)
+
+        return level
+
+    def allow(self, client, now):
+        return self._level(client, now) > 0
+
+    def spend(self, client, cost, now):
+        level = self._level(client, now)
+        self.buckets[client] = (level - cost, now)
+
+
 class LightServer(asyncio.Protocol):
 
-    def __init__(self, leds, port, iface="0.0.0.0", debug=False, **kwargs):
+    def __init__(self, leds, port, iface="0.0.0.0", debug=False,
+                 max_message_cost=16, cost_rate=None, loop=None, **kwargs):
+        """
+        Nothing runs until start() (or serve() from inside the loop).
+
+        max_message_cost: work a single message may do, in frames
+                          (ledArraySize leds written).  Messages over it
+                          are rejected before the command over the limit
+                          touches any leds.  None is unlimited.
+
+        cost_rate: frames of work per second each client may send.
+                   Messages from a client over its budget are dropped
+                   unparsed.  None is unlimited.
+        """
 
         self.leds = leds
         self.port = port
         self.iface = iface
         self.debug = debug
+        self.loop = resolveLoop(loop)
+        self.tasks = TaskSet(self.loop)
+        self.server = None
+        self._processTask = None
         self.parser = LightProtocol(leds=self.leds, debug=debug)
         self.queue = asyncio.Queue(maxsize=self.leds.fps * 5)
 
-        asyncio.get_event_loop().create_task(self._processQueue())
+        self.max_message_cost = max_message_cost
+        self.limiter = None
+
+        if cost_rate:
+            self.limiter = CostLimiter(cost_rate, cost_rate)
+
+        # tcp is a stream.  Frames are split out of this buffer
+        self.buffer = bytearray()
+        self.client = None
+        self.client_writer = None
 
     def start(self):
-        loop = asyncio.get_event_loop()
+        """start parsing and listening.  From inside the loop use serve()"""
+        self.loop.run_until_complete(self.serve())
+
+    async def serve(self):
+        self.startProcessing()
+        await self.listen()
+
+    async def listen(self):
+        self.server = await self.loop.create_server(
+            lambda: self, host=self.iface, port=self.port)
 
-        factory = loop.create_server(lambda: self,
-                                     host=self.iface, port=self.port)
+    def startProcessing(self):
+        """start parsing queued messages, once per frame"""
+        if self._processTask is None:
+            self._processTask = self.tasks.create(self._processQueue())
 
-        self.server = loop.run_until_complete(factory)
+    def stop(self):
+        """stop listening and cancel our tasks.  Queued messages are kept"""
+        self.tasks.cancel()
+        self._processTask = None
+
+        if self.server:
+            self.server.close()
+
+        if self.client_writer:
+            self.client_writer.close()
 
     def print_debug(self, msg):
         if self.debug:
@@ -59,6 +146,7 @@ class LightServer(asyncio.Protocol):
             self.print_debug("new connection!")
 
             self.client_writer = transport
+            self.client = transport.get_extra_info('peername')
 
         except Exception:
             import traceback
@@ -71,24 +159,104 @@ class LightServer(asyncio.Protocol):
     def data_received(self, data):
         self.print_debug("new data received")
 
+        metrics.count("bytes_received", len(data))
+
+        self.buffer.extend(data)
+
+        while True:
+            try:
+                length = LightProtocol.frameLength(self.buffer)
+            except IncompatibleProtocolException:
+                # we can't find the next frame boundary.  Start over.
+                self.buffer = bytearray()
+                return
+
+            if length is None:
+                return
+
+            if length > self.parser.max_message_length + 6:
+                # never buffer a frame we would refuse to parse
+                metrics.count("parse_errors", error="InvalidMessageLength")
+                self.print_debug("message length {} too long".format(length))
+                self.buffer = bytearray()
+                return
+
+            if len(self.buffer) < length:
+                return
+
+            frame = self.buffer[:length]
+            del self.buffer[:length]
+
+            self.queue_frame(frame, self.client)
+
+    def frameCost(self, frames):
+        """cost of frames worth of work for the current array size"""
+        return frames * max(self.leds.ledArraySize, 1) + 1024
+
+    def queue_frame(self, frame, client=None):
+        if self.limiter and not self.limiter.allow(
+                client, self.loop.time()):
+            metrics.count("rate_limited_messages")
+            return
+
         try:
-            self.queue.put_nowait(bytearray(data))
+            self.queue.put_nowait((frame, client))
         except asyncio.QueueFull:
-            pass  # drop message
-
-    @asyncio.coroutine
-    def _processQueue(self):
+            metrics.count("dropped_messages")  # drop message
+
+    async def _processQueue(self):
+        """
+        once per frame, parse everything that arrived since the last one.
+        The leds are written once per frame however many messages there
+        were.
+        """
         while True:
 
-            data = yield from self.queue.get()
+            batch = [(await self.queue.get())]
+
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            metrics.gauge("queue_depth", len(batch))
+
+            for data, client in batch:
+                self.parseMessage(data, client)
+
+            await asyncio.sleep(1 / self.leds.fps)
+
+    def parseMessage(self, data, client):
+        started = metrics.start()
+
+        self.parser.max_cost = None
+        self.parser.max_cost_frames = self.max_message_cost
+
+        if self.max_message_cost is not None:
+            self.parser.max_cost = self.frameCost(self.max_message_cost)
+
+        self.parser.reply = lambda msg: self.sendTo(client, msg)
+
+        try:
             self.parser.parse(data)
+        except Exception as ex:
+            metrics.count("parse_errors", error=type(ex).__name__)
+            self.print_debug("failed to parse message: {}".format(ex))
 
-            yield from asyncio.sleep(1 / self.leds.fps)
+        if self.limiter:
+            cost = self.parser.cost / max(self.leds.ledArraySize, 1)
+            self.limiter.spend(client, cost, self.loop.time())
+
+        metrics.observe("parse_seconds", started)
+
+    def sendTo(self, client, msg):
+        """send a reply to client"""
+        if self.client_writer and not self.client_writer.is_closing():
+            self.client_writer.write(msg)
 
     def close(self):
-        self.server.close()
-        asyncio.get_event_loop().run_until_complete(
-            self.server.wait_closed())
+        self.stop()
+
+        if self.server:
+            self.loop.run_until_complete(self.server.wait_closed())
 
 
 class LightServerUdp(LightServer):
@@ -96,17 +264,26 @@ class LightServerUdp(LightServer):
     def __init__(self, *args, **kwargs):
         LightServer.__init__(self, *args, **kwargs)
 
-    def start(self):
-        loop = asyncio.get_event_loop()
+        # replies must fit in one datagram
+        self.parser.max_reply_length = 60000
+
+    async def listen(self):
+        self.server, protocol = await self.loop.create_datagram_endpoint(
+            lambda: self, local_addr=(self.iface, self.port))
 
-        factory = loop.create_datagram_endpoint(lambda: self,
-                                                local_addr=(self.iface,
-                                                            self.port))
+    def close(self):
+        # a datagram transport has nothing to wait for
+        self.stop()
 
-        self.server, protocol = loop.run_until_complete(factory)
+    def sendTo(self, client, msg):
+        if client is not None:
+            self.server.sendto(msg, client)
 
     def datagram_received(self, data, addr):
-        LightServer.data_received(self, data)
+        metrics.count("bytes_received", len(data))
+
+        # one datagram is one frame
+        self.queue_frame(bytearray(data), addr)
 
 
 if __name__ == "__main__":
@@ -117,9 +294,14 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--udp', dest="udp",
                         help="use udp.", action='store_true')
+    parser.add_argument('--uvloop', dest="uvloop",
+                        help="use uvloop if installed.", action='store_true')
 
     args, unknown = parser.parse_known_args()
 
+    loop = newEventLoop(uvloop=args.uvloop)
+    asyncio.set_event_loop(loop)
+
     num_lights = 200
 
     leds = LightArray2(num_lights, OpenCvSimpleDriver(), fps=60)
@@ -133,6 +315,7 @@ if __name__ == "__main__":
 
     server.start()
 
-    asyncio.get_event_loop().run_forever()
-
-    server.close()
+    try:
+        loop.run_forever()
+    finally:
+        server.close()
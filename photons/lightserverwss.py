@@ -1,51 +1,190 @@
 import asyncio
-from wss.wssserver import Server, server_main
+import numpy as np
 
+from photons.eventloop import newEventLoop
+from photons.instrumentation import metrics
+from photons.lightprotocol import LightProtocol
+from photons.lightserver import LightServer, LightServerUdp, server_main
 
-class LightServerWss(Server):
-    def __init__(self, leds=None, port=None, iface="localhost",
-                 useSsl=False, sslCert="server.crt",
-                 sslKey="server.key", debug=False):
-        self.leds = leds
+try:
+    from wss.wssserver import Server
+except ImportError:
+    Server = None
+
+
+class LocalServer:
+    """
+    In process stand-in for wss.wssserver.Server.  Clients are plain
+    objects and everything sent to one is appended to its received list.
+    Use it for tests and for driving a LightServerWss without a network.
+    """
+
+    class Client:
+
+        def __init__(self):
+            self.received = []
+
+    def __init__(self, port=None, useSsl=False, sslCert=None, sslKey=None):
         self.port = port
-        self.iface = iface
+        self.clients = []
+
+    def start(self):
+        pass
+
+    def close(self):
+        self.clients = []
 
-        # Keep about 5 seconds worth of data
-        self.queue = asyncio.Queue(maxsize=self.leds.fps * 5)
+    def connect(self):
+        client = LocalServer.Client()
+        self.clients.append(client)
 
-        self.parser = LightProtocol(leds=self.leds, debug=debug)
+        return client
 
-        Server.__init__(self, port=port, useSsl=useSsl,
-                        sslCert=sslCert, sslKey=sslKey)
+    def disconnect(self, client):
+        self.clients.remove(client)
 
-        asyncio.get_event_loop().create_task(self._processQueue())
+    def onMessage(self, msg, fromClient):
+        """This is intended to be overridden"""
+        pass
 
     def onBinaryMessage(self, msg, fromClient):
-        data = bytearray()
-        data.extend(msg)
+        """This is intended to be overridden"""
+        pass
+
+    def sendTextMsg(self, msg, toClient):
+        self._send(msg, toClient)
+
+    def sendBinaryMsg(self, msg, toClient):
+        self._send(msg, toClient)
 
+    def _send(self, msg, toClient):
+        if toClient not in self.clients:
+            raise ConnectionError("client is not connected")
+
+        toClient.received.append(msg)
+
+
+class LightServerWss(LightServer):
+    """
+    LightServer over websockets.  Binary messages are protocol messages,
+    parsed a frame's worth at a time like LightServer.
+
+    A client that sends the text message "preview" becomes a viewer.  It
+    gets a FrameSnapshot of the leds and after that only the pixels that
+    changed, as protocol messages, at most preview_fps times a second.
+    "nopreview" stops it.
+    """
+
+    def __init__(self, leds=None, port=None, iface="localhost",
+                 useSsl=False, sslCert="server.crt",
+                 sslKey="server.key", debug=False, preview_fps=15,
+                 ServerClass=None, **kwargs):
         """
-        self.print_debug("message length: {}".format(len(data)))
-        self.print_debug("message data: {}".format(hexlify(data)))
+        ServerClass: websocket server to use.  Defaults to
+                     wss.wssserver.Server.  LocalServer needs no network.
         """
+        ServerClass = ServerClass or Server
 
-        try:
-            self.queue.put_nowait(data)
-        except asyncio.QueueFull:
-            pass  # drop message
+        if ServerClass is None:
+            raise ImportError("LightServerWss requires wss (python-wss)")
 
-    @asyncio.coroutine
-    def _processQueue(self):
-        while True:
+        LightServer.__init__(self, leds, port, iface=iface, debug=debug,
+                             **kwargs)
+
+        self.server = ServerClass(port=port, useSsl=useSsl,
+                                  sslCert=sslCert, sslKey=sslKey)
+        self.server.onMessage = self.onMessage
+        self.server.onBinaryMessage = self.onBinaryMessage
+
+        self.preview_fps = preview_fps
+
+        # client: True once it has been sent a snapshot
+        self.viewers = {}
+        self.previewer = LightProtocol()
+        self.previewer.protocol_version = 0x02
+        self.previewBase = None
+        self._previewTask = None
 
-            data = yield from self.queue.get()
-            self.parser.parse(data)
+    def start(self):
+        self.startProcessing()
+        self.server.start()
 
-            yield from asyncio.sleep(1 / self.leds.fps)
+    def startProcessing(self):
+        LightServer.startProcessing(self)
+
+        if self.preview_fps and self._previewTask is None:
+            self._previewTask = self.tasks.create(self._previewLoop())
+
+    def stop(self):
+        LightServer.stop(self)
+        self._previewTask = None
+
+    def close(self):
+        self.stop()
+
+    def onMessage(self, msg, fromClient):
+        if msg == "preview":
+            self.viewers[fromClient] = False
+        elif msg == "nopreview":
+            self.viewers.pop(fromClient, None)
+
+    def onBinaryMessage(self, msg, fromClient):
+        metrics.count("bytes_received", len(msg))
+
+        self.queue_frame(bytearray(msg), fromClient)
+
+    def sendTo(self, client, msg):
+        self.server.sendBinaryMsg(bytes(msg), client)
+
+    def sendPreview(self):
+        """send viewers what changed since the last preview"""
+        if not self.viewers:
+            self.previewBase = None
+            return
+
+        frame = self.leds.ledsData
+        delta = None
+
+        if self.previewBase is not None and \
+                self.previewBase.shape == frame.shape:
+            if all(self.viewers.values()) and \
+                    np.array_equal(self.previewBase, frame):
+                return
+
+            delta = self.previewer.writeHeader(
+                self.previewer._encodeFramePayload(frame, self.previewBase))
+
+        snapshot = None
+
+        for client, synced in list(self.viewers.items()):
+            if synced and delta is not None:
+                msg = delta
+            else:
+                if snapshot is None:
+                    snapshot = self.previewer.writeHeader(
+                        self.previewer.frameSnapshot(frame))
+                msg = snapshot
+
+            try:
+                self.sendTo(client, msg)
+                self.viewers[client] = True
+            except Exception as ex:
+                self.print_debug("dropping viewer: {}".format(ex))
+                del self.viewers[client]
+
+            metrics.count("preview_bytes", len(msg))
+
+        self.previewBase = np.array(frame, copy=True)
+
+    async def _previewLoop(self):
+        while True:
+            await asyncio.sleep(1 / self.preview_fps)
+
+            self.sendPreview()
 
 
 if __name__ == "__main__":
-    from photons import LightArray2, OpenCvSimpleDriver, DummyDriver
+    from photons import LightArray2, OpenCvSimpleDriver
 
     import argparse
 
@@ -54,9 +193,14 @@ if __name__ == "__main__":
                         help="use wss.", action='store_true')
     parser.add_argument('--udp', dest="udp",
                         help="use udp.", action='store_true')
+    parser.add_argument('--uvloop', dest="uvloop",
+                        help="use uvloop if installed.", action='store_true')
 
     args, unknown = parser.parse_known_args()
 
+    loop = newEventLoop(uvloop=args.uvloop)
+    asyncio.set_event_loop(loop)
+
     num_lights = 200
 
     leds = LightArray2(num_lights, OpenCvSimpleDriver(opengl=True), fps=60)
@@ -73,6 +217,7 @@ if __name__ == "__main__":
 
     server.start()
 
-    asyncio.get_event_loop().run_forever()
-
-    server.close()
+    try:
+        loop.run_forever()
+    finally:
+        server.close()
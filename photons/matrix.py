@@ -1,4 +1,5 @@
 from photons import LightFpsController
+import json
 import numpy as np
 
 def invert_rows(img):
@@ -13,27 +14,161 @@ def invert_rows(img):
 
 		return inverted_img
 
+class MatrixLayout:
+	"""
+	Describes how the leds of a panel are wired.  wiring[y, x] is the index
+	(in driver order) of the led showing pixel (x, y) of a frame.
+
+	Layouts are compiled once by indexMap() into a flat permutation, so a
+	row-major frame is put in driver order with a single np.take.
+	"""
+
+	def __init__(self, wiring):
+		self.wiring = np.asarray(wiring, np.intp)
+
+		if self.wiring.ndim != 2:
+			raise ValueError("wiring must be a 2d array of led indices")
+
+		if not np.array_equal(np.sort(self.wiring, axis=None), np.arange(self.wiring.size)):
+			raise ValueError("wiring must use every led index exactly once")
+
+	@property
+	def width(self):
+		return self.wiring.shape[1]
+
+	@property
+	def height(self):
+		return self.wiring.shape[0]
+
+	@staticmethod
+	def rowMajor(width, height):
+		return MatrixLayout(np.arange(width * height).reshape(height, width))
+
+	@staticmethod
+	def serpentine(width, height):
+		"""rows wired back and forth. Same as invert_rows()"""
+		wiring = np.arange(width * height).reshape(height, width)
+		wiring[1::2] = wiring[1::2, ::-1]
+
+		return MatrixLayout(wiring)
+
+	@staticmethod
+	def columnMajor(width, height, serpentine=False):
+		wiring = np.arange(width * height).reshape(width, height)
+
+		if serpentine:
+			wiring[1::2] = wiring[1::2, ::-1]
+
+		return MatrixLayout(wiring.T)
+
+	@staticmethod
+	def tiled(panel, tiles_x, tiles_y, serpentine=False):
+		"""
+		tiles_x * tiles_y copies of "panel" chained left to right, top to
+		bottom.  With serpentine, every other row of panels is chained
+		right to left.
+		"""
+		size = panel.wiring.size
+		rows = []
+
+		for ty in range(tiles_y):
+			order = range(tiles_x)
+
+			if serpentine and ty % 2:
+				order = reversed(order)
+
+			row = [None] * tiles_x
+
+			for n, tx in enumerate(order):
+				row[tx] = panel.wiring + (ty * tiles_x + n) * size
+
+			rows.append(np.hstack(row))
+
+		return MatrixLayout(np.vstack(rows))
+
+	@staticmethod
+	def load(path):
+		"""
+		load a custom wiring map.  .npy files are loaded with np.load, .json
+		files must contain a list of rows (or {"wiring": rows}).  Anything
+		else is read as whitespace separated text, one row per line.
+		"""
+		if path.endswith(".npy"):
+			return MatrixLayout(np.load(path))
+
+		if path.endswith(".json"):
+			with open(path, 'r') as f:
+				wiring = json.load(f)
+
+			if isinstance(wiring, dict):
+				wiring = wiring["wiring"]
+
+			return MatrixLayout(wiring)
+
+		return MatrixLayout(np.loadtxt(path, dtype=np.intp, ndmin=2))
+
+	def rotated(self, k=1):
+		"""panel mounted rotated by k * 90 degrees counter clockwise"""
+		return MatrixLayout(np.rot90(self.wiring, k))
+
+	def mirrored(self, horizontal=True):
+		if horizontal:
+			return MatrixLayout(self.wiring[:, ::-1])
+
+		return MatrixLayout(self.wiring[::-1])
+
+	def indexMap(self):
+		"""output[led] = frame[indexMap()[led]] for a flattened frame"""
+		index_map = np.empty(self.wiring.size, np.intp)
+		index_map[self.wiring.ravel()] = np.arange(self.wiring.size)
+
+		return index_map
+
 class Matrix(LightFpsController):
 
-	def __init__(self, driver=None, width=16, height=9, fps=30, invert_rows_on_update = False):
-		LightFpsController.__init__(self, driver = driver, fps = fps)
+	def __init__(self, driver=None, width=16, height=9, fps=30, invert_rows_on_update = False, layout=None, loop=None, autostart=True):
+		LightFpsController.__init__(self, driver = driver, fps = fps, loop = loop, autostart = autostart)
 		self.height = height
 		self.width = width
 		self.ledsData = np.zeros((height*width, 3), np.uint8)
 		self.ledArraySize = width * height
 		self.invert_rows_on_update = invert_rows_on_update
 
+		if layout is None and invert_rows_on_update:
+			layout = MatrixLayout.serpentine(width, height)
+
+		self.setLayout(layout)
+
+	def setLayout(self, layout):
+		"""remap frames with a MatrixLayout before they reach the driver"""
+		self.layout = layout
+		self.index_map = None
+		self.output = None
+
+		if layout is None:
+			return
+
+		if layout.width != self.width or layout.height != self.height:
+			raise ValueError("layout is {}x{}, matrix is {}x{}".format(
+				layout.width, layout.height, self.width, self.height))
+
+		self.index_map = layout.indexMap()
+		self.output = np.empty_like(self.ledsData)
+
 	def update(self, frame=None):
 		if frame is not None:
 			h, w, l = frame.shape
 			self.ledsData = np.reshape(frame, (h*w, 3))
 
-		if self.invert_rows_on_update:
-			frame = np.reshape(self.ledsData, (self.height, self.width, 3))		
-			frame = invert_rows(frame)
-			frame = np.reshape(frame, (self.height * self.width, 3))
+		LightFpsController.update(self)
 
-		LightFpsController.update(self, frame)
+	def _frame(self):
+		if self.index_map is None:
+			return self.ledsData
+
+		np.take(self.ledsData, self.index_map, axis=0, out=self.output)
+
+		return self.output
 
 	def color(self, led_index):
 		return self.ledsData[led_index]
@@ -45,6 +180,10 @@ class Matrix(LightFpsController):
 		self.ledsData[led_index] = color
 		self.update()
 
+	def changeColors(self, startId, colors):
+		self.ledsData[startId:startId + len(colors)] = colors
+		self.update()
+
 	def changeColorMatrix(self, x, y, color):
 		pos = x + (y * self.width) - 1
 		self.ledsData[pos] = color
@@ -52,4 +191,4 @@ class Matrix(LightFpsController):
 
 	def clear(self):
 		self.ledsData[:] = [0, 0, 0]
-		self.update()
\ No newline at end of file
+		self.update()
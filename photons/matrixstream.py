@@ -0,0 +1,193 @@
+import asyncio
+import collections
+import functools
+import queue
+import threading
+import numpy as np
+
+from photons.eventloop import resolveLoop
+
+
+@functools.lru_cache(maxsize=16)
+def _areaWeights(size_in, size_out):
+    """
+    (size_out, size_in) matrix averaging input pixels into output pixels
+    weighted by how much of each input pixel an output pixel covers.
+    """
+    scale = size_in / size_out
+    edges = np.arange(size_out + 1) * scale
+    pixels = np.arange(size_in)
+
+    overlap = np.minimum(pixels[None, :] + 1, edges[1:, None]) - \
+        np.maximum(pixels[None, :], edges[:-1, None])
+
+    return (np.clip(overlap, 0, None) / scale).astype(np.float32)
+
+
+def areaDownscale(frame, width, height):
+    """resize a HxWx3 frame to height x width x 3 by area averaging"""
+    h, w, l = frame.shape
+
+    if (h, w) == (height, width):
+        # a copy: frame may be a read-only view (eg. of a memmap)
+        return np.array(frame, np.uint8)
+
+    rows = _areaWeights(h, height) @ frame.reshape(h, w * l).astype(
+        np.float32)
+    rows = rows.reshape(height, w, l)
+
+    resized = np.einsum('xw,ywl->yxl', _areaWeights(w, width), rows)
+
+    return np.clip(np.rint(resized), 0, 255).astype(np.uint8)
+
+
+class RawVideoReader:
+    """
+    frames from a file of raw, headerless width x height RGB24 frames (eg.
+    ffmpeg -f rawvideo -pix_fmt rgb24).  The file is memory mapped so
+    frames are only read when used.
+    """
+
+    def __init__(self, path, width, height):
+        data = np.memmap(path, np.uint8, 'r')
+        frame_size = width * height * 3
+
+        self.frames = data[:len(data) // frame_size * frame_size].reshape(
+            -1, height, width, 3)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, index):
+        return self.frames[index]
+
+
+class ImageSequenceReader:
+    """frames decoded from a list of image files with OpenCV"""
+
+    def __init__(self, paths):
+        import cv2
+
+        self.imread = cv2.imread
+        self.paths = list(paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        image = self.imread(self.paths[index])
+
+        if image is None:
+            raise IOError("failed to read {}".format(self.paths[index]))
+
+        return image[:, :, ::-1]  # BGR -> RGB
+
+
+class MatrixStream:
+    """
+    Streams frames from "source" into a Matrix, one frame per matrix frame.
+
+    source is either a reader (anything with __len__ and __getitem__
+    returning HxWx3 RGB frames, like RawVideoReader) or any iterable of
+    frames, like a generator.
+
+    A worker thread decodes and downscales frames ahead of time into a
+    queue of "prefetch" frames, so decoding never stalls the event loop.
+    Resized frames from readers are kept in an LRU cache of "cache_size"
+    frames, so short looping clips are only decoded once.  If the worker
+    falls behind, the matrix keeps showing the previous frame.
+    """
+
+    def __init__(self, matrix, source, repeat=True, cache_size=64,
+                 prefetch=8, loop=None):
+        self.matrix = matrix
+        self.source = source
+        self.repeat = repeat
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+        self.frames = queue.Queue(maxsize=prefetch)
+        self.running = False
+        self.finished = False
+        self.dropped = 0
+        self.loop = resolveLoop(loop)
+        self.task = None
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._prefetch, daemon=True)
+        self.thread.start()
+
+        self.task = self.loop.create_task(self._run())
+
+    def stop(self):
+        self.running = False
+
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def _resize(self, frame):
+        return areaDownscale(np.asarray(frame), self.matrix.width,
+                             self.matrix.height)
+
+    def _cached(self, index):
+        frame = self.cache.get(index)
+
+        if frame is not None:
+            self.cache.move_to_end(index)
+            return frame
+
+        frame = self._resize(self.source[index])
+
+        self.cache[index] = frame
+
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return frame
+
+    def _frames(self):
+        if not hasattr(self.source, "__getitem__"):
+            for frame in self.source:
+                yield self._resize(frame)
+            return
+
+        if not len(self.source):
+            # nothing to repeat.  Looping would spin forever
+            return
+
+        while True:
+            for index in range(len(self.source)):
+                yield self._cached(index)
+
+            if not self.repeat:
+                return
+
+    def _prefetch(self):
+        """worker thread"""
+        for frame in self._frames():
+            while self.running:
+                try:
+                    self.frames.put(frame, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+            if not self.running:
+                return
+
+        self.finished = True
+
+    async def _run(self):
+        while self.running:
+            try:
+                self.matrix.update(self.frames.get_nowait())
+            except queue.Empty:
+                if self.finished:
+                    self.running = False
+                    return
+
+                self.dropped += 1
+
+            await asyncio.sleep(1.0 / self.matrix.fps)
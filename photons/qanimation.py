@@ -106,6 +106,6 @@ if __name__ == "__main__":
 
 	transform()
 
-	asyncio.get_event_loop().run_forever()
+	leds.loop.run_forever()
 
 
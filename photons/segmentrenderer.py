@@ -0,0 +1,145 @@
+import asyncio
+import concurrent.futures
+import os
+import numpy as np
+
+from photons.eventloop import resolveLoop
+from photons.instrumentation import metrics
+from photons.sharedmemory import SharedFrameBuffer
+
+
+# framebuffers attached by worker processes, by name
+_worker_framebuffers = {}
+
+
+def _renderSegment(name, buffer_index, render, frame, start, length):
+    """runs in a worker process"""
+    framebuffer = _worker_framebuffers.get(name)
+
+    if framebuffer is None:
+        framebuffer = SharedFrameBuffer(name)
+        _worker_framebuffers[name] = framebuffer
+
+    segment = framebuffer.buffers[buffer_index][start:start + length]
+    segment[:] = render(frame, start, length)
+
+
+class SegmentedRenderer:
+    """
+    Renders a large pixel space with a pool of worker processes.
+
+    The leds are split into "segments" consecutive segments.  For every
+    frame, render(frame, start, length) is called in a worker for each
+    segment and returns a (length, 3) array of colors for leds
+    [start, start + length).  render must be picklable, ie. a module level
+    function or an instance of a module level class.
+
+    Workers write straight into the back buffer of a SharedFrameBuffer.  The
+    frame is only published once every segment of it is done, so segments
+    never tear against each other.  Published frames are copied into leds
+    (a LightArray2 or Matrix) if given.  Other processes can read them with
+    SharedMemoryLightArray(name).
+    """
+
+    def __init__(self, render, ledArraySize, fps=30, segments=None,
+                 leds=None, name=None, loop=None):
+        self.render = render
+        self.ledArraySize = ledArraySize
+        self.fps = fps
+        self.leds = leds
+        self.loop = resolveLoop(loop)
+        self.task = None
+        self.frame = 0
+        self.running = False
+
+        if not segments:
+            segments = os.cpu_count()
+
+        bounds = np.linspace(0, ledArraySize, segments + 1).astype(int)
+        self.segments = [(int(start), int(end - start))
+                         for start, end in zip(bounds[:-1], bounds[1:])
+                         if end > start]
+
+        if not name:
+            name = "photons-segments-{}".format(os.getpid())
+
+        self.name = name
+        self.framebuffer = SharedFrameBuffer(name, ledArraySize, create=True)
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=len(self.segments))
+
+    def start(self):
+        self.running = True
+        self.task = self.loop.create_task(self._run())
+
+    def stop(self):
+        self.running = False
+
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def renderFrame(self):
+        """render the next frame in all workers and publish it"""
+        started = metrics.start()
+        buffer_index = self.framebuffer.beginWrite()
+
+        futures = [self.pool.submit(_renderSegment, self.name, buffer_index,
+                                    self.render, self.frame, start, length)
+                   for start, length in self.segments]
+
+        try:
+            # let every worker finish before the buffer is touched again
+            results = await asyncio.gather(
+                *[asyncio.wrap_future(f, loop=self.loop) for f in futures],
+                return_exceptions=True)
+        except asyncio.CancelledError:
+            await self._waitForWorkers(futures)
+            self.framebuffer.abortWrite()
+            raise
+
+        errors = [r for r in results if isinstance(r, BaseException)]
+
+        if errors:
+            # never publish a half rendered frame
+            self.framebuffer.abortWrite()
+            raise errors[0]
+
+        self.framebuffer.endWrite()
+
+        self.frame += 1
+        metrics.observe("render_seconds", started)
+
+        if self.leds is not None:
+            np.copyto(self.leds.ledsData, self.framebuffer.frame()[1])
+            self.leds.update()
+
+    async def _waitForWorkers(self, futures):
+        """
+        wait for segments already running.  Cancelling only stops the ones
+        that haven't started, the rest keep writing into the back buffer
+        """
+        running = asyncio.gather(
+            *[asyncio.wrap_future(f, loop=self.loop) for f in futures],
+            return_exceptions=True)
+
+        while not running.done():
+            try:
+                await asyncio.shield(running)
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while self.running:
+            started = self.loop.time()
+
+            await self.renderFrame()
+
+            elapsed = self.loop.time() - started
+            await asyncio.sleep(max(0, 1.0 / self.fps - elapsed))
+
+    def close(self):
+        self.stop()
+        self.pool.shutdown()
+        self.framebuffer.close()
+        self.framebuffer.unlink()
@@ -0,0 +1,210 @@
+import asyncio
+import numpy as np
+from multiprocessing import shared_memory
+
+from photons.lights import BaseDriver, LightFpsController
+
+
+# segments created (and not yet unlinked) by this process
+_created = set()
+
+
+def _create(name, size):
+    """create shared memory.  A segment of the same name left over from a
+       process that died without unlinking it is replaced"""
+    try:
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+    except FileExistsError:
+        stale = shared_memory.SharedMemory(name=name)
+        stale.close()
+        stale.unlink()
+
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+    _created.add(name)
+
+    return shm
+
+
+def _attach(name):
+    """attach to existing shared memory without handing it to the resource
+       tracker, which would unlink it when this process exits"""
+    import multiprocessing
+    from multiprocessing import resource_tracker
+
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+
+    shm = shared_memory.SharedMemory(name=name)
+
+    # child processes share the tracker of the process that created it, and
+    # the creator's own registration must stay for its unlink()
+    if multiprocessing.parent_process() is None and name not in _created:
+        resource_tracker.unregister(shm._name, "shared_memory")
+
+    return shm
+
+
+class SharedFrameBuffer:
+    """
+    Double buffered frame in shared memory for passing frames from one
+    writer process to any number of reader processes without copies.
+
+    Layout:
+
+    [seq][ledArraySize][buffer 0][buffer 1]
+    [uint64][uint64][ledArraySize * 3 bytes][ledArraySize * 3 bytes]
+
+    seq is a seqlock: it is odd while the writer fills a buffer.  Frame n
+    lives in buffer n % 2, so the newest complete frame can be read while
+    the next one is written.  A reader only races the writer if two more
+    frames are written while it still holds its buffer, which
+    wasOverwritten() reports.
+    """
+
+    headerSize = 16
+
+    def __init__(self, name, ledArraySize=None, create=False):
+        self.name = name
+
+        if create:
+            size = self.headerSize + 2 * ledArraySize * 3
+            self.shm = _create(name, size)
+        else:
+            self.shm = _attach(name)
+
+        self.header = np.ndarray((2,), np.uint64, buffer=self.shm.buf)
+
+        if create:
+            self.header[:] = [0, ledArraySize]
+
+        self.ledArraySize = int(self.header[1])
+        self.buffers = np.ndarray((2, self.ledArraySize, 3), np.uint8,
+                                  buffer=self.shm.buf, offset=self.headerSize)
+
+    @property
+    def seq(self):
+        return int(self.header[0])
+
+    def beginWrite(self):
+        """start writing the next frame.  Returns the index of the buffer to
+           fill.  Several processes may fill parts of it before endWrite()"""
+        seq = self.seq
+        self.header[0] = seq + 1
+
+        return (seq // 2 + 1) % 2
+
+    def endWrite(self):
+        """publish the frame started with beginWrite()"""
+        self.header[0] = self.seq + 1
+
+    def abortWrite(self):
+        """
+        give up the frame started with beginWrite().  The previous frame
+        is published again in its place, so seq only ever moves forward
+        and wasOverwritten() stays right for readers.
+        """
+        seq = self.seq
+        previous = self.buffers[(seq // 2) % 2]
+        np.copyto(self.buffers[(seq // 2 + 1) % 2], previous)
+        self.header[0] = seq + 1
+
+    def write(self, ledsData):
+        np.copyto(self.buffers[self.beginWrite()], ledsData)
+        self.endWrite()
+
+    def frame(self):
+        """newest complete frame as (frame number, view into shared memory)"""
+        frame = self.seq // 2
+
+        return frame, self.buffers[frame % 2]
+
+    def wasOverwritten(self, frame):
+        """true if the writer started writing over "frame" since frame()"""
+        return self.seq >= 2 * frame + 3
+
+    def close(self):
+        self.header = None
+        self.buffers = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+        _created.discard(self.name)
+
+
+class SharedMemoryDriver(BaseDriver):
+    """
+    Producer side: publishes every frame to a SharedFrameBuffer.  The
+    buffer is created on the first update unless ledArraySize is given.
+    """
+
+    def __init__(self, name="photons", ledArraySize=None, debug=False,
+                 **kwargs):
+        BaseDriver.__init__(self)
+        self.name = name
+        self.debug = debug
+        self.framebuffer = None
+
+        if ledArraySize:
+            self._create(ledArraySize)
+
+    def _create(self, ledArraySize):
+        if self.debug:
+            print("SharedMemoryDriver: creating {} ({} leds)".format(
+                self.name, ledArraySize))
+
+        self.framebuffer = SharedFrameBuffer(self.name, ledArraySize,
+                                             create=True)
+
+    def update(self, ledsData, force=False):
+        if self.framebuffer is None:
+            self._create(len(ledsData))
+
+        self.framebuffer.write(ledsData)
+
+    def close(self):
+        if self.framebuffer:
+            self.framebuffer.close()
+            self.framebuffer.unlink()
+            self.framebuffer = None
+
+
+class SharedMemoryLightArray(LightFpsController):
+    """
+    Consumer side: hands the newest frame from a SharedFrameBuffer to
+    driver at fps.  The driver gets a view into shared memory, not a copy.
+    If the producer overwrote the frame while the driver was using it, the
+    frame is sent again on the next tick.  So is the current frame when a
+    master control (brightness, fade, blackout) changes.
+    """
+
+    def __init__(self, name, driver, fps=30, loop=None, autostart=True):
+        self.framebuffer = SharedFrameBuffer(name)
+        self.ledArraySize = self.framebuffer.ledArraySize
+        self.frame_index, self.ledsData = self.framebuffer.frame()
+        self.frame_index = -1
+
+        LightFpsController.__init__(self, driver, fps, loop, autostart)
+
+    async def _updateLoop(self):
+        while True:
+            frame_index, self.ledsData = self.framebuffer.frame()
+
+            # needsUpdate: a master control changed with no new frame
+            if frame_index != self.frame_index or self.needsUpdate:
+                self.needsUpdate = False
+                self.driver.update(self._outputFrame())
+
+                if self.framebuffer.wasOverwritten(frame_index):
+                    self.frame_index = -1
+                else:
+                    self.frame_index = frame_index
+
+            await asyncio.sleep(1.0 / self.fps)
+
+    def close(self):
+        self.stop()
+        self.framebuffer.close()
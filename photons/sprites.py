@@ -0,0 +1,182 @@
+import math
+import numpy as np
+
+from photons.layers import Layer, BlendMode
+
+
+class Edge:
+    Bounce = "bounce"
+    Wrap = "wrap"
+
+
+class Profile:
+    Flat = "flat"
+    Triangle = "triangle"
+    Gaussian = "gaussian"
+
+
+class Sprite:
+    """
+    A moving segment of light.
+
+    position: center, in pixels (pixel i covers [i, i + 1))
+    velocity: pixels per frame
+    width: in pixels, may be fractional
+    profile: brightness across the width (@see Profile)
+    trail: brightness kept per frame behind the sprite (0 - 1).  0 means
+           no trail, 0.8 leaves a tail fading by 20% per frame
+    bounds: (lo, hi) range to move in.  None uses the whole strip
+    edge: what happens at the bounds (@see Edge)
+    """
+
+    def __init__(self, position=0.0, velocity=1.0, width=1.0,
+                 color=(255, 255, 255), profile=Profile.Flat, trail=0.0,
+                 bounds=None, edge=Edge.Bounce):
+        self.position = float(position)
+        self.velocity = float(velocity)
+        self.width = float(width)
+        self.color = color
+        self.profile = profile
+        self.trail = trail
+        self.bounds = bounds
+        self.edge = edge
+
+    def step(self, bounds):
+        lo, hi = self.bounds or bounds
+        self.position += self.velocity
+
+        if self.edge == Edge.Wrap:
+            self.position = lo + (self.position - lo) % (hi - lo)
+            return
+
+        half = self.width / 2
+
+        if self.position - half < lo:
+            self.position = 2 * (lo + half) - self.position
+            self.velocity = abs(self.velocity)
+
+        elif self.position + half > hi:
+            self.position = 2 * (hi - half) - self.position
+            self.velocity = -abs(self.velocity)
+
+
+class SpriteLayer(Layer):
+    """
+    Layer that moves and draws Sprites every frame.
+
+    All sprites are rasterized together: each gets a window of pixels
+    around it, intensities for every (sprite, pixel) pair are computed in
+    one set of array ops and summed into the layer with np.bincount.
+    Flat sprites are anti-aliased by pixel coverage, so they move smoothly
+    at sub-pixel speeds.
+    """
+
+    # trails end below this brightness
+    trail_cutoff = 1.0 / 255
+
+    def __init__(self, ledArraySize, blend=BlendMode.Max, opacity=1.0):
+        Layer.__init__(self, ledArraySize, blend=blend, opacity=opacity)
+        self.ledArraySize = ledArraySize
+        self.sprites = []
+        self.moving = True
+
+    def addSprite(self, sprite=None, **kwargs):
+        if sprite is None:
+            sprite = Sprite(**kwargs)
+
+        self.sprites.append(sprite)
+
+        return sprite
+
+    def removeSprite(self, sprite):
+        self.sprites.remove(sprite)
+
+    def render(self):
+        bounds = (0, self.ledArraySize)
+
+        if self.moving:
+            for sprite in self.sprites:
+                sprite.step(bounds)
+
+        self.rasterize()
+
+    def rasterize(self):
+        self.colors[:] = 0
+        self.dirty = True
+
+        sprites = self.sprites
+
+        if not sprites:
+            return
+
+        default = (0, self.ledArraySize)
+
+        pos = np.array([s.position for s in sprites])
+        vel = np.array([s.velocity for s in sprites])
+        half = np.array([s.width for s in sprites]) / 2
+        trail = np.array([s.trail for s in sprites], np.float64)
+        colors = np.array([s.color for s in sprites], np.float32)
+        lo, hi = np.array([s.bounds or default for s in sprites],
+                          np.float64).T
+        wrap = np.array([s.edge == Edge.Wrap for s in sprites])
+
+        profiles = np.array([s.profile for s in sprites])
+
+        speed = np.abs(vel)
+        forward = vel >= 0
+
+        # how far behind the sprite its trail is visible
+        trail_length = np.where(
+            (trail > 0) & (speed > 0),
+            speed * math.log(self.trail_cutoff) /
+            np.log(np.clip(trail, 1e-6, 1 - 1e-6)), 0)
+
+        left = pos - half
+        right = pos + half
+        start = np.floor(left - np.where(forward, trail_length, 0))
+        end = np.ceil(right + np.where(forward, 0, trail_length))
+
+        window = int(np.max(end - start)) + 1
+        pixels = start[:, None] + np.arange(window)
+        centers = pixels + 0.5
+
+        distance = np.abs(centers - pos[:, None]) / \
+            np.maximum(half, 1e-6)[:, None]
+
+        coverage = np.clip(np.minimum(pixels + 1, right[:, None]) -
+                           np.maximum(pixels, left[:, None]), 0, 1)
+
+        intensity = np.select(
+            [(profiles == Profile.Triangle)[:, None],
+             (profiles == Profile.Gaussian)[:, None]],
+            [np.clip(1 - distance, 0, 1),
+             np.exp(-2 * distance ** 2) * (distance <= 1.5)],
+            coverage)
+
+        behind = np.where(forward[:, None], left[:, None] - centers,
+                          centers - right[:, None])
+
+        in_tail = (behind > 0) & (trail_length[:, None] > 0)
+        frames_ago = np.where(in_tail,
+                              behind / np.maximum(speed, 1e-6)[:, None], 0)
+        tail = np.where(in_tail, trail[:, None] ** frames_ago, 0)
+
+        intensity = np.maximum(intensity, tail)
+
+        span = hi - lo
+        wrapped = lo[:, None] + (pixels - lo[:, None]) % span[:, None]
+        pixels = np.where(wrap[:, None], wrapped, pixels).astype(np.intp)
+
+        visible = (intensity > 0) & (pixels >= lo[:, None]) & \
+            (pixels < hi[:, None]) & (pixels >= 0) & \
+            (pixels < self.ledArraySize)
+
+        index = pixels[visible]
+        light = intensity[visible]
+        owner = np.broadcast_to(np.arange(len(sprites))[:, None],
+                                intensity.shape)[visible]
+
+        for c in range(3):
+            self.colors[:, c] = np.bincount(
+                index, weights=light * colors[owner, c],
+                minlength=self.ledArraySize)
@@ -0,0 +1,136 @@
+"""
+Deterministic virtual time for tests, benchmarks and offline rendering.
+
+VirtualEventLoop never sleeps.  Whenever it would wait for a timer, its
+clock jumps straight to that timer, so a 10 second animation runs as fast
+as it renders and always sees the same timestamps:
+
+    with virtualLoop() as loop:
+        recorder = FrameRecorder(loop)
+        leds = LightArray2(10, recorder, fps=30, loop=loop)
+
+        ColorTransformAnimation(...).start()
+        loop.advanceFrames(30, leds.fps)
+
+        assert len(recorder) == 31
+        assert (recorder.last == [255, 0, 0]).all()
+"""
+
+import asyncio
+import contextlib
+import math
+import selectors
+
+import numpy as np
+
+from photons.eventloop import currentLoop
+from photons.lights import BaseDriver
+
+
+class VirtualSelector(selectors.DefaultSelector):
+    """never blocks.  Waiting for a timeout advances the clock"""
+
+    def __init__(self):
+        selectors.DefaultSelector.__init__(self)
+        self.now = 0.0
+
+    def select(self, timeout=None):
+        if timeout:
+            self.now += timeout
+
+        return selectors.DefaultSelector.select(self, 0)
+
+
+class VirtualEventLoop(asyncio.SelectorEventLoop):
+    """event loop that runs timers as fast as possible in virtual time"""
+
+    def __init__(self):
+        self._virtual_selector = VirtualSelector()
+        asyncio.SelectorEventLoop.__init__(self, self._virtual_selector)
+
+    def time(self):
+        return self._virtual_selector.now
+
+    def advance(self, seconds):
+        """run everything due in the next seconds of virtual time"""
+        self.run_until_complete(asyncio.sleep(seconds))
+
+        # timers due exactly now are ready on the next iteration
+        self.run_until_complete(asyncio.sleep(0))
+
+    def advanceFrames(self, numFrames, fps):
+        """
+        Advance to half a frame past the numFrames-th frame boundary from
+        now, so ticks that land on frame boundaries are never raced.
+        A loop ticking at fps runs numFrames times, plus its tick at 0 if
+        the clock is still at 0.
+        """
+        frame = math.floor(self.time() * fps + 1e-6)
+        self.advance((frame + numFrames + 0.5) / fps - self.time())
+
+    def cancelAll(self):
+        """cancel every pending task and let them finish"""
+        tasks = asyncio.all_tasks(self)
+
+        for task in tasks:
+            task.cancel()
+
+        self.run_until_complete(
+            asyncio.gather(*tasks, return_exceptions=True))
+
+
+@contextlib.contextmanager
+def virtualLoop():
+    """
+    A VirtualEventLoop set as the current event loop for the duration of
+    the block.  Pending tasks are cancelled and the previous loop is
+    restored on exit.
+    """
+    loop = VirtualEventLoop()
+    previous_loop = currentLoop()
+    asyncio.set_event_loop(loop)
+
+    try:
+        yield loop
+    finally:
+        loop.cancelAll()
+        loop.close()
+
+        asyncio.set_event_loop(previous_loop)
+
+
+class FrameRecorder(BaseDriver):
+    """
+    Driver that keeps a copy of every frame it is given, with the loop
+    time it arrived at.  Wrap another driver with "driver" to record and
+    output at the same time.
+    """
+
+    def __init__(self, loop=None, driver=None, debug=False, **kwargs):
+        BaseDriver.__init__(self)
+        self.loop = loop
+        self.driver = driver
+        self.debug = debug
+        self.frames = []
+        self.times = []
+
+    def update(self, ledsData, force=False):
+        self.frames.append(np.array(ledsData, copy=True))
+        self.times.append(self.loop.time() if self.loop else None)
+
+        if self.driver:
+            self.driver.update(ledsData, force)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def frame(self, index):
+        return self.frames[index]
+
+    @property
+    def last(self):
+        return self.frames[-1] if self.frames else None
+
+    def clear(self):
+        self.frames = []
+        self.times = []
@@ -4,6 +4,11 @@ import photons
 import random
 import asyncio
 
+from photons import generators
+from photons.eventloop import newEventLoop
+from photons.layers import LayerStack
+from photons.sprites import SpriteLayer
+
 leds = None
 
 
@@ -15,71 +20,6 @@ def p(msg):
     print(msg)
 
 
-def wavelengthToRGB(wavelength):
-    gamma = 0.80
-    intensityMax = 255
-
-    """ Taken from Earl F. Glynn's web page:
-	* <a href="http://www.efg2.com/Lab/ScienceAndEngineering/Spectra.htm">Spectra Lab Report</a>
-	"""
-
-    factor = None
-    r = None
-    g = None
-    b = None
-
-    if((wavelength >= 380) and (wavelength < 440)):
-        r = -(wavelength - 440) / (440.0 - 380.0)
-        g = 0.0
-        b = 1.0
-    elif((wavelength >= 440) and (wavelength < 490)):
-        r = 0.0
-        g = (wavelength - 440) / (490.0 - 440.0)
-        b = 1.0
-    elif((wavelength >= 490) and (wavelength < 510)):
-        r = 0.0
-        g = 1.0
-        b = -(wavelength - 510) / (510.0 - 490.0)
-    elif((wavelength >= 510) and (wavelength < 580)):
-        r = (wavelength - 510) / (580.0 - 510.0)
-        g = 1.0
-        b = 0.0
-    elif((wavelength >= 580) and (wavelength < 645)):
-        r = 1.0
-        g = -(wavelength - 645) / (645.0 - 580.0)
-        b = 0.0
-    elif((wavelength >= 645) and (wavelength < 781)):
-        r = 1.0
-        g = 0.0
-        b = 0.0
-    else:
-        r = 0.0
-        g = 0.0
-        b = 0.0
-
-    # Let the intensity fall off near the vision limits
-    if((wavelength >= 380) and (wavelength < 420)):
-        factor = 0.3 + 0.7*(wavelength - 380) / (420.0 - 380.0)
-    elif((wavelength >= 420) and (wavelength < 701)):
-        factor = 1.0
-    elif((wavelength >= 701) and (wavelength < 781)):
-        factor = 0.3 + 0.7*(780 - wavelength) / (780.0 - 700.0)
-    else:
-        factor = 0.0
-
-    # Don't want 0^x = 1 for x != 0
-
-    r = int(round(intensityMax * pow(r * factor, gamma)))
-    g = int(round(intensityMax * pow(g * factor, gamma)))
-    b = int(round(intensityMax * pow(b * factor, gamma)))
-
-    return (r, g, b)
-
-
-def mp(x, in_min, in_max, out_min, out_max):
-    return (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
-
-
 def wrap(kX, kLowerBound, kUpperBound):
 
     range_size = kUpperBound - kLowerBound + 1
@@ -90,149 +30,70 @@ def wrap(kX, kLowerBound, kUpperBound):
     return kLowerBound + (kX - kLowerBound) % range_size
 
 
-@asyncio.coroutine
-def rainbow():
+async def rainbow():
 
     delay = 0.01
 
     offset = 0
 
+    spectrum = generators.spectrum(leds.ledArraySize)
+
     while True:
         if offset > leds.ledArraySize:
             offset = 0
 
-        x = offset
-
-        for led in range(leds.ledArraySize):
-
-            if x >= leds.ledArraySize:
-                x = 0
-
-            wavelength = mp(led, 0, leds.ledArraySize, 780, 380)
-            color = wavelengthToRGB(wavelength)
-            leds.changeColor(x, color)
-
-            #print("x={0}, offset={1}, color={2}".format(x, offset, color))
-
-            x += 1
+        leds.changeColors(0, generators.shifted(spectrum, offset))
 
         offset += 1
 
-        yield from asyncio.sleep(delay)
+        await asyncio.sleep(delay)
 
 
-@asyncio.coroutine
-def larsonScanner():
+def larsonLayers(trail=0.0):
+    """two red scanners bouncing left and right of led 140"""
 
     length = 5
-    led = 0
-    led2 = leds.ledArraySize - 1
     side1 = 140
 
-    direction = "forward"
-    direction2 = "forward"
-
-    delay = 0.02
-
-    while True:
-
-        leds.clear()
-
-        for l in range(length):
-
-            if led + length > side1:
-                direction = "backwards"
-                continue
-
-            if led < 0:
-                direction = "forward"
-                continue
-
-            leds.changeColor(led + l, (255, 0, 0))
-
-        for l in range(length):
-            if led2 - length < side1:
-                direction2 = "backwards"
-                break
-
-            if led2 >= leds.ledArraySize:
-                direction2 = "forward"
-                break
-
-            leds.changeColor(led2 - l, (255, 0, 0))
-
-        if direction == "forward":
-            led += 1
-        else:
-            led -= 1
-
-        if direction2 == "forward":
-            led2 -= 1
-        else:
-            led2 += 1
+    stack = LayerStack(leds)
+    scanners = stack.addLayer(SpriteLayer(leds.ledArraySize))
 
-        yield from asyncio.sleep(delay)
+    scanners.addSprite(position=length / 2, velocity=1, width=length,
+                       color=(255, 0, 0), trail=trail, bounds=(0, side1))
+    scanners.addSprite(position=leds.ledArraySize - length / 2, velocity=-1,
+                       width=length, color=(255, 0, 0), trail=trail,
+                       bounds=(side1, leds.ledArraySize))
 
+    return stack
 
-@asyncio.coroutine
-def larsonScanner2():
 
-    length = 5
-    led = 0
-    led2 = leds.ledArraySize - 1
-    side1 = 140
+async def larsonScanner():
 
-    direction = "forward"
-    direction2 = "forward"
+    delay = 0.02
 
-    delay = 0.05
+    stack = larsonLayers()
 
     while True:
+        stack.flatten()
 
-        # leds.clear()
-
-        for l in range(length):
+        await asyncio.sleep(delay)
 
-            if led + length > side1:
-                direction = "backwards"
-                continue
 
-            if led < 0:
-                direction = "forward"
-                continue
+async def larsonScanner2():
 
-            leds.transformColorTo(
-                led + l, (255, 0, 0), 0.001).then(leds.transformColorTo, led + l, (0, 0, 0), 0.001)
-
-        for l in range(length):
-            if led2 - length < side1:
-                direction2 = "backwards"
-                break
-
-            if led2 >= leds.ledArraySize:
-                direction2 = "forward"
-                break
-
-            leds.transformColorTo(
-                led2 - l, (255, 0, 0), 0.001).then(leds.transformColorTo, led2 - l, (0, 0, 0), 0.001)
+    delay = 0.05
 
-        if direction == "forward":
-            led += 1
-        else:
-            led -= 1
+    stack = larsonLayers(trail=0.5)
 
-        if direction2 == "forward":
-            led2 -= 1
-        else:
-            led2 += 1
+    while True:
+        stack.flatten()
 
-        yield from asyncio.sleep(delay)
+        await asyncio.sleep(delay)
 
 
-@asyncio.coroutine
-def randomRainbowTransforms():
+async def randomRainbowTransforms():
     print("rainbow...")
-    loop = asyncio.get_event_loop()
+    loop = asyncio.get_running_loop()
 
     concurrentTransform = photons.ConcurrentAnimation()
 
@@ -247,10 +108,9 @@ def randomRainbowTransforms():
     concurrentTransform.start().then(loop.create_task, randomRainbowTransforms())
 
 
-@asyncio.coroutine
-def randomRainbowTransforms2():
+async def randomRainbowTransforms2():
     print("rainbow...")
-    loop = asyncio.get_event_loop()
+    loop = asyncio.get_running_loop()
 
     concurrentTransform = photons.ColorTransformAnimation(leds)
 
@@ -293,10 +153,13 @@ if __name__ == "__main__":
                         default="", help="particle device name")
     parser.add_argument('--config', type=str, dest="config_name",
                         default="config.json", help="config")
+    parser.add_argument('--uvloop', dest="uvloop",
+                        help="use uvloop if installed", action='store_true')
 
     args = parser.parse_args()
 
-    loop = asyncio.get_event_loop()
+    loop = newEventLoop(uvloop=args.uvloop)
+    asyncio.set_event_loop(loop)
 
     config = None
 
@@ -0,0 +1,431 @@
+"""
+Benchmark suite.  Replaces bm_apa102driver.py and bm_lightprotocol.py.
+
+	python benchmarks.py                    run everything, print json
+	python benchmarks.py --quick            small sizes only
+	python benchmarks.py --filter protocol  only benchmarks matching
+	python benchmarks.py --output out.json
+	python benchmarks.py --save-baseline    store results as the baseline
+	python benchmarks.py --compare          fail on regressions
+
+Every result is the best of several runs, in seconds per operation.
+Results are compared against benchmark_baseline.json (or --baseline).
+A benchmark regresses when it is more than --tolerance (default 25%)
+slower than its baseline.  Baselines are machine specific; save one on
+the machine that runs the comparison.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import sys
+import tempfile
+import time
+import timeit
+
+import numpy as np
+
+import photons
+from photons.virtualclock import virtualLoop
+from photons.lightprotocol import LightProtocol, LightProtocolFlags
+from photons.lightserver import LightServer, LightServerUdp
+
+sizes = [100, 1000, 5000, 20000]
+quickSizes = [100, 1000]
+
+defaultBaseline = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+	"benchmark_baseline.json")
+
+
+class BenchmarkRunner:
+
+	def __init__(self, quick=False, pattern=None, repeat=5):
+		self.sizes = quickSizes if quick else sizes
+		self.pattern = pattern
+		self.repeat = 3 if quick else repeat
+		self.results = {}
+
+	def wanted(self, name):
+		return self.pattern is None or self.pattern in name
+
+	def timeit(self, name, func, number=None, **info):
+		"""best seconds per call of func()"""
+		if not self.wanted(name):
+			return
+
+		timer = timeit.Timer(func)
+
+		if number is None:
+			number, _ = timer.autorange()
+
+		best = min(timer.repeat(self.repeat, number)) / number
+
+		self.record(name, best, **info)
+
+	def record(self, name, seconds, **info):
+		result = {"seconds": seconds}
+		result.update(info)
+		self.results[name] = result
+
+		print("{:60} {:>12.3f} us".format(name, seconds * 1e6), file=sys.stderr)
+
+
+def contents(size, rng):
+	"""test frames by content type.  sparse is 1% changed from base"""
+	base = rng.integers(0, 256, (size, 3), dtype=np.uint8)
+
+	sparse = base.copy()
+	changed = rng.choice(size, max(1, size // 100), replace=False)
+	sparse[changed] = rng.integers(0, 256, (len(changed), 3), dtype=np.uint8)
+
+	gradient = np.linspace([255, 0, 0], [0, 0, 255], size).astype(np.uint8)
+
+	return base, {
+		"uniform": np.full((size, 3), [10, 20, 30], np.uint8),
+		"gradient": gradient,
+		"random": base,
+		"sparse": sparse,
+	}
+
+
+class CollectingProtocol(LightProtocol):
+	"""collects sent commands.  message() returns them as one message"""
+
+	def __init__(self, *args, **kwargs):
+		LightProtocol.__init__(self, *args, **kwargs)
+		self.send_queue = []
+
+	def send(self, msg):
+		self.send_queue.append(msg)
+
+	def message(self):
+		msg = self.writeHeader(bytearray(b"".join(self.send_queue)))
+		self.send_queue = []
+		return msg
+
+
+class FakeLeds:
+	fps = 60
+
+
+def commandMessages(size, rng):
+	"""one encoded message per protocol command"""
+	encoder = CollectingProtocol()
+	messages = {}
+
+	def encode(name, func, *args):
+		func(*args)
+		messages[name] = encoder.message()
+
+	colors = rng.integers(0, 256, (size, 3), dtype=np.uint8)
+	palette = np.array([[255, 0, 0], [0, 255, 0], [0, 0, 255], [0, 0, 0]], np.uint8)
+	indices = rng.integers(0, len(palette), size)
+
+	ids = list(range(0, size, 10))
+	encode("setColor", encoder.setColor, ids, [bytes(c) for c in colors[ids]])
+	encode("setSeries", encoder.setSeries, 0, size, [255, 0, 0])
+	encode("setAllColor", encoder.setAllColor, [255, 0, 0])
+	encode("setRange", encoder.setRange, 0, colors)
+	encode("setPalette", encoder.setPalette, 0, palette, indices)
+	encode("clear", encoder.clear)
+
+	return messages
+
+
+def benchDrivers(runner, loop):
+	rng = np.random.default_rng(1)
+	tmp = tempfile.mkdtemp()
+
+	for size in runner.sizes:
+		frame = rng.integers(0, 256, (size, 3), dtype=np.uint8)
+
+		apa = photons.Apa102Driver()
+		runner.timeit("driver/Apa102/{}".format(size), lambda: apa.update(frame))
+
+		ws = photons.Ws2801Driver()
+		runner.timeit("driver/Ws2801/{}".format(size), lambda: ws.update(frame))
+
+		try:
+			from photons.sharedmemory import SharedMemoryDriver
+		except ImportError:
+			SharedMemoryDriver = None
+
+		if SharedMemoryDriver and runner.wanted("driver/SharedMemory"):
+			shm = SharedMemoryDriver("photons_bm_{}".format(os.getpid()), size)
+			runner.timeit("driver/SharedMemory/{}".format(size), lambda: shm.update(frame))
+			shm.close()
+
+		if runner.wanted("driver/Capture"):
+			from photons.capture import CaptureDriver
+
+			capture = CaptureDriver(os.path.join(tmp, "capture{}.log".format(size)),
+				flush_interval=3600)
+
+			def captureFrames():
+				for i in range(100):
+					capture.update(frame)
+				capture.flush()
+
+			runner.timeit("driver/Capture/{}".format(size), captureFrames, number=1,
+				unit="100 frames")
+			capture.close()
+
+		leds = photons.LightArray2(size, photons.DummyDriver(), loop=loop)
+		leds.ledsData[:] = frame
+		leds.masterBrightness = 0.5
+		runner.timeit("driver/masterBrightness/{}".format(size), leds._outputFrame)
+
+
+def benchProtocol(runner, loop):
+	rng = np.random.default_rng(2)
+
+	for size in runner.sizes:
+		leds = photons.LightArray2(size, photons.DummyDriver(), loop=loop)
+		parser = LightProtocol(leds=leds)
+
+		for command, message in commandMessages(size, rng).items():
+			runner.timeit("protocol/parse/{}/{}".format(command, size),
+				lambda: parser.parse(message), bytes=len(message))
+
+		ids = np.arange(0, size, 10)
+		colors = rng.integers(0, 256, (len(ids), 3), dtype=np.uint8)
+		runner.timeit("protocol/encode/setColor/{}".format(size),
+			lambda: parser.setColor(ids, colors))
+		runner.timeit("protocol/encode/setColor-list/{}".format(size),
+			lambda: parser.setColor(ids.tolist(), list(colors)))
+
+		base, frames = contents(size, rng)
+
+		for compression in (False, LightProtocolFlags.Deflate):
+			encoder = CollectingProtocol()
+			encoder.setCompression(compression)
+			suffix = "/deflate" if compression else ""
+
+			for content, frame in frames.items():
+				baseFrame = base if content == "sparse" else None
+
+				def encode():
+					encoder.encodeFrame(frame, baseFrame)
+					return encoder.message()
+
+				message = encode()
+
+				runner.timeit("protocol/encode/{}/{}{}".format(content, size, suffix),
+					encode, bytes=len(message))
+
+				leds.ledsData[:] = 0 if baseFrame is None else baseFrame
+				runner.timeit("protocol/decode/{}/{}{}".format(content, size, suffix),
+					lambda: parser.parse(message), bytes=len(message))
+
+
+def benchAnimations(runner):
+	"""
+	ColorTransformAnimation and transformColorTo with N concurrent
+	transforms, run on a virtual clock so the numbers are engine cost,
+	not sleeping.
+	"""
+	fps = 60
+	duration = 1000
+
+	for transforms in (10, 100, 1000):
+		size = max(transforms, 100)
+
+		def run(kind):
+			with virtualLoop() as loop:
+				leds = photons.LightArray2(size, photons.DummyDriver(), fps=fps, loop=loop)
+
+				if kind == "ColorTransformAnimation":
+					animation = photons.ColorTransformAnimation(leds)
+					for led in range(transforms):
+						animation.addAnimation(led, [255, 128, 0], duration)
+					promise = animation.start()
+
+					done = loop.create_future()
+					promise.then(lambda: done.set_result(True))
+					loop.run_until_complete(done)
+				else:
+					for led in range(transforms):
+						leds.transformColorTo(led, [255, 128, 0], duration)
+					loop.advanceFrames(fps * duration // 1000 + 1, fps)
+
+		for kind in ("ColorTransformAnimation", "transformColorTo"):
+			runner.timeit("animation/{}/{}".format(kind, transforms), lambda: run(kind),
+				number=1, unit="{} frames".format(fps * duration // 1000))
+
+
+class IngestServer:
+	"""counts frames instead of parsing them"""
+
+	def queue_frame(self, frame, client=None):
+		self.frames += 1
+
+		if self.frames >= self.expected:
+			self.done.set_result(True)
+
+
+class TcpIngestServer(IngestServer, LightServer):
+	pass
+
+
+class UdpIngestServer(IngestServer, LightServerUdp):
+	pass
+
+
+def benchIngest(runner, loop):
+	"""frames per second the server can receive and split over loopback"""
+	rng = np.random.default_rng(3)
+	numFrames = 2000
+
+	for size in runner.sizes:
+		encoder = CollectingProtocol()
+		encoder.setRange(0, rng.integers(0, 256, (size, 3), dtype=np.uint8))
+		message = bytes(encoder.message())
+
+		for transport, ServerClass in (("tcp", TcpIngestServer), ("udp", UdpIngestServer)):
+			name = "ingest/{}/{}".format(transport, size)
+
+			if not runner.wanted(name) or (transport == "udp" and len(message) > 60000):
+				continue  # a frame must fit in one datagram
+
+			server = ServerClass(FakeLeds(), port=0, iface="127.0.0.1")
+			server.start()
+
+			if transport == "tcp":
+				port = server.server.sockets[0].getsockname()[1]
+				sock = socket.create_connection(("127.0.0.1", port))
+				sock.setblocking(False)
+				payload = message * numFrames
+				loop.run_until_complete(asyncio.sleep(0.01))
+			else:
+				port = server.server.get_extra_info("sockname")[1]
+				sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+				sock.connect(("127.0.0.1", port))
+
+			def ingest():
+				server.frames = 0
+				server.expected = numFrames
+				server.done = loop.create_future()
+
+				if transport == "tcp":
+					loop.run_until_complete(loop.sock_sendall(sock, payload))
+				else:
+					async def sendDatagrams():
+						# the transport reads one datagram per loop iteration
+						for i in range(numFrames):
+							sock.send(message)
+							await asyncio.sleep(0)
+
+					loop.run_until_complete(sendDatagrams())
+
+				try:
+					loop.run_until_complete(asyncio.wait_for(server.done, 5))
+				except asyncio.TimeoutError:
+					pass  # udp may drop datagrams.  Count what arrived.
+
+				return server.frames
+
+			started = time.perf_counter()
+			received = ingest()
+			elapsed = time.perf_counter() - started
+
+			runner.record(name, elapsed / max(received, 1),
+				frames_per_second=received / elapsed,
+				received=received, sent=numFrames, bytes=len(message))
+
+			sock.close()
+			server.close()
+
+
+def compare(results, baseline, tolerance):
+	"""return names of results more than tolerance slower than baseline"""
+	regressions = []
+
+	for name, result in sorted(results.items()):
+		if name not in baseline:
+			continue
+
+		before = baseline[name]["seconds"]
+		after = result["seconds"]
+		change = after / before - 1.0 if before else 0.0
+
+		status = ""
+		if change > tolerance:
+			status = "REGRESSION"
+			regressions.append(name)
+
+		print("{:60} {:>+8.1%} {}".format(name, change, status), file=sys.stderr)
+
+	return regressions
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--quick", action="store_true", help="small sizes only")
+	parser.add_argument("--filter", dest="pattern", help="only run benchmarks containing this")
+	parser.add_argument("--output", help="write json results here (default stdout)")
+	parser.add_argument("--baseline", default=defaultBaseline, help="baseline json")
+	parser.add_argument("--save-baseline", dest="save", action="store_true",
+		help="store these results as the baseline")
+	parser.add_argument("--compare", action="store_true",
+		help="compare against the baseline.  Exit 1 on regressions")
+	parser.add_argument("--tolerance", type=float, default=0.25,
+		help="allowed slowdown before a result is a regression")
+
+	args = parser.parse_args(argv)
+
+	runner = BenchmarkRunner(quick=args.quick, pattern=args.pattern)
+
+	loop = asyncio.new_event_loop()
+	asyncio.set_event_loop(loop)
+
+	benchDrivers(runner, loop)
+	benchProtocol(runner, loop)
+	benchAnimations(runner)
+	benchIngest(runner, loop)
+
+	for task in asyncio.all_tasks(loop):
+		task.cancel()
+	loop.run_until_complete(asyncio.sleep(0))
+	loop.close()
+
+	output = {
+		"meta": {
+			"time": time.time(),
+			"python": platform.python_version(),
+			"numpy": np.__version__,
+			"machine": platform.machine(),
+			"platform": platform.platform(),
+		},
+		"results": runner.results,
+	}
+
+	text = json.dumps(output, indent=1, sort_keys=True)
+
+	if args.output:
+		with open(args.output, "w") as f:
+			f.write(text)
+	else:
+		print(text)
+
+	if args.save:
+		with open(args.baseline, "w") as f:
+			f.write(text)
+
+	elif args.compare:
+		with open(args.baseline) as f:
+			baseline = json.load(f)["results"]
+
+		regressions = compare(runner.results, baseline, args.tolerance)
+
+		if regressions:
+			print("{} regressions".format(len(regressions)), file=sys.stderr)
+			return 1
+
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -1,9 +1,15 @@
 class FakeLightArray2:
+	# every id the protocol can address is in range
+	ledArraySize = 0xffff
+
 	def setLedArraySize(self, ledArraySize):
-		pass
+		self.ledArraySize = ledArraySize
 
 	def clear(self):
 		pass
 
 	def changeColor(self, ledNumber, color):
 		pass
+
+	def changeColors(self, startId, colors):
+		pass
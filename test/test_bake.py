@@ -0,0 +1,43 @@
+import pytest
+
+from photons import LightArray2, DummyDriver
+from photons.bake import bake, BakedAnimation, BakedPlayer
+from photons.virtualclock import virtualLoop, FrameRecorder
+
+
+def fill(leds):
+	for i in range(leds.ledArraySize):
+		leds.changeColor(i, [i, 0, 0])
+
+
+@pytest.mark.parametrize("delta", [False, True])
+def test_bake_and_play(tmp_path, delta):
+	path = str(tmp_path / "fill.bake")
+	bake(fill, 4, 3, path, delta=delta)
+
+	baked = BakedAnimation(path)
+
+	with virtualLoop() as loop:
+		recorder = FrameRecorder(loop)
+		leds = LightArray2(4, recorder, loop=loop)
+		BakedPlayer(leds, baked, repeat=False, loop=loop).start()
+		loop.advanceFrames(5, leds.fps)
+
+	assert (recorder.last[:, 0] == [0, 1, 2, 3]).all()
+
+	baked.close()
+
+
+@pytest.mark.parametrize("loopStart,loopEnd", [(1, 1), (2, 1), (-1, 2), (0, 4)])
+def test_bad_loop_is_rejected(tmp_path, loopStart, loopEnd):
+	path = str(tmp_path / "fill.bake")
+	bake(fill, 4, 3, path)
+	baked = BakedAnimation(path)
+
+	with virtualLoop() as loop:
+		leds = LightArray2(4, DummyDriver(), loop=loop)
+
+		with pytest.raises(ValueError):
+			BakedPlayer(leds, baked, loopStart=loopStart, loopEnd=loopEnd, loop=loop)
+
+	baked.close()
@@ -0,0 +1,78 @@
+import types
+
+import numpy as np
+import pytest
+
+from photons import LightArray2
+from photons.capture import CaptureDriver, CaptureReader
+from photons.virtualclock import virtualLoop, FrameRecorder
+
+fps = 20
+
+
+@pytest.fixture
+def loop(monkeypatch):
+	with virtualLoop() as loop:
+		# timestamp captured frames with virtual time
+		monkeypatch.setattr("photons.capture.time", types.SimpleNamespace(time=loop.time))
+		yield loop
+
+
+def record(loop, path, colors):
+	"""capture one frame per (frame number, color)"""
+	capture = CaptureDriver(str(path), flush_interval=60)
+	leds = LightArray2(3, capture, fps=fps, loop=loop)
+
+	for frames, color in colors:
+		loop.advanceFrames(frames, fps)
+		leds.ledsData[:] = color
+		leds.update()
+
+	loop.advanceFrames(1, fps)
+	leds.stop()
+	capture.close()
+
+	return CaptureReader(str(path))
+
+
+@pytest.fixture
+def reader(loop, tmp_path):
+	reader = record(loop, tmp_path / "capture.log",
+		[(0, [10, 0, 0]), (2, [0, 20, 0]), (5, [0, 0, 30])])
+	yield reader
+	reader.close()
+
+
+def test_capture_keeps_frames_and_timing(reader):
+	assert len(reader) == 3
+	assert [frame[0].tolist() for frame in reader.frames()] == [[10, 0, 0], [0, 20, 0], [0, 0, 30]]
+	assert np.diff(reader.timestamps) == pytest.approx([2 / fps, 5 / fps])
+
+
+@pytest.mark.parametrize("speed", [1.0, 2.0])
+def test_replay(loop, reader, speed):
+	# fast enough that no replayed frame shares an output tick
+	recorder = FrameRecorder(loop)
+	leds = LightArray2(3, recorder, fps=1000, loop=loop)
+
+	task = loop.create_task(reader.replay(leds, speed=speed))
+	loop.advance(1)
+
+	assert task.done()
+	assert len(recorder) == 3
+
+	for played, captured in zip(recorder.frames, reader.frames()):
+		assert (played == captured).all()
+
+	assert np.diff(recorder.times) == pytest.approx(np.diff(reader.timestamps) / speed, abs=2 / leds.fps)
+
+	leds.stop()
+
+
+def test_diff(loop, reader, tmp_path):
+	other = record(loop, tmp_path / "other.log",
+		[(0, [10, 0, 0]), (2, [0, 20, 1]), (5, [0, 0, 30])])
+
+	assert reader.diff(other).tolist() == [0, 3, 0]
+
+	other.close()
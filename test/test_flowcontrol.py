@@ -0,0 +1,223 @@
+import numpy as np
+import pytest
+
+from photons.lightclient import LightClient
+from photons.lightprotocol import LightProtocol, FrameBuffer, InvalidMessageLength
+from photons.virtualclock import virtualLoop
+
+numLeds = 10
+fps = 60
+
+
+@pytest.fixture
+def loop():
+	with virtualLoop() as loop:
+		yield loop
+
+
+class FakeTransport:
+	"""keeps what is written.  The test pauses and resumes the client"""
+
+	def __init__(self):
+		self.written = []
+		self.limits = None
+		self.buffered = 0
+		self.closed = False
+
+	def set_write_buffer_limits(self, high=None, low=None):
+		self.limits = (high, low)
+
+	def get_write_buffer_size(self):
+		return self.buffered
+
+	def write(self, data):
+		self.written.append(bytes(data))
+
+	def close(self):
+		self.closed = True
+
+	def frame(self, size=numLeds):
+		"""what a server ends up with after parsing everything written"""
+		server = LightProtocol(leds=FrameBuffer(size))
+
+		for msg in self.written:
+			server.parse(bytearray(msg))
+
+		return server.leds.ledsData
+
+
+def frame(value):
+	return np.full((numLeds, 3), value, np.uint8)
+
+
+def test_newer_frame_wins_over_one_coalesced_before_a_reconnect(loop):
+	client = LightClient(loop=loop, fps=fps)
+	transport = FakeTransport()
+	client.connection_made(transport)
+
+	client.update(frame(1), force=True)
+	client.pause_writing()
+	client.update(frame(2))
+	client.connection_lost(None)
+
+	transport = FakeTransport()
+	client.connection_made(transport)
+	client.update(frame(4))
+	loop.advanceFrames(2, fps)
+
+	assert (transport.frame() == 4).all()
+
+	client.close()
+
+
+@pytest.fixture
+def connected(loop):
+	client = LightClient(loop=loop, fps=fps, write_buffer_limits=(4096, 512))
+	transport = FakeTransport()
+	client.connection_made(transport)
+
+	yield client, transport
+
+	client.close()
+
+
+def test_write_buffer_limits_go_to_the_transport(connected):
+	client, transport = connected
+
+	assert transport.limits == (4096, 512)
+
+
+def test_paused_frames_are_coalesced(loop, connected):
+	client, transport = connected
+
+	client.update(frame(1), force=True)
+	assert len(transport.written) == 1
+
+	client.pause_writing()
+
+	for value in range(2, 6):
+		client.update(frame(value))
+		loop.advanceFrames(1, fps)
+
+	assert len(transport.written) == 1
+	assert client.send_queue.qsize() == 0
+
+	client.resume_writing()
+	loop.advanceFrames(3, fps)
+
+	assert len(transport.written) == 2
+	assert (transport.frame() == 5).all()
+
+
+def test_write_stats(loop, connected):
+	client, transport = connected
+	transport.buffered = 5000
+
+	client.pause_writing()
+	loop.advance(0.5)
+
+	stats = client.write_stats()
+	assert stats["paused"]
+	assert stats["pause_count"] == 1
+	assert stats["paused_time"] == pytest.approx(0.5)
+	assert stats["write_buffer_size"] == 5000
+
+	transport.buffered = 100
+	client.resume_writing()
+	loop.advance(1)
+
+	client.pause_writing()
+	loop.advance(0.25)
+	client.resume_writing()
+
+	stats = client.write_stats()
+	assert not stats["paused"]
+	assert stats["pause_count"] == 2
+	assert stats["paused_time"] == pytest.approx(0.75)
+	assert stats["write_buffer_size"] == 100
+
+
+def test_latest_frame_sends_only_the_newest(loop):
+	client = LightClient(loop=loop, fps=fps, latest_frame=True)
+	transport = FakeTransport()
+	client.connection_made(transport)
+	loop.advanceFrames(0, fps)
+
+	for value in range(1, 4):
+		client.update(frame(value))
+
+	loop.advanceFrames(1, fps)
+
+	assert len(transport.written) == 1
+	assert (transport.frame() == 3).all()
+
+	client.close()
+
+
+def test_latest_frame_resends_the_shadow_frame_on_reconnect(loop):
+	client = LightClient(loop=loop, fps=fps, latest_frame=True)
+	client.connection_made(FakeTransport())
+	client.update(frame(1), force=True)
+
+	client.connection_lost(None)
+
+	for value in range(2, 5):
+		client.update(frame(value))
+		loop.advanceFrames(1, fps)
+
+	assert client.send_queue.qsize() == 0
+
+	transport = FakeTransport()
+	client.connection_made(transport)
+	loop.advanceFrames(1, fps)
+
+	# a whole frame: the new server has nothing to diff against
+	assert len(transport.written) == 1
+	assert (transport.frame() == 4).all()
+
+	client.close()
+
+
+def test_large_frames_are_split_into_version_1_messages(loop, connected):
+	client, transport = connected
+	big = np.random.default_rng(29).integers(0, 256, (25000, 3), np.uint8)
+
+	client.update(big, force=True)
+
+	assert len(transport.written) > 1
+	assert all(len(msg) <= 3 + 0xffff for msg in transport.written)
+	assert (transport.frame(len(big)) == big).all()
+
+
+def test_a_backlog_is_flushed_in_several_messages(loop):
+	client = LightClient(loop=loop, fps=fps)
+
+	# queued while not connected
+	for i in range(20000):
+		client.setColor(i, [1, 2, 3])
+
+	transport = FakeTransport()
+	client.connection_made(transport)
+	loop.advanceFrames(1, fps)
+
+	assert len(transport.written) > 1
+	assert all(len(msg) <= 3 + 0xffff for msg in transport.written)
+	assert (transport.frame(20000) == [1, 2, 3]).all()
+
+	client.close()
+
+
+def test_commands_too_long_for_version_1_are_rejected(loop, connected):
+	client, transport = connected
+
+	with pytest.raises(InvalidMessageLength):
+		client.setRange(0, np.zeros((30000, 3), np.uint8))
+
+	with pytest.raises(InvalidMessageLength):
+		LightProtocol().writeHeader(bytearray(0x10000))
+
+	# the send loop keeps going
+	client.setColor(0, [9, 9, 9])
+	loop.advanceFrames(1, fps)
+
+	assert (transport.frame()[0] == 9).all()
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from photons import generators
+
+
+def test_wavelength_matches_scalar_version():
+	# values from the per-pixel wavelengthToRGB the generators replaced
+	expected = {
+		380: [97, 0, 97],
+		450: [0, 70, 255],
+		500: [0, 255, 146],
+		550: [163, 255, 0],
+		600: [255, 190, 0],
+		700: [255, 0, 0],
+		780: [97, 0, 0],
+	}
+
+	colors = generators.wavelengthToRGB(list(expected))
+
+	assert colors.tolist() == list(expected.values())
+
+
+def test_cached_frames_are_read_only():
+	frame = generators.spectrum(30)
+
+	assert frame is generators.spectrum(30)
+	assert frame.shape == (30, 3)
+
+	with pytest.raises(ValueError):
+		frame[0] = 0
+
+	shifted = generators.shifted(frame, 1)
+	shifted[0] = 0
+	assert (shifted[1:] == frame[:-1]).all()
+
+
+def test_hsv_rainbow():
+	colors = generators.hsvRainbow(6)
+
+	assert colors.tolist() == [[255, 0, 0], [255, 255, 0], [0, 255, 0],
+		[0, 255, 255], [0, 0, 255], [255, 0, 255]]
+
+
+def test_palette():
+	colors = [[0, 0, 0], [255, 0, 0], [255, 255, 255]]
+	values = np.array([0, 0.25, 0.5, 1, 2])
+
+	mapped = generators.palette(values, colors)
+
+	assert mapped.shape == (5, 3)
+	assert mapped[0].tolist() == [0, 0, 0]
+	assert np.abs(mapped[2] - np.array([255, 0, 0])).max() <= 1
+	assert mapped[3].tolist() == mapped[4].tolist() == [255, 255, 255]
+	assert 0 < mapped[1, 0] < 255 and mapped[1, 1] == 0
+
+	# the lookup table agrees with gradient()
+	assert (mapped[:4] == generators.gradient(256, colors)[[0, 64, 128, 255]]).all()
+
+
+def test_noise():
+	values = generators.noise(200, scale=16.0, octaves=3, seed=7)
+
+	assert values.shape == (200,)
+	assert values.min() >= 0 and values.max() <= 1
+
+	# smooth: neighbours are close
+	assert np.abs(np.diff(values)).max() < 0.2
+
+	# deterministic, and animating the offset slides the pattern along
+	assert (values == generators.noise(200, 16.0, octaves=3, seed=7)).all()
+	moved = generators.noise(200, 16.0, offset=16, octaves=3, seed=7)
+	assert np.allclose(moved[:-16], values[16:])
+
+	assert not np.allclose(values, generators.noise(200, 16.0, octaves=3, seed=8))
@@ -0,0 +1,177 @@
+import asyncio
+import json
+
+import pytest
+
+from photons import instrumentation
+from photons.instrumentation import Histogram, Metrics, MetricsServer, startMetricsServer
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+	"""a fresh, enabled Metrics in place of the module level one"""
+	metrics = Metrics()
+	metrics.enable()
+	monkeypatch.setattr(instrumentation, "metrics", metrics)
+
+	return metrics
+
+
+def test_histogram():
+	histogram = Histogram([1, 2, 4])
+
+	for value in [0.5, 1, 1.5, 3, 3, 10]:
+		histogram.observe(value)
+
+	# buckets are upper bounds, inclusive
+	assert histogram.counts == [2, 1, 2, 1]
+	assert histogram.count == 6
+	assert histogram.sum == 19
+	assert histogram.quantile(0.5) == 2
+	assert histogram.quantile(0.8) == 4
+	assert histogram.quantile(1) == float("inf")
+	assert Histogram([1]).quantile(0.5) == 0.0
+
+	snapshot = histogram.snapshot()
+	assert snapshot["buckets"] == {"1": 2, "2": 1, "4": 2, "+Inf": 1}
+	assert (snapshot["p50"], snapshot["p99"]) == (2, float("inf"))
+
+
+def test_disabled_metrics_record_nothing():
+	metrics = Metrics()
+
+	assert metrics.start() is None
+
+	metrics.observe("seconds", metrics.start())
+	metrics.observeValue("bytes", 10)
+	metrics.count("messages")
+	metrics.gauge("clients", 1)
+
+	assert metrics.snapshot() == {"histograms": [], "counters": [], "gauges": []}
+
+
+def test_prometheus(metrics):
+	metrics.observeValue("message_bytes", 3, buckets=[2, 4], client="a")
+	metrics.observeValue("message_bytes", 1, buckets=[2, 4], client="a")
+	metrics.count("bytes_sent", 10)
+	metrics.count("bytes_sent", 5)
+	metrics.gauge("clients", 2, server="tcp")
+
+	assert metrics.toPrometheus() == "\n".join([
+		"# TYPE photons_message_bytes histogram",
+		'photons_message_bytes_bucket{client="a",le="2"} 1',
+		'photons_message_bytes_bucket{client="a",le="4"} 2',
+		'photons_message_bytes_bucket{client="a",le="+Inf"} 2',
+		'photons_message_bytes_sum{client="a"} 4.0',
+		'photons_message_bytes_count{client="a"} 2',
+		"# TYPE photons_bytes_sent counter",
+		"photons_bytes_sent 15",
+		"# TYPE photons_clients gauge",
+		'photons_clients{server="tcp"} 2',
+	]) + "\n"
+
+
+def test_json(metrics):
+	metrics.observeValue("message_bytes", 100)
+	metrics.count("dropped_frames", 3, driver="Dummy")
+
+	data = json.loads(metrics.toJson())
+
+	assert data["counters"] == [{"name": "dropped_frames", "labels": {"driver": "Dummy"}, "value": 3}]
+	assert data["gauges"] == []
+
+	histogram, = data["histograms"]
+	assert histogram["name"] == "message_bytes"
+	assert histogram["value"]["count"] == 1
+	assert histogram["value"]["buckets"]["128"] == 1
+
+
+class FakeTransport:
+	def __init__(self):
+		self.written = bytearray()
+		self.closed = False
+
+	def write(self, data):
+		self.written.extend(data)
+
+	def close(self):
+		self.closed = True
+
+
+def request(*chunks):
+	server = MetricsServer()
+	transport = FakeTransport()
+	server.connection_made(transport)
+
+	for chunk in chunks:
+		server.data_received(chunk)
+
+	return transport
+
+
+def response(transport):
+	head, body = bytes(transport.written).split(b"\r\n\r\n", 1)
+
+	return head.decode().split("\r\n"), body.decode()
+
+
+def test_handler_serves_prometheus(metrics):
+	metrics.count("bytes_sent", 7)
+
+	transport = request(b"GET /metrics HTTP/1.1\r\n", b"Host: x\r\n\r\n")
+	head, body = response(transport)
+
+	assert head[0] == "HTTP/1.0 200 OK"
+	assert "Content-Type: text/plain; version=0.0.4" in head
+	assert "Content-Length: {}".format(len(body)) in head
+	assert body == metrics.toPrometheus()
+	assert transport.closed
+
+
+def test_handler_serves_json(metrics):
+	metrics.count("bytes_sent", 7)
+
+	head, body = response(request(b"GET /metrics.json HTTP/1.0\n\n"))
+
+	assert "Content-Type: application/json" in head
+	assert json.loads(body) == metrics.snapshot()
+
+
+def test_handler_waits_for_the_whole_request(metrics):
+	transport = request(b"GET /metrics HTTP/1.1\r\n")
+
+	assert not transport.written and not transport.closed
+
+
+def test_handler_drops_oversized_requests(metrics):
+	chunk = b"X-Padding: " + b"a" * 1000 + b"\r\n"
+	transport = request(b"GET /metrics HTTP/1.1\r\n", *[chunk] * 10)
+
+	assert transport.closed
+	assert not transport.written
+
+
+def test_metrics_over_http():
+	loop = asyncio.new_event_loop()
+	server = startMetricsServer(0, "127.0.0.1", loop=loop)
+	port = server.sockets[0].getsockname()[1]
+
+	async def get():
+		reader, writer = await asyncio.open_connection("127.0.0.1", port)
+		writer.write(b"GET /metrics.json HTTP/1.0\r\n\r\n")
+		data = await reader.read()
+		writer.close()
+		return data
+
+	try:
+		instrumentation.metrics.count("http_test")
+		data = loop.run_until_complete(get())
+
+		assert data.startswith(b"HTTP/1.0 200 OK")
+		assert b"http_test" in data
+	finally:
+		instrumentation.metrics.enable(False)
+		instrumentation.metrics.reset()
+		server.close()
+		loop.run_until_complete(server.wait_closed())
+		loop.close()
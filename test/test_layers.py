@@ -0,0 +1,52 @@
+import pytest
+
+from photons import LightArray2, DummyDriver
+from photons.layers import LayerStack, BlendMode
+from photons.virtualclock import virtualLoop
+
+
+@pytest.fixture
+def loop():
+	with virtualLoop() as loop:
+		yield loop
+
+
+@pytest.fixture
+def stack(loop):
+	leds = LightArray2(4, DummyDriver(), loop=loop)
+	return LayerStack(leds, loop=loop)
+
+
+def test_layers_composite_bottom_to_top(stack):
+	stack.addLayer().fill([100, 0, 0])
+	stack.addLayer(blend=BlendMode.Add).fill([0, 50, 0])
+	stack.addLayer(opacity=0.5).fill([0, 0, 200])
+
+	assert stack.flatten()
+	assert (stack.leds.ledsData == [50, 25, 100]).all()
+
+	assert not stack.flatten()
+
+
+def test_remove_top_layer(stack):
+	bottom = stack.addLayer()
+	bottom.fill([10, 20, 30])
+	top = stack.addLayer()
+	top.fill([255, 0, 0])
+	stack.flatten()
+
+	stack.removeLayer(top)
+
+	assert stack.flatten()
+	assert (stack.leds.ledsData == [10, 20, 30]).all()
+
+
+def test_remove_last_layer_clears(stack):
+	layer = stack.addLayer()
+	layer.fill([255, 255, 255])
+	stack.flatten()
+
+	stack.removeLayer(layer)
+
+	assert stack.flatten()
+	assert (stack.leds.ledsData == 0).all()
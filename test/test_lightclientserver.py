@@ -1,37 +1,98 @@
-from photons import LightClient, LightServer
-from fakelightarray import FakeLightArray2
-import asyncio
 import numpy as np
+import pytest
+
+from photons import LightArray2
+from photons.lightclient import LightClient
+from photons.lightprotocol import LightProtocol, LightProtocolCommand, FrameBuffer
+from photons.lightserver import LightServer
+from photons.virtualclock import virtualLoop
+from fakelightarray import FakeLightArray2
 
 set_color = [255, 0, 0]
 
+
+@pytest.fixture
+def loop():
+	with virtualLoop() as loop:
+		yield loop
+
+
 class LA(FakeLightArray2):
 	def __init__(self):
 		self.fps = 60
-		self.got_it = False
+		self.got_it = None
 
 	def changeColor(self, index, color):
-		print("changeColor({}, {})".format(index, color))
-		self.got_it = True
+		self.got_it = (index, list(color))
+
+
+def test_client_sets_color_on_server(loop):
+	leds = LA()
+
+	server = LightServer(leds=leds, port=0, iface="127.0.0.1", loop=loop)
+	server.start()
+	port = server.server.sockets[0].getsockname()[1]
+
+	client = LightClient(loop=loop)
+	client.onConnected = lambda: client.setColor(0, set_color)
+	client.connectTo("127.0.0.1", port)
+
+	# real socket io interleaved with virtual time
+	for i in range(100):
+		loop.advance(0.1 / 60)
+
+		if leds.got_it:
+			break
+
+	assert leds.got_it == (0, set_color)
+
+	client.close()
+	server.close()
+
+
+def test_stop_cancels_tasks(loop):
+	leds = LA()
+
+	server = LightServer(leds=leds, port=0, iface="127.0.0.1", loop=loop)
+	server.start()
+	assert len(server.tasks) == 1
+
+	server.close()
+	loop.advance(0)
+
+	assert len(server.tasks) == 0
+
+
+def test_master_brightness_through_client(loop):
+	client = LightClient(loop=loop)
+	leds = LightArray2(10, client, loop=loop)
+
+	leds.ledsData[:] = [200, 100, 50]
+	leds.masterBrightness = 0.5
+	leds.updateNow()
 
-leds = LA()
+	decoder = LightProtocol(leds=FrameBuffer(10))
+	decoder.parse(client.writeHeader(b"".join(client.send_queue._queue)))
 
-server = LightServer(leds=leds, port=1888, debug=True)
+	assert (decoder.leds.ledsData == [100, 50, 25]).all()
 
-server.start()
+	client.close()
 
-client = LightClient(debug=True, onConnected=set_color)
 
-def set_color():
-	print("sending set color...")
-	client.setColor(0, [255, 0, 0])
+def test_reconnect_sends_keyframe(loop):
+	client = LightClient(loop=loop)
+	client.keyframe_interval = 100
+	frame = np.zeros((10, 3), np.uint8)
 
-def check_got_message():
-	assert(leds.got_it)
-	asyncio.get_event_loop().stop()
+	client.update(frame)
+	frame[3] = [1, 2, 3]
+	client.update(frame)
+	assert client.send_queue.get_nowait()[0] == LightProtocolCommand.KeyFrame
+	assert client.send_queue.get_nowait()[0] == LightProtocolCommand.DeltaFrame
 
-asyncio.get_event_loop().call_later(2.0, check_got_message)
+	client._onDisconnected()
+	client.update(frame)
 
-asyncio.get_event_loop().run_forever()
-server.close()
+	assert client.send_queue.get_nowait()[0] == LightProtocolCommand.KeyFrame
 
+	client.close()
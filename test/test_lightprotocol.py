@@ -0,0 +1,159 @@
+import numpy as np
+import pytest
+
+from photons.lightprotocol import LightProtocol, LightProtocolCommand, FrameBuffer, \
+	InvalidCommandException
+
+numLeds = 20
+
+
+def roundTrip(encode, leds=None):
+	"""encode with a fresh protocol and parse into a FrameBuffer"""
+	encoder = LightProtocol()
+	decoder = LightProtocol(leds=leds or FrameBuffer(numLeds))
+	decoder.parse(encoder.writeHeader(encode(encoder)))
+
+	return decoder.leds.ledsData
+
+
+@pytest.mark.parametrize("colors", [
+	[bytes([1, 2, 3]), bytes([4, 5, 6])],
+	[bytes([1, 2, 3]), [4, 5, 6]],
+	list(np.array([[3, 2, 1], [6, 5, 4]], np.uint8)[:, ::-1]),
+	np.array([[1, 2, 3], [4, 5, 6]]),
+	[[1, 2, 3], (4, 5, 6)],
+], ids=["bytes", "mixed", "strided rows", "array", "lists"])
+def test_set_color_forms(colors):
+	leds = roundTrip(lambda p: p.setColor([0, 1], colors))
+
+	assert (leds[:2] == [[1, 2, 3], [4, 5, 6]]).all()
+
+
+
+class Recorder(LightProtocol):
+	"""keeps what it sends and which encoding encodeFrame picked"""
+
+	def __init__(self):
+		LightProtocol.__init__(self, debug=True)
+		self.sent = []
+		self.encodings = []
+
+	def send(self, msg):
+		self.sent.append(msg)
+		return msg
+
+	def debug_print(self, msg):
+		self.encodings.append(msg.split(" as ")[1].split(" ")[0])
+
+	def take(self):
+		msg = self.writeHeader(b"".join(self.sent))
+		self.sent = []
+
+		return msg
+
+
+def sparse(*ids):
+	frame = np.zeros((numLeds, 3), np.uint8)
+	frame[list(ids)] = [9, 8, 7]
+
+	return frame
+
+
+@pytest.mark.parametrize("name, frame", [
+	("all", np.full((numLeds, 3), 7, np.uint8)),
+	("color", sparse(0, numLeds - 1)),
+	("series", sparse(*range(5), *range(15, 20))),
+	("range", np.random.default_rng(28).integers(0, 256, (numLeds, 3), np.uint8)),
+	("palette", np.random.default_rng(28).integers(0, 2, (numLeds, 3), np.uint8) * 200),
+])
+def test_encode_frame_round_trip(name, frame):
+	encoder = Recorder()
+	leds = roundTrip(lambda p: encoder._encodeFramePayload(frame, np.zeros_like(frame)))
+
+	assert encoder.encodings == [name]
+	assert (leds == frame).all()
+
+
+def test_set_range():
+	colors = np.arange(15, dtype=np.uint8).reshape(5, 3)
+	leds = roundTrip(lambda p: p.setRange(3, colors))
+
+	assert (leds[3:8] == colors).all()
+	assert not leds[:3].any() and not leds[8:].any()
+
+
+def test_update_sends_only_changes():
+	frame = np.zeros((numLeds, 3), np.uint8)
+	encoder = Recorder()
+	decoder = LightProtocol(leds=FrameBuffer(numLeds))
+
+	for i in range(5):
+		frame[i * 3] = [i, 2 * i, 255]
+		encoder.update(frame)
+		msg = encoder.take()
+		decoder.parse(msg)
+
+		assert (decoder.leds.ledsData == frame).all()
+
+	assert len(msg) < 15
+
+
+def test_keyframe_and_deltas():
+	frame = np.zeros((numLeds, 3), np.uint8)
+	encoder = Recorder()
+	encoder.keyframe_interval = 3
+	decoder = LightProtocol(leds=FrameBuffer(numLeds))
+	commands = []
+
+	for i in range(6):
+		frame[i] = [255, i, 0]
+		encoder.update(frame)
+		commands.append(encoder.sent[0][0])
+		decoder.parse(encoder.take())
+
+		assert (decoder.leds.ledsData == frame).all()
+
+	assert commands == [LightProtocolCommand.KeyFrame, LightProtocolCommand.DeltaFrame,
+		LightProtocolCommand.DeltaFrame] * 2
+
+
+def test_delta_without_keyframe_is_dropped():
+	frame = np.full((numLeds, 3), 5, np.uint8)
+	encoder = Recorder()
+	encoder.keyframe_interval = 10
+
+	encoder.update(frame)
+	encoder.take()  # the keyframe is lost
+	frame[0] = [1, 2, 3]
+	encoder.update(frame)
+
+	decoder = LightProtocol(leds=FrameBuffer(numLeds))
+	decoder.parse(encoder.take())
+
+	assert not decoder.leds.ledsData.any()
+
+
+@pytest.mark.parametrize("numColors", [2, 3, 16, 17, 256])
+def test_set_palette(numColors):
+	rng = np.random.default_rng(numColors)
+	palette = rng.integers(0, 256, (numColors, 3), np.uint8)
+	indices = rng.integers(0, numColors, numLeds - 3)
+
+	leds = roundTrip(lambda p: p.setPalette(3, palette, indices))
+
+	assert (leds[3:] == palette[indices]).all()
+	assert not leds[:3].any()
+
+
+def test_set_palette_is_clamped():
+	palette = np.array([[1, 1, 1], [2, 2, 2]], np.uint8)
+	leds = roundTrip(lambda p: p.setPalette(numLeds - 2, palette, [1, 0, 1, 0]))
+
+	assert (leds[-2:] == palette[[1, 0]]).all()
+
+
+def test_set_palette_bad_index():
+	msg = LightProtocol().setPalette(0, [[1, 2, 3], [4, 5, 6], [7, 8, 9]], [3])
+
+	with pytest.raises(InvalidCommandException):
+		roundTrip(lambda p: msg)
@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+
+from photons import LightArray2, DummyDriver
+from photons.lightprotocol import LightProtocol
+from photons.lightserverwss import LightServerWss, LocalServer
+from photons.virtualclock import virtualLoop
+
+numLeds = 100
+
+
+@pytest.fixture
+def loop():
+	with virtualLoop() as loop:
+		yield loop
+
+
+@pytest.fixture
+def server(loop):
+	leds = LightArray2(numLeds, DummyDriver(), fps=60, loop=loop)
+	server = LightServerWss(leds, port=0, preview_fps=10, ServerClass=LocalServer)
+	server.start()
+	yield server
+	server.close()
+
+
+class Viewer:
+	"""decodes preview messages into its own copy of the frame"""
+
+	def __init__(self):
+		self.leds = LightArray2(numLeds, DummyDriver())
+		self.parser = LightProtocol(leds=self.leds)
+		self.parser.onFrameSnapshot = self.onFrameSnapshot
+		self.snapshots = 0
+
+	def onFrameSnapshot(self, frame):
+		self.snapshots += 1
+		self.leds.ledsData[:] = frame
+
+	def parse(self, messages):
+		for msg in messages:
+			self.parser.parse(bytearray(msg))
+
+
+def test_binary_messages_are_batched(loop, server):
+	client = server.server.connect()
+	encoder = LightProtocol()
+
+	for i in range(10):
+		server.server.onBinaryMessage(bytes(encoder.writeHeader(encoder.setColor(i, bytes([i, 2, 3])))), client)
+
+	loop.advanceFrames(0, server.leds.fps)
+
+	assert server.queue.qsize() == 0
+	assert (server.leds.ledsData[:10, 0] == np.arange(10)).all()
+
+
+def test_get_frame_replies_to_sender(loop, server):
+	client = server.server.connect()
+	encoder = LightProtocol()
+
+	server.server.onBinaryMessage(bytes(encoder.writeHeader(encoder.getFrame(hashOnly=True))), client)
+	loop.advanceFrames(1, server.leds.fps)
+
+	assert len(client.received) == 1
+
+
+def test_preview_sends_snapshot_then_dirty_regions(loop, server):
+	server.leds.ledsData[:] = [10, 20, 30]
+	client = server.server.connect()
+	server.server.onMessage("preview", client)
+
+	loop.advance(0.1)
+	assert len(client.received) == 1
+
+	viewer = Viewer()
+	viewer.parse(client.received)
+	assert viewer.snapshots == 1
+	assert (viewer.leds.ledsData == server.leds.ledsData).all()
+
+	# nothing changed, nothing sent
+	loop.advance(0.1)
+	assert len(client.received) == 1
+
+	server.leds.changeColor(5, [1, 2, 3])
+	loop.advance(0.1)
+	assert len(client.received) == 2
+	assert len(client.received[1]) < 20
+
+	viewer.parse(client.received[1:])
+	assert viewer.snapshots == 1
+	assert (viewer.leds.ledsData == server.leds.ledsData).all()
+
+
+def test_preview_rate_is_capped(loop, server):
+	client = server.server.connect()
+	server.server.onMessage("preview", client)
+
+	for i in range(60):
+		server.leds.changeColor(i, [255, 0, 0])
+		loop.advanceFrames(1, server.leds.fps)
+
+	assert len(client.received) <= 11
+
+
+def test_disconnected_viewers_are_dropped(loop, server):
+	client = server.server.connect()
+	server.server.onMessage("preview", client)
+	loop.advance(0.1)
+
+	server.server.disconnect(client)
+	server.leds.changeColor(0, [1, 1, 1])
+	loop.advance(0.1)
+
+	assert not server.viewers
@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from photons import LightArray2
+from photons.lights import Apa102Driver
+from photons.virtualclock import virtualLoop, FrameRecorder
+
+
+@pytest.fixture
+def loop():
+	with virtualLoop() as loop:
+		yield loop
+
+
+@pytest.fixture
+def recorder(loop):
+	return FrameRecorder(loop)
+
+
+@pytest.fixture
+def leds(loop, recorder):
+	leds = LightArray2(4, recorder, fps=20, loop=loop)
+	leds.ledsData[:] = [200, 100, 50]
+	leds.update()
+	loop.advanceFrames(1, leds.fps)
+
+	return leds
+
+
+def test_brightness_only_dims_the_output(loop, recorder, leds):
+	leds.masterBrightness = 0.5
+	loop.advanceFrames(1, leds.fps)
+
+	assert (recorder.last == [100, 50, 25]).all()
+	assert (leds.ledsData == [200, 100, 50]).all()
+
+	leds.masterBrightness = 2
+	loop.advanceFrames(1, leds.fps)
+
+	assert leds.masterBrightness == 1.0
+	assert (recorder.last == [200, 100, 50]).all()
+
+
+def test_blackout(loop, recorder, leds):
+	leds.blackout = True
+	loop.advanceFrames(1, leds.fps)
+	assert not recorder.last.any()
+
+	leds.blackout = False
+	loop.advanceFrames(1, leds.fps)
+	assert (recorder.last == [200, 100, 50]).all()
+
+
+def test_fade_to(loop, recorder, leds):
+	done = []
+	leds.fadeTo(0, 500).then(lambda: done.append(True))
+	recorder.clear()
+
+	loop.advance(0.49)
+	assert not done
+
+	loop.advanceFrames(2, leds.fps)
+	assert done
+
+	red = [int(frame[0, 0]) for frame in recorder.frames]
+	assert (np.diff(red) < 0).all()
+	assert red[-1] == 0
+
+
+def test_newer_fade_wins(loop, leds):
+	leds.fadeTo(0, 1000)
+	loop.advance(0.25)
+	leds.fadeTo(1, 100)
+	loop.advance(1)
+
+	assert leds.masterFade == 1.0
+
+
+class SpiRecorder:
+	def __init__(self):
+		self.writes = []
+
+	def write(self, data):
+		self.writes.append(bytes(data))
+
+
+def test_apa102_dims_in_hardware(loop):
+	driver = Apa102Driver(pixel_order=[0, 1, 2])
+	driver.spiDev = SpiRecorder()
+	leds = LightArray2(2, driver, loop=loop)
+	leds.ledsData[:] = [200, 100, 50]
+
+	leds.masterBrightness = 0.5
+	leds.updateNow()
+
+	frame = np.frombuffer(driver.spiDev.writes[-1][4:12], np.uint8).reshape(2, 4)
+
+	# 31 * 0.5 rounded up to 16, the rest (15.5 / 16) in software
+	assert (frame[:, 0] == 0b11100000 | 16).all()
+	assert (frame[:, 1:] == [193, 96, 48]).all()
+
+	leds.masterBrightness = 1.0
+	leds.updateNow()
+
+	frame = np.frombuffer(driver.spiDev.writes[-1][4:12], np.uint8).reshape(2, 4)
+
+	assert (frame[:, 0] == 0b11100000 | 31).all()
+	assert (frame[:, 1:] == [200, 100, 50]).all()
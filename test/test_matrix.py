@@ -0,0 +1,107 @@
+import json
+
+import numpy as np
+import pytest
+
+from photons.matrix import Matrix, MatrixLayout, invert_rows
+from photons.virtualclock import virtualLoop, FrameRecorder
+
+
+@pytest.fixture
+def loop():
+	with virtualLoop() as loop:
+		yield loop
+
+
+def frame(width, height):
+	return np.arange(width * height * 3, dtype=np.uint8).reshape(height, width, 3)
+
+
+def output(loop, image, **kwargs):
+	"""what the driver gets for image"""
+	height, width = image.shape[:2]
+	recorder = FrameRecorder(loop)
+	matrix = Matrix(recorder, width, height, loop=loop, autostart=False, **kwargs)
+	matrix.update(image)
+	matrix.updateNow()
+
+	return recorder.last
+
+
+@pytest.mark.parametrize("kwargs", [
+	{"layout": MatrixLayout.serpentine(4, 3)},
+	{"invert_rows_on_update": True},
+], ids=["layout", "flag"])
+def test_serpentine_matches_invert_rows(loop, kwargs):
+	image = frame(4, 3)
+
+	assert (output(loop, image, **kwargs) == invert_rows(image).reshape(-1, 3)).all()
+
+
+def test_no_layout_is_row_major(loop):
+	image = frame(3, 2)
+
+	assert (output(loop, image) == image.reshape(-1, 3)).all()
+	assert (output(loop, image, layout=MatrixLayout.rowMajor(3, 2)) == image.reshape(-1, 3)).all()
+
+
+@pytest.mark.parametrize("layout, wiring", [
+	(MatrixLayout.columnMajor(3, 2), [[0, 2, 4], [1, 3, 5]]),
+	(MatrixLayout.columnMajor(3, 2, serpentine=True), [[0, 3, 4], [1, 2, 5]]),
+	(MatrixLayout.tiled(MatrixLayout.rowMajor(2, 1), 2, 2), [[0, 1, 2, 3], [4, 5, 6, 7]]),
+	(MatrixLayout.tiled(MatrixLayout.rowMajor(2, 1), 2, 2, serpentine=True), [[0, 1, 2, 3], [6, 7, 4, 5]]),
+	(MatrixLayout.rowMajor(3, 2).rotated(), [[2, 5], [1, 4], [0, 3]]),
+	(MatrixLayout.rowMajor(3, 2).rotated(2), [[5, 4, 3], [2, 1, 0]]),
+	(MatrixLayout.rowMajor(3, 2).mirrored(), [[2, 1, 0], [5, 4, 3]]),
+	(MatrixLayout.rowMajor(3, 2).mirrored(horizontal=False), [[3, 4, 5], [0, 1, 2]]),
+], ids=["column major", "column serpentine", "tiled", "tiled serpentine",
+	"rotated", "rotated 180", "mirrored", "mirrored vertically"])
+def test_layouts(layout, wiring):
+	assert layout.wiring.tolist() == wiring
+
+
+def test_index_map_puts_pixels_on_their_leds(loop):
+	layout = MatrixLayout([[0, 3, 4], [1, 2, 5]])
+	image = frame(3, 2)
+
+	assert layout.indexMap().tolist() == [0, 3, 4, 1, 2, 5]
+
+	leds = output(loop, image, layout=layout)
+	pixels = image.reshape(-1, 3)
+
+	for y, x in np.ndindex(2, 3):
+		assert (leds[layout.wiring[y, x]] == pixels[y * 3 + x]).all()
+
+
+wiring = [[1, 0, 2], [5, 4, 3]]
+
+
+@pytest.mark.parametrize("name, write", [
+	("layout.json", lambda path: path.write_text(json.dumps(wiring))),
+	("wrapped.json", lambda path: path.write_text(json.dumps({"wiring": wiring}))),
+	("layout.npy", lambda path: np.save(str(path), np.array(wiring))),
+	("layout.txt", lambda path: path.write_text("1 0 2\n5 4 3\n")),
+])
+def test_load(tmp_path, name, write):
+	path = tmp_path / name
+	write(path)
+
+	layout = MatrixLayout.load(str(path))
+
+	assert layout.wiring.tolist() == wiring
+	assert (layout.width, layout.height) == (3, 2)
+
+
+@pytest.mark.parametrize("bad", [
+	[0, 1, 2],
+	[[0, 0], [1, 2]],
+	[[0, 1], [2, 4]],
+], ids=["1d", "duplicate", "missing"])
+def test_invalid_wiring(bad):
+	with pytest.raises(ValueError):
+		MatrixLayout(bad)
+
+
+def test_layout_must_match_the_matrix(loop):
+	with pytest.raises(ValueError):
+		Matrix(FrameRecorder(loop), 4, 3, loop=loop, layout=MatrixLayout.rowMajor(3, 4))
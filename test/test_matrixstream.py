@@ -0,0 +1,132 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from photons.matrixstream import areaDownscale, RawVideoReader, MatrixStream
+from photons.virtualclock import virtualLoop
+
+
+@pytest.fixture
+def loop():
+	with virtualLoop() as loop:
+		yield loop
+
+
+class FakeMatrix:
+	def __init__(self, width=2, height=2, fps=30):
+		self.width = width
+		self.height = height
+		self.fps = fps
+		self.frames = []
+
+	def update(self, frame):
+		self.frames.append(frame)
+
+
+class CountingSource:
+	"""numFrames 4x4 frames filled with their index.  Counts reads"""
+
+	def __init__(self, numFrames):
+		self.numFrames = numFrames
+		self.reads = []
+
+	def __len__(self):
+		return self.numFrames
+
+	def __getitem__(self, index):
+		self.reads.append(index)
+		return np.full((4, 4, 3), index, np.uint8)
+
+
+def test_downscale_is_the_block_mean():
+	frame = np.arange(16 * 3, dtype=np.uint8).reshape(4, 4, 3)
+
+	resized = areaDownscale(frame, 2, 2)
+
+	for y, x in itertools.product(range(2), range(2)):
+		block = frame[2 * y:2 * y + 2, 2 * x:2 * x + 2].reshape(-1, 3)
+		assert (resized[y, x] == np.rint(block.mean(axis=0))).all()
+
+
+def test_downscale_weighs_partial_pixels():
+	# 3 -> 2: the middle pixel is split between both outputs
+	frame = np.array([[[0, 0, 0], [90, 90, 90], [180, 180, 180]]], np.uint8)
+
+	resized = areaDownscale(frame, 2, 1)
+
+	assert resized[0, :, 0].tolist() == [30, 150]
+
+
+def test_same_size_is_a_writable_copy():
+	frame = np.zeros((2, 2, 3), np.uint8)
+	frame.setflags(write=False)
+
+	resized = areaDownscale(frame, 2, 2)
+	resized[0, 0] = 1
+
+	assert not frame.any()
+
+
+def test_raw_video_reader(tmp_path):
+	frames = np.random.default_rng(35).integers(0, 256, (3, 2, 4, 3), np.uint8)
+	path = tmp_path / "video.rgb"
+	path.write_bytes(frames.tobytes() + b"partial")
+
+	reader = RawVideoReader(str(path), 4, 2)
+
+	assert len(reader) == 3
+	assert (reader[2] == frames[2]).all()
+
+
+def test_cache_hits_and_eviction(loop):
+	source = CountingSource(4)
+	stream = MatrixStream(FakeMatrix(), source, cache_size=2, loop=loop)
+
+	assert stream._cached(0)[0, 0, 0] == 0
+	stream._cached(1)
+	stream._cached(0)
+	assert source.reads == [0, 1]
+
+	# 1 is the least recently used
+	stream._cached(2)
+	assert list(stream.cache) == [0, 2]
+
+	stream._cached(1)
+	assert source.reads == [0, 1, 2, 1]
+
+
+def test_repeat_loops_over_the_source(loop):
+	stream = MatrixStream(FakeMatrix(), CountingSource(3), loop=loop)
+
+	frames = itertools.islice(stream._frames(), 7)
+
+	assert [frame[0, 0, 0] for frame in frames] == [0, 1, 2, 0, 1, 2, 0]
+
+
+@pytest.mark.parametrize("repeat", [True, False])
+def test_empty_source_finishes(loop, repeat):
+	stream = MatrixStream(FakeMatrix(), CountingSource(0), repeat=repeat, loop=loop)
+
+	stream.start()
+	stream.thread.join(timeout=1)
+
+	assert not stream.thread.is_alive()
+	assert stream.finished
+
+	loop.advanceFrames(1, stream.matrix.fps)
+	assert not stream.running
+
+
+def test_prefetched_frames_play_once_without_repeat(loop):
+	matrix = FakeMatrix()
+	stream = MatrixStream(matrix, CountingSource(3), repeat=False, loop=loop)
+
+	stream.start()
+	stream.thread.join(timeout=1)
+	assert stream.finished
+
+	loop.advanceFrames(5, matrix.fps)
+
+	assert [frame[0, 0, 0] for frame in matrix.frames] == [0, 1, 2]
+	assert not stream.running
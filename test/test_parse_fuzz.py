@@ -0,0 +1,198 @@
+import struct
+import zlib
+
+import numpy as np
+import pytest
+
+from photons import LightArray2, DummyDriver
+from photons.lightprotocol import LightProtocol, LightProtocolException, \
+	InvalidCommandException, InvalidMessageLength, CostLimitExceeded, \
+	CorruptPayloadException
+from photons.lightserver import LightServer, CostLimiter
+from photons.virtualclock import virtualLoop
+
+numLeds = 300
+
+
+@pytest.fixture
+def loop():
+	with virtualLoop() as loop:
+		yield loop
+
+
+@pytest.fixture
+def parser(loop):
+	leds = LightArray2(numLeds, DummyDriver(), loop=loop)
+	parser = LightProtocol(leds=leds)
+	parser.max_cost = 16 * numLeds + 1024
+	return parser
+
+
+def v1(payload):
+	return bytearray(struct.pack('<BH', 1, len(payload))) + payload
+
+
+def v2(payload, flags=0, length=None):
+	if length is None:
+		length = len(payload)
+	return bytearray(struct.pack('<BBI', 2, flags, length)) + payload
+
+
+def command(cmd, fmt="", *args):
+	return bytearray([cmd]) + struct.pack("<" + fmt, *args)
+
+
+"""hand written adversarial messages and the exception each must raise"""
+corpus = [
+	("empty", bytearray(), InvalidMessageLength),
+	("short header", bytearray([2, 0, 1]), InvalidMessageLength),
+	("bytes past length", v1(bytearray([3])) + bytearray([1, 1]), None),
+	("huge declared length", v2(bytearray([3]), length=0xffffffff), InvalidMessageLength),
+	("unknown command", v1(command(0xff)), InvalidCommandException),
+	("setColor huge count", v1(command(0x01, "HHBBB", 0xffff, 0, 1, 2, 3)), InvalidMessageLength),
+	("setColor id past end", v1(command(0x01, "HHBBB", 1, 0xffff, 1, 2, 3)), None),
+	("setColor truncated", v1(command(0x01, "H", 1)), InvalidMessageLength),
+	("setSeries whole range", v1(command(0x07, "HHBBB", 0, 0xffff, 1, 2, 3)), None),
+	("setSeries past end", v1(command(0x07, "HHBBB", 0xffff, 0xffff, 1, 2, 3)), None),
+	("setSeries truncated", v1(command(0x07, "HH", 0, 10)), InvalidMessageLength),
+	("setRange huge count", v1(command(0x08, "HH", 0, 0xffff) + bytearray(30)), InvalidMessageLength),
+	("setRange past end", v1(command(0x08, "HH", numLeds - 1, 10) + bytearray(30)), None),
+	("setPalette bad bits", v1(command(0x09, "HHBB", 0, 4, 3, 2) + bytearray(8)), InvalidCommandException),
+	("setPalette bad index", v1(command(0x09, "HHBB", 0, 1, 8, 1) + bytearray([1, 2, 3, 200])), InvalidCommandException),
+	("setPalette truncated", v1(command(0x09, "HHBB", 0, 0xffff, 8, 0)), InvalidMessageLength),
+	("setAll truncated", v1(command(0x06, "B", 1)), InvalidMessageLength),
+	("setNumPixels truncated", v1(command(0x02)), InvalidMessageLength),
+	("setDebug truncated", v1(command(0x05)), InvalidMessageLength),
+	("many clears", v2(bytearray([3]) * 100000), CostLimitExceeded),
+	("many series", v2(command(0x07, "HHBBB", 0, 0xffff, 1, 2, 3) * 10000), CostLimitExceeded),
+	("deflate bomb", v2(bytearray(zlib.compress(bytes(8 << 20), 9)), flags=1), InvalidMessageLength),
+	("corrupt deflate", v2(bytearray(b"not deflate"), flags=1), LightProtocolException),
+	("truncated deflate", v2(bytearray(zlib.compress(bytes([3]) * 100)[:-4]), flags=1), CorruptPayloadException),
+	("unknown flags", v2(bytearray([3]), flags=0x80), LightProtocolException),
+	("nested keyframes", v1(command(0x0A, "HI", 1, 7) + command(0x0A, "HI", 2, 0)), InvalidCommandException),
+	("keyframe truncated", v1(command(0x0A, "HI", 1, 100)), InvalidMessageLength),
+	("delta without keyframe", v1(command(0x0B, "HI", 5, 1) + bytearray([3])), None),
+]
+
+
+def boundedParse(parser, message):
+	"""parse, and check the work done stayed within the cost limit"""
+	try:
+		parser.parse(message)
+	finally:
+		# one command may be charged before it is rejected
+		assert parser.cost <= parser.max_cost + 0xffff
+
+
+@pytest.mark.parametrize("name,message,exception", corpus, ids=[c[0] for c in corpus])
+def test_corpus(parser, name, message, exception):
+	if exception is None:
+		boundedParse(parser, message)
+	else:
+		with pytest.raises(exception):
+			boundedParse(parser, message)
+
+	assert parser.leds.ledsData.shape == (numLeds, 3)
+
+
+def test_series_is_clamped(parser):
+	parser.parse(v1(command(0x07, "HHBBB", numLeds - 2, 0xffff, 1, 2, 3)))
+
+	assert parser.cost == 3
+	assert (parser.leds.ledsData[-2:] == [1, 2, 3]).all()
+	assert (parser.leds.ledsData[:-2] == 0).all()
+
+
+def test_server_grows_array(loop):
+	leds = LightArray2(60, DummyDriver(), loop=loop)
+	server = LightServer(leds, port=0)
+	server.startProcessing()
+
+	encoder = LightProtocol()
+	server.queue_frame(encoder.writeHeader(b"".join([
+		encoder.SetNumPixels(2000), encoder.setAllColor([1, 2, 3])])))
+	loop.advanceFrames(1, leds.fps)
+
+	assert leds.ledArraySize == 2000
+	assert (leds.ledsData == [1, 2, 3]).all()
+
+
+def test_resizes_are_capped(parser):
+	with pytest.raises(CostLimitExceeded):
+		parser.parse(v2(command(0x02, "H", 0xffff) * 2))
+
+
+def validMessages(rng):
+	encoder = LightProtocol()
+	messages = []
+
+	for i in range(20):
+		frame = rng.integers(0, 256, (numLeds, 3), dtype=np.uint8)
+		if i % 3 == 0:
+			frame[:] = frame[0]
+		elif i % 3 == 1:
+			frame = rng.integers(0, 4, numLeds)[:, None] * np.uint8(60) + frame[:1]
+
+		messages.append(encoder.writeHeader(encoder._encodeFramePayload(frame)))
+
+	return messages
+
+
+def test_mutations(parser):
+	"""
+	random byte flips, truncations and splices of valid messages.  Every
+	one either parses or raises a LightProtocolException, within the cost
+	limit
+	"""
+	rng = np.random.default_rng(46)
+	messages = validMessages(rng)
+
+	for i in range(2000):
+		message = bytearray(messages[rng.integers(len(messages))])
+
+		for flip in range(rng.integers(1, 8)):
+			message[rng.integers(len(message))] = rng.integers(256)
+
+		if rng.random() < 0.3:
+			message = message[:rng.integers(len(message))]
+
+		if rng.random() < 0.3:
+			other = messages[rng.integers(len(messages))]
+			message = message + other[rng.integers(len(other)):]
+
+		try:
+			boundedParse(parser, message)
+		except LightProtocolException:
+			pass
+
+
+def test_cost_limiter():
+	limiter = CostLimiter(rate=10, burst=10)
+
+	assert limiter.allow("a", 0)
+	limiter.spend("a", 15, 0)
+
+	assert not limiter.allow("a", 0.4)
+	assert limiter.allow("b", 0.4)
+	assert limiter.allow("a", 0.6)
+
+
+def test_server_rate_limits_clients(loop):
+	leds = LightArray2(10, DummyDriver(), fps=10, loop=loop)
+	server = LightServer(leds, port=0, cost_rate=2)
+	server.startProcessing()
+
+	encoder = LightProtocol()
+	fill = encoder.writeHeader(encoder.setAllColor([1, 2, 3]))
+
+	# 3 frames of work from "a" spends its 2 frame burst and then some
+	server.queue_frame(v1(command(0x06, "BBB", 1, 2, 3) * 3), "a")
+	loop.advanceFrames(1, leds.fps)
+
+	server.queue_frame(fill, "a")
+	server.queue_frame(fill, "b")
+	assert server.queue.qsize() == 1
+
+	loop.advance(1)
+	server.queue_frame(fill, "a")
+	assert server.queue.qsize() == 1
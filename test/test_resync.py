@@ -0,0 +1,138 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from photons import LightArray2, DummyDriver
+from photons.lightclient import LightClient
+from photons.lightprotocol import LightProtocol
+from photons.lightserver import LightServer
+from photons.virtualclock import virtualLoop
+
+numLeds = 50
+
+
+@pytest.fixture
+def loop():
+	with virtualLoop() as loop:
+		yield loop
+
+
+@pytest.fixture
+def leds(loop):
+	leds = LightArray2(numLeds, DummyDriver(), loop=loop)
+	leds.ledsData[:] = np.random.default_rng(48).integers(0, 256, (numLeds, 3))
+	return leds
+
+
+def ask(leds, request, max_reply_length=None):
+	"""parse request on a server parser and the reply on a client"""
+	server = LightProtocol(leds=leds)
+	server.max_reply_length = max_reply_length
+	replies = []
+	server.reply = replies.append
+	server.parse(request)
+
+	client = LightProtocol()
+	received = {}
+	client.onFrameSnapshot = lambda frame: received.update(frame=frame)
+	client.onFrameHash = lambda n, digest: received.update(hash=(n, digest))
+	client.parse(replies[0])
+
+	return received, len(replies[0])
+
+
+def test_baseline_is_per_instance(leds):
+	a = LightProtocol()
+	b = LightProtocol()
+	a.update(leds.ledsData)
+
+	assert b.ledsDataCopy is None
+
+
+def test_snapshot(leds):
+	request = LightProtocol()
+	received, size = ask(leds, request.writeHeader(request.getFrame()))
+
+	assert (received["frame"] == leds.ledsData).all()
+
+
+def test_snapshot_is_compact(leds):
+	leds.ledsData[:] = [1, 2, 3]
+	request = LightProtocol()
+	received, size = ask(leds, request.writeHeader(request.getFrame()))
+
+	assert (received["frame"] == [1, 2, 3]).all()
+	assert size < 20
+
+
+def test_hash(leds):
+	request = LightProtocol()
+	received, size = ask(leds, request.writeHeader(request.getFrame(hashOnly=True)))
+
+	assert received["hash"] == (numLeds, LightProtocol.hashFrame(leds.ledsData))
+
+
+def test_oversized_snapshot_falls_back_to_hash(leds):
+	request = LightProtocol()
+	received, size = ask(leds, request.writeHeader(request.getFrame()), max_reply_length=20)
+
+	assert "frame" not in received
+	assert received["hash"][0] == numLeds
+
+
+def connect(loop, leds, **kwargs):
+	server = LightServer(leds, port=0, iface="127.0.0.1")
+	server.start()
+	port = server.server.sockets[0].getsockname()[1]
+
+	client = LightClient("127.0.0.1", port, loop=loop, fps=leds.fps, **kwargs)
+
+	for i in range(100):
+		loop.run_until_complete(asyncio.sleep(0))
+		if client.connected:
+			break
+
+	return server, client
+
+
+def settle(loop, frames=5):
+	"""let real socket io and virtual timers interleave"""
+	for i in range(frames * 10):
+		loop.advance(0.1 / 30)
+
+
+def test_client_resyncs_on_connect(loop, leds):
+	server, client = connect(loop, leds, latest_frame=True, resync=True)
+	settle(loop)
+
+	assert not client.resync_pending
+	assert (client.ledsDataCopy == leds.ledsData).all()
+
+	# the next frame goes out as a true delta
+	frame = leds.ledsData.copy()
+	frame[7] = [1, 2, 3]
+	sent = []
+	client.writer.write = sent.append
+	client.update(frame, force=True)
+
+	assert len(sent[0]) < 20
+
+	client.close()
+	server.close()
+
+
+def test_wrong_baseline_is_replaced(loop, leds):
+	server, client = connect(loop, leds, latest_frame=True, resync=True)
+	settle(loop)
+
+	# the server changed behind the client's back
+	leds.ledsData[3] = [9, 9, 9]
+	client.requestResync()
+	settle(loop)
+
+	assert not client.resync_pending
+	assert (client.ledsDataCopy == leds.ledsData).all()
+
+	client.close()
+	server.close()
@@ -0,0 +1,103 @@
+import asyncio
+import os
+import time
+
+import numpy as np
+import pytest
+
+from photons.segmentrenderer import SegmentedRenderer
+from photons.sharedmemory import SharedFrameBuffer
+
+
+class Fill:
+	"""frame number in red.  Segment failAt of frame failFrame raises"""
+
+	def __init__(self, failFrame=None, failAt=None):
+		self.failFrame = failFrame
+		self.failAt = failAt
+
+	def __call__(self, frame, start, length):
+		if frame == self.failFrame and start == self.failAt:
+			raise RuntimeError("render failed")
+
+		colors = np.zeros((length, 3), np.uint8)
+		colors[:, 0] = frame + 1
+		return colors
+
+
+@pytest.fixture
+def loop():
+	loop = asyncio.new_event_loop()
+	yield loop
+	loop.close()
+
+
+def test_failed_frame_is_not_published(loop):
+	renderer = SegmentedRenderer(Fill(failFrame=1, failAt=0), 8, segments=2,
+		name="photons-test-segments", loop=loop)
+
+	try:
+		loop.run_until_complete(renderer.renderFrame())
+		assert (renderer.framebuffer.frame()[1][:, 0] == 1).all()
+
+		with pytest.raises(RuntimeError):
+			loop.run_until_complete(renderer.renderFrame())
+
+		# the previous frame, whole, is what readers see
+		assert renderer.framebuffer.seq % 2 == 0
+		assert (renderer.framebuffer.frame()[1][:, 0] == 1).all()
+	finally:
+		renderer.close()
+
+
+def test_abort_write_keeps_previous_frame():
+	framebuffer = SharedFrameBuffer("photons-test-abort", 4, create=True)
+
+	try:
+		framebuffer.write(np.full((4, 3), 7, np.uint8))
+		framebuffer.buffers[framebuffer.beginWrite()][:2] = 9
+		framebuffer.abortWrite()
+
+		frame, data = framebuffer.frame()
+		assert frame == 2
+		assert (data == 7).all()
+	finally:
+		framebuffer.close()
+		framebuffer.unlink()
+
+
+class Slow:
+	"""frame number in red, after delay seconds"""
+
+	def __init__(self, delay):
+		self.delay = delay
+
+	def __call__(self, frame, start, length):
+		time.sleep(self.delay if frame else 0)
+
+		colors = np.zeros((length, 3), np.uint8)
+		colors[:, 0] = frame + 1
+		return colors
+
+
+def test_cancelled_frame_waits_for_workers(loop):
+	renderer = SegmentedRenderer(Slow(0.3), 8, segments=2,
+		name="photons-test-segments-{}".format(os.getpid()), loop=loop)
+
+	try:
+		loop.run_until_complete(renderer.renderFrame())
+
+		task = loop.create_task(renderer.renderFrame())
+		loop.run_until_complete(asyncio.sleep(0.1))
+		task.cancel()
+
+		with pytest.raises(asyncio.CancelledError):
+			loop.run_until_complete(task)
+
+		# workers were done before the previous frame was republished
+		loop.run_until_complete(asyncio.sleep(0.4))
+
+		assert renderer.framebuffer.seq % 2 == 0
+		assert (renderer.framebuffer.frame()[1][:, 0] == 1).all()
+	finally:
+		renderer.close()
@@ -0,0 +1,69 @@
+import os
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import pytest
+
+from photons.sharedmemory import SharedMemoryDriver, SharedMemoryLightArray
+from photons.virtualclock import virtualLoop, FrameRecorder
+
+name = "photons-test-shm-{}".format(os.getpid())
+
+
+@pytest.fixture
+def loop():
+	with virtualLoop() as loop:
+		yield loop
+
+
+def test_stale_segment_is_replaced():
+	# what a producer that crashed leaves behind
+	stale = shared_memory.SharedMemory(name=name, create=True, size=16)
+	stale.close()
+	resource_tracker.unregister(stale._name, "shared_memory")
+
+	driver = SharedMemoryDriver(name=name)
+	driver.update(np.full((4, 3), 5, np.uint8))
+
+	assert driver.framebuffer.ledArraySize == 4
+
+	driver.close()
+
+
+def test_reader_in_creating_process(loop):
+	driver = SharedMemoryDriver(name=name, ledArraySize=4)
+	driver.update(np.full((4, 3), 5, np.uint8))
+
+	recorder = FrameRecorder(loop)
+	reader = SharedMemoryLightArray(name, recorder, loop=loop)
+	loop.advanceFrames(1, reader.fps)
+
+	assert (recorder.last == 5).all()
+
+	reader.close()
+	driver.close()
+
+
+def test_master_controls_apply_while_the_producer_is_idle(loop):
+	driver = SharedMemoryDriver(name=name, ledArraySize=4)
+	driver.update(np.full((4, 3), 200, np.uint8))
+
+	recorder = FrameRecorder(loop)
+	reader = SharedMemoryLightArray(name, recorder, loop=loop)
+	loop.advanceFrames(2, reader.fps)
+	assert len(recorder) == 1
+
+	reader.masterBrightness = 0.5
+	loop.advanceFrames(1, reader.fps)
+	assert (recorder.last == 100).all()
+
+	reader.blackout = True
+	loop.advanceFrames(1, reader.fps)
+	assert not recorder.last.any()
+
+	# nothing changed, nothing sent
+	loop.advanceFrames(2, reader.fps)
+	assert len(recorder) == 3
+
+	reader.close()
+	driver.close()
@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+
+from photons import LightArray2, DummyDriver
+from photons.layers import LayerStack, BlendMode
+from photons.sprites import SpriteLayer, Edge, Profile
+from photons.virtualclock import virtualLoop
+
+numLeds = 10
+
+
+@pytest.fixture
+def loop():
+	with virtualLoop() as loop:
+		yield loop
+
+
+@pytest.fixture
+def stack(loop):
+	leds = LightArray2(numLeds, DummyDriver(), loop=loop)
+	return LayerStack(leds, loop=loop)
+
+
+def test_flat_sprite_is_antialiased():
+	layer = SpriteLayer(numLeds)
+	layer.addSprite(position=2.25, width=1, color=(200, 100, 0))
+	layer.rasterize()
+
+	assert layer.colors[1].tolist() == [50, 25, 0]
+	assert layer.colors[2].tolist() == [150, 75, 0]
+	assert not layer.colors[3:].any() and not layer.colors[:1].any()
+
+
+def test_overlapping_sprites_add():
+	layer = SpriteLayer(numLeds)
+	layer.addSprite(position=4.5, color=(100, 0, 0))
+	layer.addSprite(position=4.5, color=(0, 0, 60))
+	layer.rasterize()
+
+	assert layer.colors[4].tolist() == [100, 0, 60]
+
+
+def test_sprites_bounce_and_wrap():
+	layer = SpriteLayer(numLeds)
+	bouncing = layer.addSprite(position=numLeds - 1, velocity=1.5, width=2)
+	wrapping = layer.addSprite(position=numLeds - 0.5, velocity=1, edge=Edge.Wrap)
+
+	layer.render()
+
+	assert bouncing.velocity < 0
+	assert bouncing.position + bouncing.width / 2 <= numLeds
+	assert wrapping.position == 0.5
+
+
+def test_trail_fades_behind_the_sprite():
+	layer = SpriteLayer(numLeds)
+	layer.addSprite(position=6.5, velocity=1, color=(255, 255, 255), trail=0.5)
+	layer.rasterize()
+
+	red = layer.colors[:, 0]
+
+	assert red[6] == 255
+	assert red[5] == pytest.approx(255 * 0.5 ** 0.5)
+	assert red[4] == pytest.approx(255 * 0.5 ** 1.5)
+	assert (np.diff(red[:7]) >= 0).all()
+	assert not red[7:].any()
+
+
+def test_triangle_profile_peaks_at_the_center():
+	layer = SpriteLayer(numLeds)
+	layer.addSprite(position=5, width=4, profile=Profile.Triangle, color=(200, 0, 0))
+	layer.rasterize()
+
+	red = layer.colors[:, 0]
+
+	assert red[4] == red[5] == 150
+	assert red[3] == red[6] == 50
+
+
+def test_sprites_composite_in_layer_order(stack):
+	background = stack.addLayer()
+	background.fill([0, 0, 100])
+	sprites = stack.addLayer(SpriteLayer(numLeds))
+	sprites.addSprite(position=1.5, velocity=0, color=(255, 0, 0))
+	cover = stack.addLayer(opacity=0.5)
+	cover.fill([0, 200, 0])
+
+	stack.flatten()
+
+	assert stack.leds.ledsData[1].tolist() == [128, 100, 50]
+	assert stack.leds.ledsData[0].tolist() == [0, 100, 50]
+
+	# sprites on top are not covered
+	stack.removeLayer(cover)
+	stack.addLayer(cover)
+	stack.removeLayer(sprites)
+	stack.addLayer(sprites)
+
+	stack.flatten()
+
+	assert stack.leds.ledsData[1].tolist() == [255, 100, 50]
+	assert stack.leds.ledsData[0].tolist() == [0, 100, 50]
+
+
+def test_sprite_layer_blends_with_max(stack):
+	stack.addLayer().fill([100, 100, 100])
+	sprites = stack.addLayer(SpriteLayer(numLeds))
+	sprites.addSprite(position=3.5, velocity=0, color=(255, 50, 0))
+
+	stack.flatten()
+
+	assert stack.leds.ledsData[3].tolist() == [255, 100, 100]
+	assert (stack.leds.ledsData[4:] == 100).all()
+	assert sprites.blend == BlendMode.Max
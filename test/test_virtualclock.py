@@ -0,0 +1,101 @@
+import pytest
+
+from photons import LightArray2, ColorTransformAnimation, Delay
+from photons.lightprotocol import LightProtocol
+from photons.lightserver import LightServer
+from photons.virtualclock import virtualLoop, FrameRecorder
+
+
+@pytest.fixture
+def loop():
+	with virtualLoop() as loop:
+		yield loop
+
+
+def promiseDone(promise):
+	done = []
+	promise.then(lambda: done.append(True))
+	return done
+
+
+def test_advance_is_instant_and_exact(loop):
+	loop.advance(3600)
+
+	assert loop.time() == pytest.approx(3600)
+
+
+def test_fps_loop_only_writes_changed_frames(loop):
+	recorder = FrameRecorder(loop)
+	leds = LightArray2(4, recorder, fps=30, loop=loop)
+
+	leds.changeColor(1, [255, 0, 0])
+	loop.advanceFrames(10, leds.fps)
+
+	assert len(recorder) == 1
+	assert recorder.times[0] == 0
+	assert (recorder.last[1] == [255, 0, 0]).all()
+
+	leds.changeColor(2, [0, 255, 0])
+	loop.advanceFrames(1, leds.fps)
+
+	assert len(recorder) == 2
+	assert recorder.times[1] == pytest.approx(11 / 30.0)
+
+
+@pytest.mark.parametrize("fps", [10, 24, 30, 60, 120])
+@pytest.mark.parametrize("time", [100, 500, 1000, 2500])
+def test_color_transform_takes_its_frame_count(loop, fps, time):
+	recorder = FrameRecorder(loop)
+	leds = LightArray2(3, recorder, fps=fps, loop=loop)
+
+	animation = ColorTransformAnimation(leds)
+	animation.addAnimation(0, [255, 100, 0], time)
+	animation.addAnimation(2, [0, 0, 255], time)
+	done = promiseDone(animation.start())
+
+	numFrames = max(int(fps * time / 1000.0), 1)
+
+	loop.advanceFrames(numFrames - 1, fps)
+	assert not done
+	assert recorder.last is None or (recorder.last[0] != [255, 100, 0]).any()
+
+	loop.advanceFrames(1, fps)
+	assert done
+	assert (recorder.last == [[255, 100, 0], [0, 0, 0], [0, 0, 255]]).all()
+
+
+def test_delay(loop):
+	done = promiseDone(Delay(500).start())
+
+	loop.advance(0.499)
+	assert not done
+
+	loop.advance(0.001)
+	assert done
+
+
+def test_server_parses_everything_queued_each_frame(loop):
+	leds = LightArray2(3, FrameRecorder(loop), fps=20, loop=loop)
+	server = LightServer(leds, port=0)
+	server.startProcessing()
+
+	encoder = LightProtocol()
+
+	def queueColors(value):
+		for i in range(3):
+			server.queue_frame(encoder.writeHeader(encoder.setColor(i, bytes([255, i, value]))))
+
+	queueColors(0)
+	loop.advanceFrames(0, leds.fps)
+
+	assert server.queue.qsize() == 0
+	assert (leds.ledsData == [[255, 0, 0], [255, 1, 0], [255, 2, 0]]).all()
+
+	# everything queued while waiting is parsed on the next frame
+	queueColors(1)
+	queueColors(2)
+	assert server.queue.qsize() == 6
+
+	loop.advanceFrames(1, leds.fps)
+	assert server.queue.qsize() == 0
+	assert (leds.ledsData == [[255, 0, 2], [255, 1, 2], [255, 2, 2]]).all()